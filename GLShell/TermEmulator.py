@@ -35,6 +35,7 @@ and background color. New sequences from Xterm and the Linux terminal are added.
 from __future__ import print_function
 
 import os
+import re
 import sys
 import pty
 import select
@@ -152,14 +153,73 @@ class V102Terminal:
                             # Parameter is two chars if it starts with '%' or '"',
                             # else it is one character.
 
+    __ESC_ST = '\\'         # Non-CSI: String terminator (ends OSC / DCS).
+
     # A large number of extended escape sequences have the form:
-    # '\x1b' <params> [ '\x07', '\x1b\\' ]
+    # '\x1b]' <kind> ';' <params> [ '\x07', '\x1b\\' ]
     #
     # These are almost all new sequences which were added by Xterm and
-    # modern terminals.  These sequences are better distinguished by
-    # their starting characters rather than by their ending character.
+    # modern terminals (OSC).  These sequences are better distinguished by
+    # their kind rather than by their ending character.
+
+    __EX_ICON_TITLE = '0'   # Set icon name and terminal title.
+
+    # Escape sequence parser states, in the style of the DEC VT500 parser
+    # state diagram (https://vt100.net/emu/dec_ansi_parser). The CSI entry,
+    # param and intermediate states are merged, as the CSI handlers parse
+    # their own parameters.
+    __STATE_GROUND = 0      # Printable text and C0 controls.
+    __STATE_ESCAPE = 1      # After ESC.
+    __STATE_ESCAPE_INTER = 2# After ESC and one or more intermediates.
+    __STATE_CSI = 3         # After ESC [ or CSI; collecting params.
+    __STATE_OSC = 4         # After ESC ]; collecting until BEL or ST.
+    __STATE_STRING = 5      # After ESC P, X, ^ or _; ignored until BEL or ST.
+
+    # Escape sequence parser actions.
+    __ACT_IGNORE = 0        # Drop the character.
+    __ACT_EXECUTE = 1       # Run the C0 control character handler.
+    __ACT_COLLECT = 2       # Append to the collected params / intermediates.
+    __ACT_ENTER = 3         # Clear the collected characters.
+    __ACT_ESC_DISPATCH = 4  # Run an ESC handler.
+    __ACT_CSI_DISPATCH = 5  # Run a CSI handler.
+    __ACT_OSC_END = 6       # Run an OSC handler.
+    __ACT_STRING_END = 7    # Finish an ignored control string.
 
-    __EX_ICON_TITLE = ']0;' # Set icon name and terminal title.
+    # Parser state table: (first char, last char, action, next state). Later
+    # entries override earlier ones; characters above 0xff use the 0xff entry.
+    __PARSER_ANYWHERE = ( (0x1b, 0x1b, __ACT_ENTER,  __STATE_ESCAPE),
+                          (0x9b, 0x9b, __ACT_ENTER,  __STATE_CSI), )
+    # CAN and SUB abort any sequence, control strings included.
+    __PARSER_ABORT = ( (0x18, 0x18, __ACT_IGNORE, __STATE_GROUND),
+                       (0x1a, 0x1a, __ACT_IGNORE, __STATE_GROUND), )
+    __PARSER_TABLE = {
+        __STATE_ESCAPE:       ( (0x00, 0x1f, __ACT_EXECUTE,      __STATE_ESCAPE),
+                                (0x20, 0x2f, __ACT_COLLECT,      __STATE_ESCAPE_INTER),
+                                (0x30, 0x7e, __ACT_ESC_DISPATCH, __STATE_GROUND),
+                                (0x50, 0x50, __ACT_ENTER,        __STATE_STRING),
+                                (0x58, 0x58, __ACT_ENTER,        __STATE_STRING),
+                                (0x5b, 0x5b, __ACT_ENTER,        __STATE_CSI),
+                                (0x5d, 0x5d, __ACT_ENTER,        __STATE_OSC),
+                                (0x5e, 0x5f, __ACT_ENTER,        __STATE_STRING),
+                                (0x7f, 0xff, __ACT_IGNORE,       __STATE_ESCAPE), ),
+        __STATE_ESCAPE_INTER: ( (0x00, 0x1f, __ACT_EXECUTE,      __STATE_ESCAPE_INTER),
+                                (0x20, 0x2f, __ACT_COLLECT,      __STATE_ESCAPE_INTER),
+                                (0x30, 0x7e, __ACT_ESC_DISPATCH, __STATE_GROUND),
+                                (0x7f, 0xff, __ACT_IGNORE,       __STATE_ESCAPE_INTER), ),
+        __STATE_CSI:          ( (0x00, 0x1f, __ACT_EXECUTE,      __STATE_CSI),
+                                (0x20, 0x3f, __ACT_COLLECT,      __STATE_CSI),
+                                (0x40, 0x7e, __ACT_CSI_DISPATCH, __STATE_GROUND),
+                                (0x7f, 0xff, __ACT_IGNORE,       __STATE_CSI), ),
+        __STATE_OSC:          ( (0x00, 0x1f, __ACT_IGNORE,       __STATE_OSC),
+                                (0x07, 0x07, __ACT_OSC_END,      __STATE_GROUND),
+                                (0x20, 0xff, __ACT_COLLECT,      __STATE_OSC),
+                                (0x1b, 0x1b, __ACT_OSC_END,      __STATE_ESCAPE), ),
+        __STATE_STRING:       ( (0x00, 0xff, __ACT_IGNORE,       __STATE_STRING),
+                                (0x07, 0x07, __ACT_STRING_END,   __STATE_GROUND),
+                                (0x1b, 0x1b, __ACT_STRING_END,   __STATE_ESCAPE), ),
+    }
+    # States whose own table entries take precedence over __PARSER_ANYWHERE.
+    __PARSER_STRING_STATES = ( __STATE_OSC, __STATE_STRING )
 
     # vt102 modes.
     MODE_KAM     = '2'      # Keyboard action
@@ -202,6 +262,31 @@ class V102Terminal:
     RENDITION_STYLE_FAST_BLINK = 32
     RENDITION_STYLE_INVERSE = 64
     RENDITION_STYLE_HIDDEN = 128
+    # Set when the fg / bg color is an index into the truecolor palette.
+    RENDITION_STYLE_FG_RGB = 256
+    RENDITION_STYLE_BG_RGB = 512
+
+    # SGR parameter to (mask, bits) rendition delta.
+    __SGR_FG = 0x00ff0000 | RENDITION_STYLE_FG_RGB
+    __SGR_BG = 0xff000000 | RENDITION_STYLE_BG_RGB
+    __SGR_CODES = { 0:  (0xffffffff, 0),
+                    22: (RENDITION_STYLE_BOLD | RENDITION_STYLE_DIM, 0),
+                    23: (RENDITION_STYLE_ITALIC, 0),
+                    24: (RENDITION_STYLE_UNDERLINE, 0),
+                    25: (RENDITION_STYLE_SLOW_BLINK | RENDITION_STYLE_FAST_BLINK, 0),
+                    27: (RENDITION_STYLE_INVERSE, 0),
+                    28: (RENDITION_STYLE_HIDDEN, 0),
+                    39: (__SGR_FG | RENDITION_STYLE_UNDERLINE, 0),
+                    49: (__SGR_BG, 0), }
+    for i in range(8):
+        __SGR_CODES[1+i] = (1<<i, 1<<i)
+        __SGR_CODES[30+i] = (__SGR_FG, i<<16)
+        __SGR_CODES[40+i] = (__SGR_BG, i<<24)
+        __SGR_CODES[90+i] = (__SGR_FG, (8+i)<<16)
+        __SGR_CODES[100+i] = (__SGR_BG, (8+i)<<24)
+    del i
+    __SGR_CACHE_MAX = 4096
+    __TRUECOLOR_MAX = 256
 
     CALLBACK_SCROLL_UP_SCREEN = 0
     CALLBACK_UPDATE_LINES = 1
@@ -210,6 +295,7 @@ class V102Terminal:
     CALLBACK_UPDATE_MODE = 4
     CALLBACK_UPDATE_CURSOR = 5
     CALLBACK_SEND_DATA = 6
+    CALLBACK_SCROLL_UP_LINES = 7
 
     def __init__(self, rows, cols):
         """
@@ -228,8 +314,9 @@ class V102Terminal:
         self.printableChars += """!"#$%&'()*+,-./:;<=>?@[\]^_`{|}~ """
         self.printableChars += "\t"
 
-        # unparsed part of last input
-        self.unparsedInput = None
+        # escape sequence parser state, kept across calls to ProcessInput
+        self.parseState = self.__STATE_GROUND
+        self.parseCollect = []
 
         # special character handlers
         self.charHandlers = { self.__ASCII_NUL: self.__OnCharIgnore,
@@ -247,6 +334,32 @@ class V102Terminal:
                               self.__ASCII_SO:  self.__OnCharSO,
                               self.__ASCII_SI:  self.__OnCharSI, }
 
+        # matches a run of characters which have no special handler
+        special = "".join(chr(c) for c in self.charHandlers)
+        self.printableRun = re.compile("[^%s]+"%(re.escape(special)))
+
+        # complete CSI and OSC sequences, lifted out of the input in one step
+        self.csiSequence = re.compile("(?:\x1b\\[|\x9b)([\x20-\x3f]*)([\x40-\x7e])")
+        self.oscSequence = re.compile("\x1b\\]([^\x00-\x1f\x9b]*)(?:\x07|\x1b\\\\)")
+        # runs of characters collected as a whole by the state machine
+        self.csiParamRun = re.compile("[\x20-\x3f]+")
+        self.oscStringRun = re.compile("[^\x00-\x1f\x9b]+")
+        self.ignoreStringRun = re.compile("[^\x07\x18\x1a\x1b\x9b]+")
+
+        # parser state table, expanded to one (action, state) entry per char
+        self.parseTable = {}
+        for state, ranges in self.__PARSER_TABLE.items():
+            if state in self.__PARSER_STRING_STATES:
+                ranges = self.__PARSER_ANYWHERE + ranges
+            else:
+                ranges = ranges + self.__PARSER_ANYWHERE
+            ranges = ranges + self.__PARSER_ABORT
+            table = [ None ] * 256
+            for first, last, action, nextState in ranges:
+                for c in range(first, last + 1):
+                    table[c] = (action, nextState)
+            self.parseTable[state] = table
+
         # escape sequence handlers
         self.escSeqHandlers = { self.__ESCSEQ_ICH_SL:  self.__OnEscSeqICH_SL,
                                 self.__ESCSEQ_CUU:     self.__OnEscSeqCUU,
@@ -299,7 +412,13 @@ class V102Terminal:
                            self.CALLBACK_UPDATE_WINDOW_TITLE: None,
                            self.CALLBACK_UPDATE_MODE: None,
                            self.CALLBACK_UPDATE_CURSOR: None,
-                           self.CALLBACK_SEND_DATA: None, }
+                           self.CALLBACK_SEND_DATA: None,
+                           self.CALLBACK_SCROLL_UP_LINES: None, }
+        # lines scrolled off the screen during ProcessInput
+        self.scrolledLines = []
+        # truecolor palette; kept by Reset(), as history renditions index it
+        self.truePalette = []
+        self.truePaletteIndex = {}
 
         # perform initial reset
         self.Reset()
@@ -310,16 +429,17 @@ class V102Terminal:
     def Reset(self):
         # Screen and rendition arrays.
         self.curRendition = 0
-        self.screen = []
-        self.scrRendition = []
-        for i in range(self.rows):
-            line = array('u')
-            rendition = array('L')
-            for j in range(self.cols):
-                line.append(u' ')
-                rendition.append(0)
-            self.screen.append(line)
-            self.scrRendition.append(rendition)
+        self.sgrCache = {}
+        self.blankLine = array('u', u' ')*self.cols
+        self.blankRendition = array('L', [0])*self.cols
+        self.screen = [ array('u', self.blankLine) for i in range(self.rows) ]
+        self.scrRendition = [ array('L', self.blankRendition) for i in range(self.rows) ]
+        # Soft-wrap flags: non-zero when the row wrapped into the next row.
+        self.lineWrapped = bytearray(self.rows)
+        self.savedWrapped = bytearray(self.rows)
+        # Damage tracking: one byte per row, non-zero when the row changed.
+        self.allDirty = b'\x01'*self.rows
+        self.dirtyRows = bytearray(self.allDirty)
         self.savedScreen = []
         self.savedRendition = []
         for scrl,renl in zip(self.screen, self.scrRendition):
@@ -328,6 +448,7 @@ class V102Terminal:
         # Cursor.
         self.curY = 0
         self.curX = 0
+        self.dirtyCursor = (self.curY, self.curX)
         self.cursorStyle = self.CURSOR_STYLE_DEFAULT
         self.savedCursor = [ (self.curY, self.curX, self.cursorStyle, self.curRendition),
                              (self.curY, self.curX, self.cursorStyle, self.curRendition) ]
@@ -355,67 +476,77 @@ class V102Terminal:
         """
         Returns the screen as a list of array of long. The list will have rows
         no. of array and each array will have columns no. of longs. The first
-        8 bits of long represents rendition style like bold, italics and etc.
-        The next 4 bits represents foreground color and next 4 bits for
-        background color.
+        16 bits of long represents rendition style like bold, italics and etc.
+        The next 8 bits represents foreground color and next 8 bits for
+        background color. If RENDITION_STYLE_FG_RGB or RENDITION_STYLE_BG_RGB
+        is set then the color is an index for GetTrueColor() instead of one
+        of the 256 colors.
         """
         return self.scrRendition
+    def GetTrueColor(self, index):
+        """
+        Returns the (r, g, b) tuple of the given truecolor palette index.
+        """
+        return self.truePalette[index]
     def GetSize(self):
         """
         Returns terminal rows and cols as tuple
         """
         return (self.rows, self.cols)
-    def Resize(self, rows, cols):
+    def GetLineWrapped(self):
+        """
+        Returns a bytearray with one byte per screen row, non-zero when the row
+        was soft-wrapped into the next row at the right margin.
+        """
+        return self.lineWrapped
+    def Resize(self, rows, cols, history=None):
         """
         Resizes the terminal to specified rows and cols.
-        - If the new no. rows is less than existing no. rows then existing rows
-          are deleted at top.
-        - If the new no. rows is greater than existing no. rows then
-          blank rows are added at bottom.
-        - If the new no. cols is less than existing no. cols then existing cols
-          are deleted at right.
-        - If the new no. cols is greater than existing no. cols then new cols
-          are added at right.
-        """
-        new_x = min(max(self.curX, 0), self.cols-1)
-        new_y = min(max(self.curY, 0), self.rows-1)
-        if new_x != self.curX or new_y != self.curY:
-            self.curX = new_x
-            self.curY = new_y
-            self.__Callback(self.CALLBACK_UPDATE_CURSOR_POS)
-        cur_rows = len(self.screen)
-        cur_cols = len(self.screen[0])
-        if rows < cur_rows:
-            # remove rows at top
-            for i in range(cur_rows - rows):
-                self.screen.pop(0)
-                self.scrRendition.pop(0)
-        elif rows > cur_rows:
-            # add blank rows at bottom
-            for i in range(rows - cur_rows):
-                line = array('u')
-                rendition = array('L')
-                for j in range(cur_cols):
-                    line.append(u' ')
-                    rendition.append(0)
-                self.screen.append(line)
-                self.scrRendition.append(rendition)
+        - Lines soft-wrapped at the right margin are reflowed to the new no.
+          of cols; hard line breaks are kept.
+        - If the content no longer fits then lines are pushed off the top into
+          the history; if there is room then lines are pulled back from it.
+        - history is an optional (texts, renditions, wrapped) tuple of lists
+          holding the scrolled off lines, oldest first. It is updated in place.
+        - The alternate screen is not reflowed; it is cut or padded at the
+          bottom and right.
+        The scroll region is kept if it still fits.
+        """
+        if rows == self.rows and cols == self.cols:
+            return
+        if history is None:
+            history = ([], [], [])
+        oldRows = self.rows
         self.rows = rows
-        if cols < cur_cols:
-            # remove cols at right
-            for i in range(self.rows):
-                self.screen[i] = self.screen[i][:cols - cur_cols]
-                for j in range(cur_cols - cols):
-                    self.scrRendition[i].pop(len(self.scrRendition[i]) - 1)
-        elif cols > cur_cols:
-            # add cols at right
-            for i in range(self.rows):
-                for j in range(cols - cur_cols):
-                    self.screen[i].append(u' ')
-                    self.scrRendition[i].append(0)
         self.cols = cols
-        #!!avose: maintain state somehow?
-        self.scrollRegion = (0, self.rows-1)
+        self.blankLine = array('u', u' ')*self.cols
+        self.blankRendition = array('L', [0])*self.cols
+        if self.modes[self.MODE_ALTBUF]:
+            # The primary screen is the saved one; reflow it with its cursor.
+            y, x, style, rendition = self.savedCursor[0]
+            (self.savedScreen, self.savedRendition,
+             self.savedWrapped, y, x) = self.__ReflowBuffer(self.savedScreen,
+                                                            self.savedRendition,
+                                                            self.savedWrapped,
+                                                            y, x, history)
+            self.savedCursor[0] = (y, x, style, rendition)
+            self.__FitBuffer(self.screen, self.scrRendition, self.lineWrapped)
+            self.curX = min(self.curX, self.cols-1)
+            self.curY = min(self.curY, self.rows-1)
+        else:
+            (self.screen, self.scrRendition,
+             self.lineWrapped, self.curY, self.curX) = self.__ReflowBuffer(self.screen,
+                                                                        self.scrRendition,
+                                                                        self.lineWrapped,
+                                                                        self.curY, self.curX,
+                                                                        history)
+            self.__FitBuffer(self.savedScreen, self.savedRendition, self.savedWrapped)
+        self.allDirty = b'\x01'*self.rows
+        self.dirtyRows = bytearray(self.allDirty)
+        top, bottom = self.scrollRegion
+        if bottom == oldRows-1 or bottom >= self.rows:
+            self.scrollRegion = (0, self.rows-1)
+        self.__Callback(self.CALLBACK_UPDATE_CURSOR_POS)
         return
     def GetCursorPos(self):
         """
@@ -455,14 +586,16 @@ class V102Terminal:
             startCol, endCol = endCol, startCol
         for i in range(startRow, endRow + 1):
             start = 0
-            end = self.cols - 1
+            end = self.cols
             if i == startRow:
                 start = startCol
-            elif i == endRow:
-                end = endCol
-            for j in range(start, end + 1):
-                self.screen[i][j] = ' '
-                self.scrRendition[i][j] = 0
+            if i == endRow:
+                end = endCol + 1
+            if end == self.cols:
+                self.lineWrapped[i] = 0
+            self.screen[i][start:end] = self.blankLine[start:end]
+            self.scrRendition[i][start:end] = self.blankRendition[start:end]
+        self.__MarkDirty(startRow, endRow)
         return
     def SetCallback(self, event, func):
         """
@@ -476,7 +609,9 @@ class V102Terminal:
         CALLBACK_UPDATE_LINES
             Called when ever some lines need to be updated. Usually called
             before leaving ProcessInput and before scrolling up the
-            terminal screen.
+            terminal screen. A sorted list of the changed (dirty) row
+            indices will be passed as an argument; rows holding the old and
+            new cursor position are included when the cursor moved.
 
         CALLBACK_UPDATE_CURSOR_POS
             Called to update the cursor position. Usually called before leaving
@@ -497,52 +632,64 @@ class V102Terminal:
         CALLBACK_SEND_DATA
             Called whenever the terminal emulator needs to send data to the child.
             The data to send will be passed as an argument.
+
+        CALLBACK_SCROLL_UP_LINES
+            Called before leaving ProcessInput if lines scrolled off the top
+            of the screen. A list of (text, rendition, wrapped) tuples, oldest
+            first, will be passed as an argument; the text is a string and the
+            rendition a copy of the row. When set, CALLBACK_SCROLL_UP_SCREEN
+            is not called.
         """
         self.callbacks[event] = func
         return
     def ProcessInput(self, text):
         """
         Processes the given input text. It detects V100 escape sequences and
-        handles it. Any partial unparsed escape sequences are stored internally
-        and processed along with next input text. Before leaving, the function
-        calls the callbacks CALLBACK_UPDATE_LINE and CALLBACK_UPDATE_CURSOR_POS
-        to update the changed lines and cursor position respectively.
+        handles it. A partial escape sequence at the end of the text leaves the
+        parser mid-sequence, and parsing resumes with the next input text.
+        Before leaving, the function calls the callbacks CALLBACK_UPDATE_LINE
+        and CALLBACK_UPDATE_CURSOR_POS to update the changed lines and cursor
+        position respectively.
         """
         if text == None:
             return
-        if self.unparsedInput != None:
-            text = self.unparsedInput + text
-            self.unparsedInput = None
         textlen = len(text)
         index = 0
+        if self.parseState != self.__STATE_GROUND:
+            index = self.__ParseSequence(text, index)
         while index < textlen:
-            ch = text[index]
-            ascii = ord(ch)
             if self.ignoreChars:
                 index += 1
                 continue
-            if ascii in self.charHandlers.keys():
-                index = self.charHandlers[ascii](text, index)
+            handler = self.charHandlers.get(ord(text[index]))
+            if handler is not None:
+                index = handler(text, index)
                 continue
-            self.__PushChar(ch)
-            '''
-            if ch in self.printableChars:
-                self.__PushChar(ch)
-            else:
-                glsLog.debug("TE: Unsupported Character: '%s' (%d)"%
-                             (ch, ascii), 1)
-            '''
-            index += 1
+            # Write the whole run up to the next special character at once.
+            end = self.printableRun.match(text, index).end()
+            self.__PushChars(text, index, end)
+            index = end
+        # deliver the scrolled lines
+        if self.scrolledLines:
+            lines = self.scrolledLines
+            self.scrolledLines = []
+            self.__Callback(self.CALLBACK_SCROLL_UP_LINES, lines)
         # update the dirty lines
-        self.__Callback(self.CALLBACK_UPDATE_LINES)
+        self.__UpdateLines()
         # update cursor position
         self.__Callback(self.CALLBACK_UPDATE_CURSOR_POS)
         return
+    def GetDirtyRows(self):
+        """
+        Returns a sorted list of the rows changed since the last
+        CALLBACK_UPDATE_LINES callback.
+        """
+        return [ row for row, dirty in enumerate(self.dirtyRows) if dirty ]
     def PasteText(self, text):
         if self.modes[self.MODE_BRCKPST]:
             text = '\x1b[200~' + text + '\x1b[201~'
         self.__Callback(self.CALLBACK_SEND_DATA, text)
-        glsLog.debug("TE: Paste Text '%s'."%(text), 3)
+        glsLog.debug("TE: Paste Text '%s'.", 3, text)
         return
     def SetFocus(self, focus=True):
         if self.modes[self.MODE_RFC]:
@@ -550,53 +697,207 @@ class V102Terminal:
                 self.__Callback(self.CALLBACK_SEND_DATA, '\x1b[I')
             else:
                 self.__Callback(self.CALLBACK_SEND_DATA, '\x1b[O')
-        glsLog.debug("TE: Set Focus '%s'."%(str(focus)), 3)
+        glsLog.debug("TE: Set Focus '%s'.", 3, str(focus))
         return
     ################################################################
     # Private Functions
     ################################################################
     def __ScrollUp(self):
         if self.scrollRegion[0] == 0 and self.scrollRegion[1] == self.rows-1:
-            # update the dirty lines
-            self.__Callback(self.CALLBACK_UPDATE_LINES)
-            # scrolls up the screen
-            if not self.modes[self.MODE_ALTBUF]:
-                self.__Callback(self.CALLBACK_SCROLL_UP_SCREEN)
-        glsLog.debug("TE: Scroll Up: rg = (%d,%d) term.rows = %d"%
-                     (self.scrollRegion[0], self.scrollRegion[1], self.rows), 3)
-        line = self.screen.pop(self.scrollRegion[0])
-        for i in range(self.cols):
-            line[i] = u' '
-        self.screen.insert(self.scrollRegion[1], line)
-        rendition = self.scrRendition.pop(self.scrollRegion[0])
-        for i in range(self.cols):
-            rendition[i] = 0
-        self.scrRendition.insert(self.scrollRegion[1], rendition)
+            if self.callbacks[self.CALLBACK_SCROLL_UP_LINES] is not None:
+                # Delivered by ProcessInput; the rotation marks every row
+                # dirty, so the dirty lines need no update first.
+                if not self.modes[self.MODE_ALTBUF]:
+                    self.scrolledLines.append( (self.screen[0].tounicode(),
+                                                self.scrRendition[0][:],
+                                                self.lineWrapped[0]) )
+            else:
+                # update the dirty lines
+                self.__UpdateLines()
+                # scrolls up the screen
+                if not self.modes[self.MODE_ALTBUF]:
+                    self.__Callback(self.CALLBACK_SCROLL_UP_SCREEN)
+        glsLog.debug("TE: Scroll Up: rg = (%d,%d) term.rows = %d", 3,
+                     self.scrollRegion[0], self.scrollRegion[1], self.rows)
+        self.__RotateRows(self.scrollRegion[0], self.scrollRegion[1], 1)
         return
     def __ScrollDown(self):
-        line = self.screen.pop(self.scrollRegion[1])
-        for i in range(self.cols):
-            line[i] = u' '
-        self.screen.insert(self.scrollRegion[0], line)
-        rendition = self.scrRendition.pop(self.scrollRegion[1])
-        for i in range(self.cols):
-            rendition[i] = 0
-        self.scrRendition.insert(self.scrollRegion[0], rendition)
-        glsLog.debug("TE: Scroll Down: rg = (%d,%d) term.rows = %d"%
-                     (self.scrollRegion[0], self.scrollRegion[1], self.rows), 3)
+        self.__RotateRows(self.scrollRegion[0], self.scrollRegion[1], -1)
+        glsLog.debug("TE: Scroll Down: rg = (%d,%d) term.rows = %d", 3,
+                     self.scrollRegion[0], self.scrollRegion[1], self.rows)
+        return
+    def __RotateRows(self, top, bottom, count, rendition=0):
+        """
+        Rotates rows top to bottom (inclusive) up by count rows, or down if count
+        is negative. Only row references are moved; the rows rotated into view
+        are recycled and blanked with one slice copy each, using the given
+        rendition.
+        """
+        height = bottom - top + 1
+        n = min(abs(count), height)
+        if n <= 0:
+            return
+        if count < 0:
+            n = height - n
+            exposed = range(top, top + height - n)
+        else:
+            exposed = range(bottom - n + 1, bottom + 1)
+        end = bottom + 1
+        self.screen[top:end] = self.screen[top+n:end] + self.screen[top:top+n]
+        self.scrRendition[top:end] = self.scrRendition[top+n:end] + self.scrRendition[top:top+n]
+        self.lineWrapped[top:end] = self.lineWrapped[top+n:end] + self.lineWrapped[top:top+n]
+        if rendition:
+            blankRendition = array('L', [rendition])*self.cols
+        else:
+            blankRendition = self.blankRendition
+        for i in exposed:
+            self.screen[i][:] = self.blankLine
+            self.scrRendition[i][:] = blankRendition
+            self.lineWrapped[i] = 0
+        self.__MarkDirty(top, bottom)
+        return
+    def __FitBuffer(self, screen, rendition, wrapped):
+        """
+        Cuts or pads a screen buffer in place at the bottom and right to the
+        current rows and cols, without reflowing.
+        """
+        del screen[self.rows:]
+        del rendition[self.rows:]
+        del wrapped[self.rows:]
+        for line, rend in zip(screen, rendition):
+            if len(line) > self.cols:
+                del line[self.cols:]
+                del rend[self.cols:]
+            elif len(line) < self.cols:
+                line.extend(self.blankLine[len(line):])
+                rend.extend(self.blankRendition[len(rend):])
+        for i in range(len(screen), self.rows):
+            screen.append(array('u', self.blankLine))
+            rendition.append(array('L', self.blankRendition))
+            wrapped.append(0)
         return
+    def __ReflowBuffer(self, screen, rendition, wrapped, curY, curX, history):
+        """
+        Rewraps the history and the rows of a screen buffer to the current cols
+        and splits the result into history and a screen of the current rows.
+        Returns the new screen, rendition, wrapped flags and cursor position;
+        history is updated in place.
+        """
+        texts, renditions, wraps = history
+        oldCols = len(screen[0])
+        # Blank rows below the cursor are dropped.
+        last = curY
+        for row in range(len(screen)-1, curY, -1):
+            if screen[row].count(u' ') != oldCols or rendition[row].count(0) != oldCols:
+                last = row
+                break
+        lines = texts + [ line.tounicode() for line in screen[:last+1] ]
+        rends = renditions + [ array('L', rend) for rend in rendition[:last+1] ]
+        flags = wraps + list(wrapped[:last+1])
+        cursorLine = len(texts) + curY
+        if oldCols != self.cols:
+            lines, rends, flags, cursorLine, curX = self.__Rewrap(lines, rends, flags,
+                                                                  cursorLine, curX, oldCols)
+        # Keep the end of the content and the cursor on screen.
+        start = min(max(len(lines) - self.rows, 0), cursorLine)
+        end = start + self.rows
+        texts[:] = lines[:start]
+        renditions[:] = rends[:start]
+        wraps[:] = flags[:start]
+        screen = [ array('u', line) for line in lines[start:end] ]
+        rendition = rends[start:end]
+        wrapped = bytearray(flags[start:end])
+        self.__FitBuffer(screen, rendition, wrapped)
+        curX = min(curX, self.cols)
+        return screen, rendition, wrapped, cursorLine - start, curX
+    def __Rewrap(self, lines, rends, flags, cursorLine, curX, oldCols):
+        """
+        Joins soft-wrapped lines into logical lines and splits them again at the
+        current cols. Trailing blanks are not carried over. Returns the new
+        lines, renditions, wrapped flags and the cursor line and column.
+        """
+        cols = self.cols
+        newLines = []
+        newRends = []
+        newFlags = []
+        newCursor = (cursorLine, min(curX, cols))
+        count = len(lines)
+        i = 0
+        while i < count:
+            j = i
+            while j < count - 1 and flags[j]:
+                j += 1
+            if i == j:
+                text = lines[i]
+                rend = rends[i]
+            else:
+                text = "".join(lines[i:j+1])
+                rend = array('L')
+                for k in range(i, j+1):
+                    rend.extend(rends[k])
+            # Content ends at the last non-blank character or colored blank.
+            length = len(text.rstrip(u' '))
+            tail = rend[length:]
+            if tail.count(0) != len(tail):
+                length = len(rend)
+                while not rend[length-1]:
+                    length -= 1
+            pieces = max((length + cols - 1) // cols, 1)
+            if i <= cursorLine <= j:
+                offset = (cursorLine - i)*oldCols + curX
+                row, col = divmod(offset, cols)
+                if curX >= oldCols and col == 0 and row > 0:
+                    # Keep a pending wrap pending at the new right margin.
+                    row -= 1
+                    col = cols
+                pieces = max(pieces, row + 1)
+                newCursor = (len(newLines) + row, col)
+            for k in range(0, pieces*cols, cols):
+                piece = text[k:k+cols]
+                pieceRend = rend[k:k+cols]
+                if len(piece) < cols:
+                    piece += u' '*(cols - len(piece))
+                    pieceRend.extend(self.blankRendition[len(pieceRend):])
+                newLines.append(piece)
+                newRends.append(pieceRend)
+                newFlags.append(1)
+            newFlags[-1] = flags[j]
+            i = j + 1
+        return newLines, newRends, newFlags, newCursor[0], newCursor[1]
     def __Callback(self, callback, *args):
         if callback in self.callbacks:
             self.callbacks[callback](*args)
         return
+    def __MarkDirty(self, startRow, endRow):
+        """
+        Marks rows startRow to endRow (inclusive) as changed.
+        """
+        startRow = max(startRow, 0)
+        endRow = min(endRow, self.rows - 1) + 1
+        self.dirtyRows[startRow:endRow] = self.allDirty[startRow:endRow]
+        return
+    def __UpdateLines(self):
+        """
+        Reports the dirty rows, including the rows under the old and new
+        cursor positions, through CALLBACK_UPDATE_LINES and clears them.
+        """
+        cursor = (self.curY, self.curX)
+        if cursor != self.dirtyCursor:
+            self.__MarkDirty(self.dirtyCursor[0], self.dirtyCursor[0])
+            self.__MarkDirty(self.curY, self.curY)
+            self.dirtyCursor = cursor
+        dirty = self.GetDirtyRows()
+        self.dirtyRows[:] = bytes(self.rows)
+        self.__Callback(self.CALLBACK_UPDATE_LINES, dirty)
+        return
     def __NewLine(self):
         """
         Moves the cursor to the next line, if the cursor is already at the
         bottom row then scroll up.
         """
-        glsLog.debug("TE: Newline: @ (%d,%d) SR=%d,%d rows=%d"%
-                     (self.curY, self.curX, self.scrollRegion[0], self.scrollRegion[1],
-                      self.rows), 3)
+        glsLog.debug("TE: Newline: @ (%d,%d) SR=%d,%d rows=%d", 3,
+                     self.curY, self.curX, self.scrollRegion[0], self.scrollRegion[1],
+                     self.rows)
         if self.curY >= self.scrollRegion[0] and self.curY <= self.scrollRegion[1]:
             if self.curY + 1 <= self.scrollRegion[1]:
                 self.curY += 1
@@ -606,21 +907,30 @@ class V102Terminal:
         if self.curY + 1 < self.rows:
             self.curY += 1
         return
-    def __PushChar(self, ch):
+    def __PushChars(self, text, start, end):
         """
-        Writes the character (ch) into current cursor position and advances
-        cursor position.
+        Writes the characters text[start:end] starting at the current cursor
+        position and advances the cursor position, wrapping at the last column.
+        Each row segment is written with a single slice assignment.
         """
-        glsLog.debug("TE: Push Char: '%s' @ (%d,%d)"%(ch, self.curY, self.curX), 10)
-        if self.curX >= self.cols:
-            self.__NewLine()
-            self.curX = 0
-        self.curY = min(self.curY, self.rows-1)
-        self.screen[self.curY][self.curX] = ch
-        self.scrRendition[self.curY][self.curX] = self.curRendition
-        self.curX += 1
+        glsLog.debug("TE: Push Chars: %d @ (%d,%d)", 10, end - start, self.curY, self.curX)
+        while start < end:
+            if self.curX >= self.cols:
+                self.lineWrapped[self.curY] = 1
+                self.__NewLine()
+                self.curX = 0
+            self.curY = min(self.curY, self.rows-1)
+            count = min(end - start, self.cols - self.curX)
+            col = self.curX
+            self.screen[self.curY][col:col+count] = array('u', text[start:start+count])
+            self.scrRendition[self.curY][col:col+count] = array('L', [self.curRendition])*count
+            self.dirtyRows[self.curY] = 1
+            self.curX += count
+            start += count
         return
     def __UnhandledEscSeq(self, seq, ex=False):
+        if not glsLog.enabled(1):
+            return
         printable_seq = ""
         for c in seq:
             if c in self.printableChars:
@@ -632,204 +942,136 @@ class V102Terminal:
                 if len(esc) < 2:
                     esc = '0' + esc
                 printable_seq += '\\x' + esc
-        glsLog.debug("TE: Unhandled %s Sequence: '%s'"%
-                     ('EX ESC' if ex else 'ESC', printable_seq), 1)
+        glsLog.debug("TE: Unhandled %s Sequence: '%s'", 1,
+                     'EX ESC' if ex else 'ESC', printable_seq)
         return
-    def __ParseEscSeq(self, text, index):
+    def __ParseSequence(self, text, index):
         """
-        Parses escape sequence from the input and returns the index after escape
-        sequence, the escape sequence character and parameter for the escape
-        sequence
+        Runs the parser state table over text starting at index, until the
+        parser returns to the ground state or the text is exhausted. Returns
+        the index of the first unconsumed character.
         """
         textlen = len(text)
-        interChars = None
         while index < textlen:
-            ch = text[index]
-            ascii = ord(ch)
-            if ascii >= 32 and ascii <= 63:
-                # intermediate char (32 - 47)
-                # parameter chars (48 - 63)
-                if interChars == None:
-                    interChars = ch
-                else:
-                    interChars += ch
-            elif ascii >= 64 and ascii <= 125:
-                # final char
-                return (index + 1, chr(ascii), interChars)
-            else:
-                glsLog.debug("TE: Unexpected character in escape sequence: %s"%ch, 1)
-            index += 1
-        # the escape sequence is not complete, inform this to caller by giving
-        # '?' as final char
-        return (index, '?', interChars)
-    def __ParseExtendedSeq(self, first, text, index):
-        textlen = len(text)
-        params = []
-        kind = None
-        while index < textlen:
-            ch = text[index]
-            if ch == '\x07':
-                # Sequence ended with a bell.
-                index += 1
-                kind = '' if kind is None else kind
-                params = ''.join(params)
-                params = None if params == '' else params
-                return (index, kind, params)
-            if ch == '\x1b':
-                if index + 1 < textlen:
-                    index += 1
-                    if text[index] == '\\':
-                        # Sequence is complete.
-                        index += 1
-                        kind = '' if kind is None else kind
-                        params = ''.join(params)
-                        params = None if params == '' else params
-                        return (index, kind, params)
-                    else:
-                        # Escape without '\': unknown sequence.
-                        kind = '' if kind is None else kind + ';'
-                        params = ''.join(params)
-                        seq = first + kind + params + '\x1b' + text[index]
-                        self.__UnhandledEscSeq(seq, ex=True)
-                        return (index+1, None, None)
+            state = self.parseState
+            if state == self.__STATE_GROUND:
                 break
-            if ch == ';' and kind is None:
-                # Found end to kind portion of sequence.
-                index += 1
-                if len(params) == 0:
-                    self.__UnhandledEscSeq(first+';', ex=True)
-                    return (index, None, None)
-                kind = ''.join(params)
-                params = []
+            # Collect whole runs of parameter / string characters at once.
+            if state == self.__STATE_CSI:
+                match = self.csiParamRun.match(text, index)
+            elif state == self.__STATE_OSC:
+                match = self.oscStringRun.match(text, index)
+            elif state == self.__STATE_STRING:
+                match = self.ignoreStringRun.match(text, index)
+            else:
+                match = None
+            if match is not None:
+                if state != self.__STATE_STRING:
+                    self.parseCollect.append(match.group())
+                index = match.end()
                 continue
-            # Character is part of unfinished kind or of parameters.
-            params.append(ch)
+            ch = text[index]
+            code = ord(ch)
+            action, self.parseState = self.parseTable[state][min(code, 0xff)]
+            if action == self.__ACT_COLLECT:
+                self.parseCollect.append(ch)
+            elif action == self.__ACT_EXECUTE:
+                handler = self.charHandlers.get(code)
+                if handler is not None:
+                    handler(text, index)
+            elif action == self.__ACT_ENTER:
+                self.parseCollect = []
+            elif action == self.__ACT_CSI_DISPATCH:
+                self.__DispatchCSI("".join(self.parseCollect), ch)
+                self.parseCollect = []
+            elif action == self.__ACT_ESC_DISPATCH:
+                self.__DispatchESC("".join(self.parseCollect), ch)
+                self.parseCollect = []
+            elif action == self.__ACT_OSC_END:
+                self.__DispatchOSC("".join(self.parseCollect))
+                self.parseCollect = []
+            elif action == self.__ACT_STRING_END:
+                glsLog.debug("TE: Control String: Unsupported.", 10)
+                self.parseCollect = []
             index += 1
-        # The escape sequence is not complete, inform this to caller by giving
-        # '?' as sequence kind and all read text in params.
-        kind = '' if kind is None else kind
-        params = ''.join(params)
-        return (index, '?', kind+params)
-    def __HandleEscSeq(self, text, index, csi=False):
-        """
-        Tries to parse escape sequence from input and if its not complete then
-        puts it in unparsedInput and process it when the ProcessInput called
-        next time.
-        """
-        if csi or text[index] == '[':
-            # Traditional escape sequences.
-            if csi:
-                firstChar = '['
+        return index
+    def __DispatchCSI(self, params, finalChar):
+        """
+        Runs the handler for a complete CSI sequence.
+        """
+        params = params if params else None
+        if finalChar not in self.escSeqHandlers:
+            self.__UnhandledEscSeq("[" + (params or "") + finalChar)
+            return
+        try:
+            self.escSeqHandlers[finalChar]('[', params, finalChar)
+        except:
+            glsLog.add("TE: Exception in ESC seq handler for '[%s%s'!\n%s"%
+                       (params, finalChar, traceback.format_exc()))
+        return
+    def __DispatchESC(self, interChars, finalChar):
+        """
+        Runs the handler for a complete non-CSI escape sequence.
+        """
+        if interChars:
+            if interChars[0] in self.__ESC_CHRST:
+                # Character set sequences.
+                glsLog.debug("TE: Charset: Unsupported '%s' @ (%d,%d)", 10,
+                             interChars + finalChar, self.curY, self.curX)
             else:
-                firstChar = text[index]
-                index += 1
-            index, finalChar, interChars = self.__ParseEscSeq(text, index)
-            if finalChar == '?':
-                # Partial sequence; save and parse later.
-                self.unparsedInput = "\x1b" + firstChar
-                if interChars != None:
-                    self.unparsedInput += interChars
-                return index
-            if finalChar in self.escSeqHandlers.keys():
-                # Complete sequence with handler.
-                try:
-                    self.escSeqHandlers[finalChar](firstChar, interChars, finalChar)
-                except:
-                    glsLog.add("TE: Exception in ESC seq handler for '[%s%s'!\n%s"%
-                               (interChars, finalChar, traceback.format_exc()))
-                return index
-            # Unhandled sequence.
-            escSeq = "["
-            if interChars != None:
-                escSeq += interChars
-            escSeq += finalChar
-            self.__UnhandledEscSeq(escSeq)
-            return index
-        if text[index] == ']':
-            # Extended escape sequences used by Xterm and modern terminals.
-            firstChar = text[index]
-            index += 1
-            index, kind, params = self.__ParseExtendedSeq(firstChar, text, index)
-            if kind is None:
-                # Unhandled sequence (already notified logger).
-                return index
-            if kind == '?':
-                # Partial sequence; save and parse later.
-                self.unparsedInput = "\x1b" + firstChar + params
-                return index
-            if kind not in self.exHandlers:
-                params = '' if params is None else params
-                escSeq = firstChar + kind + ';' + params
-                self.__UnhandledEscSeq(escSeq, ex=True)
-                return index
-            try:
-                self.exHandlers[kind](firstChar, params)
-            except:
-                params = '' if params is None else params
-                glsLog.add("TE: Exception in EX handler for ']%s%s'!\n%s"%
-                           (kind, params, traceback.format_exc()))
-            return index
-        if text[index] == 'P':
-            # Additional extended escape sequences.
-            # !!avose: TODO
-            index += 1
-            textlen = len(text)
-            while index < textlen:
-                if text[index] == '\x1b' or text[index] == '\x07':
-                    return index + 1
-                index += 1
-            return index
-        # Special case for character set sequences.
-        if text[index] in self.__ESC_CHRST:
-            firstChar = text[index]
-            index += 1
-            textlen = len(text)
-            if index >= textlen:
-                self.unparsedInput += "\x1b" + firstChar
-                return index
-            interChars = text[index]
-            if interChars in '%"':
-                index += 1
-                if index >= textlen:
-                    self.unparsedInput += "\x1b" + firstChar + interChars
-                    return index
-                interChars += text[index]
-            glsLog.debug("TE: Charset: Unsupported '%s' @ (%d,%d)"%
-                         (firstChar + interChars, self.curY, self.curX), 10)
-            return index + 1
-        # Escape but non-CSI sequences.
-        if text[index] in self.escHandlers:
-            try:
-                self.escHandlers[text[index]]()
-            except:
-                glsLog.add("TE: Exception in ESC handler for '%s'!\n%s"%
-                           (text[index], traceback.format_exc()))
-            return index + 1
-        self.__UnhandledEscSeq("\x1b" + text[index])
-        return index + 1
+                self.__UnhandledEscSeq("\x1b" + interChars + finalChar)
+            return
+        if finalChar == self.__ESC_ST:
+            return
+        if finalChar not in self.escHandlers:
+            self.__UnhandledEscSeq("\x1b" + finalChar)
+            return
+        try:
+            self.escHandlers[finalChar]()
+        except:
+            glsLog.add("TE: Exception in ESC handler for '%s'!\n%s"%
+                       (finalChar, traceback.format_exc()))
+        return
+    def __DispatchOSC(self, text):
+        """
+        Runs the handler for a complete extended (OSC) escape sequence.
+        """
+        kind, sep, params = text.partition(';')
+        if not sep:
+            kind, params = '', text
+        params = params if params else None
+        if kind not in self.exHandlers:
+            self.__UnhandledEscSeq("]" + kind + ";" + (params or ""), ex=True)
+            return
+        try:
+            self.exHandlers[kind](']', params)
+        except:
+            glsLog.add("TE: Exception in EX handler for ']%s;%s'!\n%s"%
+                       (kind, params, traceback.format_exc()))
+        return
     def __CursorForward(self, n):
-        glsLog.debug("TE: Cursor Forward: %d @ (%d,%d)"%(n, self.curY, self.curX), 3)
+        glsLog.debug("TE: Cursor Forward: %d @ (%d,%d)", 3, n, self.curY, self.curX)
         n = max(n, 1)
         self.curX = min(self.curX + n, self.cols - 1)
         return
     def __CursorBackward(self, n):
-        glsLog.debug("TE: Cursor Backward: %d @ (%d,%d)"%(n, self.curY, self.curX), 3)
+        glsLog.debug("TE: Cursor Backward: %d @ (%d,%d)", 3, n, self.curY, self.curX)
         n = max(n, 1)
         self.curX = max(self.curX - n, 0)
         return
     def __SaveCursor(self):
         ndx = 1 if self.modes[self.MODE_ALTBUF] else 0
         self.savedCursor[ndx] = (self.curY, self.curX, self.cursorStyle, self.curRendition)
-        glsLog.debug("TE: Save Cursor: %d,%d [%s]"%
-                     (self.curY, self.curX, 'ALT' if ndx == 1 else 'PRI'), 3)
+        glsLog.debug("TE: Save Cursor: %d,%d [%s]", 3,
+                     self.curY, self.curX, 'ALT' if ndx == 1 else 'PRI')
         return
     def __RestoreCursor(self):
         ndx = 1 if self.modes[self.MODE_ALTBUF] else 0
         self.curY, self.curX, self.cursorStyle, self.curRendition = self.savedCursor[ndx]
         self.curX = min(max(self.curX, 0), self.cols-1)
         self.curY = min(max(self.curY, 0), self.rows-1)
-        glsLog.debug("TE: Restore Cursor: %d,%d [%s]"%
-                     (self.curY, self.curX, 'ALT' if ndx == 1 else 'PRI'), 3)
+        glsLog.debug("TE: Restore Cursor: %d,%d [%s]", 3,
+                     self.curY, self.curX, 'ALT' if ndx == 1 else 'PRI')
         return
     def __AltBuffIn(self, save=False, clear=False):
         if self.modes[self.MODE_ALTBUF]:
@@ -839,11 +1081,12 @@ class V102Terminal:
         self.modes[self.MODE_ALTBUF] = True
         self.savedScreen, self.screen = self.screen, self.savedScreen
         self.savedRendition, self.scrRendition = self.scrRendition, self.savedRendition
-        self.Resize(self.rows, self.cols)
+        self.savedWrapped, self.lineWrapped = self.lineWrapped, self.savedWrapped
+        self.scrollRegion = (0, self.rows-1)
+        self.__MarkDirty(0, self.rows - 1)
         if clear:
             self.Clear()
-        glsLog.debug("TE: (ALTBUF) Enter: save=%s clear=%s"%
-                     (str(save), str(clear)), 3)
+        glsLog.debug("TE: (ALTBUF) Enter: save=%s clear=%s", 3, str(save), str(clear))
         return
     def __AltBuffOut(self, restore=False, clear=False):
         if not self.modes[self.MODE_ALTBUF]:
@@ -853,30 +1096,103 @@ class V102Terminal:
             self.Clear()
         self.savedScreen, self.screen = self.screen, self.savedScreen
         self.savedRendition, self.scrRendition = self.scrRendition, self.savedRendition
-        self.Resize(self.rows, self.cols)
+        self.savedWrapped, self.lineWrapped = self.lineWrapped, self.savedWrapped
+        self.scrollRegion = (0, self.rows-1)
+        self.__MarkDirty(0, self.rows - 1)
         if restore:
             self.__RestoreCursor()
-        glsLog.debug("TE: (ALTBUF) Exit: restore=%s clear=%s"%
-                     (str(restore), str(clear)), 3)
+        glsLog.debug("TE: (ALTBUF) Exit: restore=%s clear=%s", 3, str(restore), str(clear))
         return
-    def __SetRenditionBits(self, style=None, fg=None, bg=None):
+    def __DecodeSGR(self, first, params, last):
+        """
+        Decodes SGR parameters into one (mask, bits) rendition delta and caches
+        it by parameter string. Returns None if the sequence is not supported.
+        """
+        if '?' in params or '>' in params or '%' in params:
+            self.__UnhandledEscSeq(first+params+last)
+            return None
         mask = 0
         bits = 0
-        if style is not None:
-            flag, enable = style
-            mask |= 0xffff
-            if enable:
-                bits |=  0xffff &  flag
+        args = params.split(';')
+        i = 0
+        while i < len(args):
+            code, sep, extra = args[i].partition(':')
+            i += 1
+            try:
+                code = int(code) if code else 0
+            except ValueError:
+                self.__UnhandledEscSeq(first+params+last)
+                return None
+            if code == 38 or code == 48:
+                if sep:
+                    extra = extra.split(':')
+                else:
+                    # The color takes the following arguments: 5;n or 2;r;g;b.
+                    kind = args[i] if i < len(args) else ''
+                    count = 2 if kind == '5' else 4 if kind == '2' else 1
+                    extra = args[i:i+count]
+                    i += count
+                color = self.__DecodeColor(extra)
+                if color is None:
+                    glsLog.debug("TE: (SGR) Select Graphic Rendition: Unsupported: '%s'.", 1,
+                                 params)
+                    continue
+                index, rgb = color
+                if code == 38:
+                    flag = self.RENDITION_STYLE_FG_RGB if rgb else 0
+                    delta = (self.__SGR_FG, (index<<16) | flag)
+                else:
+                    flag = self.RENDITION_STYLE_BG_RGB if rgb else 0
+                    delta = (self.__SGR_BG, (index<<24) | flag)
             else:
-                bits &= ~0xffff | ~flag
-        if fg is not None:
-            mask |= (0xff)      << 16
-            bits |= (0xff & fg) << 16
-        if bg is not None:
-            mask |= (0xff)      << 24
-            bits |= (0xff & bg) << 24
-        self.curRendition = (self.curRendition & (~mask)) | bits
-        return
+                delta = self.__SGR_CODES.get(code)
+                if delta is None:
+                    glsLog.debug("TE: (SGR) Select Graphic Rendition: Unsupported %d", 1, code)
+                    continue
+            mask |= delta[0]
+            bits = (bits & ~delta[0]) | delta[1]
+        if len(self.sgrCache) >= self.__SGR_CACHE_MAX:
+            self.sgrCache.clear()
+        self.sgrCache[params] = (mask, bits)
+        return mask, bits
+    def __DecodeColor(self, args):
+        """
+        Decodes extended color arguments 5;n or 2;r;g;b (colon separated forms
+        may carry a color space id before r:g:b). Returns (index, rgb) where rgb
+        is True for a truecolor palette index, or None if not supported.
+        """
+        try:
+            if len(args) == 2 and args[0] == '5':
+                return int(args[1]) & 0xff, False
+            if len(args) in (4, 5) and args[0] == '2':
+                r, g, b = [ min(max(int(c or 0), 0), 255) for c in args[-3:] ]
+                return self.__TrueColor(r, g, b)
+        except ValueError:
+            pass
+        return None
+    def __TrueColor(self, r, g, b):
+        """
+        Returns (index, True) for the color in the truecolor palette, adding it
+        if there is room. Once the palette is full, returns (index, False) for
+        the nearest color of the 256 color cube and grey ramp.
+        """
+        index = self.truePaletteIndex.get((r, g, b))
+        if index is not None:
+            return index, True
+        if len(self.truePalette) < self.__TRUECOLOR_MAX:
+            index = len(self.truePalette)
+            self.truePalette.append((r, g, b))
+            self.truePaletteIndex[(r, g, b)] = index
+            return index, True
+        cube = [ 0 if c < 48 else 1 if c < 115 else (c - 35) // 40 for c in (r, g, b) ]
+        index = 16 + 36*cube[0] + 6*cube[1] + cube[2]
+        levels = (0, 95, 135, 175, 215, 255)
+        error = sum((c - levels[n])**2 for c, n in zip((r, g, b), cube))
+        grey = min(max((r + g + b) // 3 - 3, 0) // 10, 23)
+        level = 8 + 10*grey
+        if sum((c - level)**2 for c in (r, g, b)) < error:
+            index = 232 + grey
+        return index, False
     ################################################################
     # Character Handlers
     ################################################################
@@ -884,7 +1200,7 @@ class V102Terminal:
         """
         Handler for backspace character
         """
-        glsLog.debug("TE: BS: @ (%d,%d)"%(self.curY, self.curX), 3)
+        glsLog.debug("TE: BS: @ (%d,%d)", 3, self.curY, self.curX)
         if self.curX > 0:
             self.curX -= 1
         return index + 1
@@ -892,7 +1208,7 @@ class V102Terminal:
         """
         Handler for horizontal tab character
         """
-        glsLog.debug("TE: TAB: @ (%d,%d)"%(self.curY, self.curX), 3)
+        glsLog.debug("TE: TAB: @ (%d,%d)", 3, self.curY, self.curX)
         while self.curX + 1 < self.cols:
             self.curX += 1
             if self.curX % 8 == 0:
@@ -902,53 +1218,58 @@ class V102Terminal:
         """
         Handler for line feed character
         """
-        glsLog.debug("TE: LF: @ (%d,%d)"%(self.curY, self.curX), 3)
+        glsLog.debug("TE: LF: @ (%d,%d)", 3, self.curY, self.curX)
         self.__NewLine()
         return index + 1
     def __OnCharCR(self, text, index):
         """
         Handler for carriage return character
         """
-        glsLog.debug("TE: CR: @ (%d,%d)"%(self.curY, self.curX), 3)
+        glsLog.debug("TE: CR: @ (%d,%d)", 3, self.curY, self.curX)
         self.curX = 0
         return index + 1
     def __OnCharXON(self, text, index):
         """
         Handler for XON character
         """
-        glsLog.debug("TE: XON: @ (%d,%d)"%(self.curY, self.curX), 3)
+        glsLog.debug("TE: XON: @ (%d,%d)", 3, self.curY, self.curX)
         self.ignoreChars = False
         return index + 1
     def __OnCharXOFF(self, text, index):
         """
         Handler for XOFF character
         """
-        glsLog.debug("TE: XOFF: @ (%d,%d)"%(self.curY, self.curX), 3)
+        glsLog.debug("TE: XOFF: @ (%d,%d)", 3, self.curY, self.curX)
         self.ignoreChars = True
         return index + 1
     def __OnCharESC(self, text, index):
         """
         Handler for escape character
         """
-        index += 1
-        if index < len(text):
-            index = self.__HandleEscSeq(text, index)
-        else:
-            glsLog.debug("TE: ESC: @ (%d,%d) without sequence!"%
-                         (self.curY, self.curX), 1)
-        return index
+        match = self.csiSequence.match(text, index)
+        if match is not None:
+            self.__DispatchCSI(match.group(1), match.group(2))
+            return match.end()
+        match = self.oscSequence.match(text, index)
+        if match is not None:
+            self.__DispatchOSC(match.group(1))
+            return match.end()
+        # Incomplete or unusual sequence: run the state machine.
+        self.parseState = self.__STATE_ESCAPE
+        self.parseCollect = []
+        return self.__ParseSequence(text, index + 1)
     def __OnCharCSI(self, text, index):
         """
         Handler for control sequence intruducer(CSI) character
         """
         glsLog.debug("TE: CSI Character!", 1)
-        index += 1
-        if index < len(text):
-            index = self.__HandleEscSeq(text, index, csi=True)
-        else:
-            glsLog.debug("TE: CSI: @ (%d,%d) without sequence!"%
-                         (self.curY, self.curX), 1)
-        return index
+        match = self.csiSequence.match(text, index)
+        if match is not None:
+            self.__DispatchCSI(match.group(1), match.group(2))
+            return match.end()
+        self.parseState = self.__STATE_CSI
+        self.parseCollect = []
+        return self.__ParseSequence(text, index + 1)
     def __OnCharSO(self, text, index):
         """
         Handler SO: Shift out to the G1 character set.
@@ -1003,7 +1324,7 @@ class V102Terminal:
         if ' ' in params:
             # Escape sequence SL
             # !!avose: This is almost certainly wrong..
-            glsLog.debug("TE: (SL) Shift Left: '%s%s'"%(params, last), 3)
+            glsLog.debug("TE: (SL) Shift Left: '%s%s'", 3, params, last)
             plist = params.split(' ')
             if len(plist) != 2:
                 self.__UnhandledEscSeq(first+params+last)
@@ -1013,21 +1334,23 @@ class V102Terminal:
             self.curX = newX if newX < self.cols else self.cols
         else:
             # Escape sequence ICH
-            glsLog.debug("TE: (ICH) Insert (Blank) Chars: '%s%s'"%(params, last), 3)
-            row = self.curY
+            glsLog.debug("TE: (ICH) Insert (Blank) Chars: '%s%s'", 3, params, last)
+            line = self.screen[self.curY]
+            rendition = self.scrRendition[self.curY]
             col = self.curX
             count = int(params) if params != '' else 1
             count = min(count, self.cols-col)
-            for i in range(count):
-                for c in reversed(range(col, self.cols-1)):
-                    self.screen[row][c+1] = self.screen[row][c]
-                    self.scrRendition[row][c+1] = self.scrRendition[row][c]
-                self.screen[row][col] = ' '
-                self.scrRendition[row][col] = self.curRendition
+            if count <= 0:
+                return
+            line[col+count:] = line[col:self.cols-count]
+            line[col:col+count] = self.blankLine[:count]
+            rendition[col+count:] = rendition[col:self.cols-count]
+            rendition[col:col+count] = array('L', [self.curRendition])*count
+            self.__MarkDirty(self.curY, self.curY)
         return
     def __OnEscSeqCUU(self, first, params, last):
         # Handler CUU: Cursor Update Up
-        glsLog.debug("TE: (CUU) Cursor Update Up: '%s%s'"%(params, last), 3)
+        glsLog.debug("TE: (CUU) Cursor Update Up: '%s%s'", 3, params, last)
         n = 1
         if params != None:
             n = int(params)
@@ -1037,7 +1360,7 @@ class V102Terminal:
         return
     def __OnEscSeqCUD(self, first, params, last):
         # Handler CUD: Cursor Update Down
-        glsLog.debug("TE: (CUD) Cursor Update Down: '%s%s'"%(params, last), 3)
+        glsLog.debug("TE: (CUD) Cursor Update Down: '%s%s'", 3, params, last)
         n = 1
         if params != None:
             n = int(params)
@@ -1047,7 +1370,7 @@ class V102Terminal:
         return
     def __OnEscSeqCUF(self, first, params, last):
         # Handler CUF: Cursor Update Forward
-        glsLog.debug("TE: (CUF) Cursor Update Forward: '%s%s'"%(params, last), 3)
+        glsLog.debug("TE: (CUF) Cursor Update Forward: '%s%s'", 3, params, last)
         n = 1
         if params != None:
             n = int(params)
@@ -1055,7 +1378,7 @@ class V102Terminal:
         return
     def __OnEscSeqCUB(self, first, params, last):
         # Handler CUB: Cursor Update Back
-        glsLog.debug("TE: (CUB) Cursor Update Back: '%s%s'"%(params, last), 3)
+        glsLog.debug("TE: (CUB) Cursor Update Back: '%s%s'", 3, params, last)
         n = 1
         if params != None:
             n = int(params)
@@ -1070,9 +1393,9 @@ class V102Terminal:
         if col >= 0 and col < self.cols:
             self.curX = col
         else:
-            glsLog.debug("TE: (CHA) Cursor Horizontal Position: %d out of bounds (%d)!"%
-                         (col, self.cols), 1)
-        glsLog.debug("TE: (CHA) Cursor Horizontal Absolute: %d"%(col), 3)
+            glsLog.debug("TE: (CHA) Cursor Horizontal Position: %d out of bounds (%d)!", 1,
+                         col, self.cols)
+        glsLog.debug("TE: (CHA) Cursor Horizontal Absolute: %d", 3, col)
         return
     def __OnEscSeqCUP(self, first, params, last):
         # Handler CUP: Cursor Update Position
@@ -1083,10 +1406,10 @@ class V102Terminal:
             if len(values) == 2:
                 y = int(values[0]) - 1
                 x = int(values[1]) - 1
-                glsLog.debug("TE: (CUP) Cursor Update Position: (%d,%d)"%(y, x), 3)
+                glsLog.debug("TE: (CUP) Cursor Update Position: (%d,%d)", 3, y, x)
             else:
-                glsLog.debug("TE: (CUP) Cursor Position: Invalid Parameters '%s%s'!"%
-                             (params, last), 1)
+                glsLog.debug("TE: (CUP) Cursor Position: Invalid Parameters '%s%s'!", 1,
+                             params, last)
                 return
         x = min(max(x, 0), self.cols-1)
         y = min(max(y, 0), self.rows-1)
@@ -1100,18 +1423,18 @@ class V102Terminal:
             n = int(params)
         if n == 0:
             self.ClearRect(self.curY, self.curX, self.rows - 1, self.cols - 1)
-            glsLog.debug("TE: (ED) Erase Display: (%d,%d) to (%d,%d)"%
-                         (self.curY, self.curX, self.rows - 1, self.cols - 1), 3)
+            glsLog.debug("TE: (ED) Erase Display: (%d,%d) to (%d,%d)", 3,
+                         self.curY, self.curX, self.rows - 1, self.cols - 1)
         elif n == 1:
             self.ClearRect(0, 0, self.curY, self.curX)
-            glsLog.debug("TE: (ED) Erase Display: (%d,%d) to (%d,%d)"%
-                         (0, 0, self.curY, self.curX), 3)
+            glsLog.debug("TE: (ED) Erase Display: (%d,%d) to (%d,%d)", 3,
+                         0, 0, self.curY, self.curX)
         elif n == 2 or n == 3:
             self.ClearRect(0, 0, self.rows - 1, self.cols - 1)
-            glsLog.debug("TE: (ED) Erase Display: (%d,%d) to (%d,%d)"%
-                         (0, 0, self.rows - 1, self.cols - 1), 3)
+            glsLog.debug("TE: (ED) Erase Display: (%d,%d) to (%d,%d)", 3,
+                         0, 0, self.rows - 1, self.cols - 1)
         else:
-            glsLog.debug("TE: (ED) Erase Display: Invalid Parameter %d!"%(n), 1)
+            glsLog.debug("TE: (ED) Erase Display: Invalid Parameter %d!", 1, n)
         return
     def __OnEscSeqEL(self, first, params, last):
         # Handler EL: Erase Line
@@ -1120,18 +1443,18 @@ class V102Terminal:
             n = int(params)
         if n == 0:
             self.ClearRect(self.curY, self.curX, self.curY, self.cols - 1)
-            glsLog.debug("TE: (EL) Erase Line: (%d,%d) to (%d,%d)"%
-                         (self.curY, self.curX, self.curY, self.cols - 1), 3)
+            glsLog.debug("TE: (EL) Erase Line: (%d,%d) to (%d,%d)", 3,
+                         self.curY, self.curX, self.curY, self.cols - 1)
         elif n == 1:
             self.ClearRect(self.curY, 0, self.curY, self.curX)
-            glsLog.debug("TE: (EL) Erase Line: (%d,%d) to (%d,%d)"%
-                         (self.curY, 0, self.curY, self.curX), 3)
+            glsLog.debug("TE: (EL) Erase Line: (%d,%d) to (%d,%d)", 3,
+                         self.curY, 0, self.curY, self.curX)
         elif n == 2:
             self.ClearRect(self.curY, 0, self.curY, self.cols - 1)
-            glsLog.debug("TE: (EL) Erase Line: (%d,%d) to (%d,%d)"%
-                         (self.curY, 0, self.curY, self.cols - 1), 3)
+            glsLog.debug("TE: (EL) Erase Line: (%d,%d) to (%d,%d)", 3,
+                         self.curY, 0, self.curY, self.cols - 1)
         else:
-            glsLog.debug("TE: (EL) Erase Line: Invalid Parameter %d!"%(n), 1)
+            glsLog.debug("TE: (EL) Erase Line: Invalid Parameter %d!", 1, n)
         return
     def __OnEscSeqIL(self, first, params, last):
         # Handler IL: Insert Lines
@@ -1139,17 +1462,9 @@ class V102Terminal:
             return
         self.curX = 0
         n = int(params) if params != None else 1
-        for l in range(n):
-            line = self.screen.pop(self.scrollRegion[1])
-            for i in range(self.cols):
-                line[i] = u' '
-            self.screen.insert(self.curY, line)
-            rendition = self.scrRendition.pop(self.scrollRegion[1])
-            for i in range(self.cols):
-                rendition[i] = self.curRendition
-            self.scrRendition.insert(self.curY, rendition)
-        glsLog.debug("TE: (IL) Insert Lines: %d @ (%d,%d) term.rows=%d"%
-                     (n, self.curY, self.scrollRegion[1], self.rows), 3)
+        self.__RotateRows(self.curY, self.scrollRegion[1], -n, self.curRendition)
+        glsLog.debug("TE: (IL) Insert Lines: %d @ (%d,%d) term.rows=%d", 3,
+                     n, self.curY, self.scrollRegion[1], self.rows)
         return
     def __OnEscSeqDL(self, first, params, last):
         # Handler DL: Delete Lines
@@ -1157,30 +1472,24 @@ class V102Terminal:
             return
         self.curX = 0
         n = int(params) if params != None else 1
-        for l in range(n):
-            line = self.screen.pop(self.curY)
-            for i in range(self.cols):
-                line[i] = u' '
-            self.screen.insert(self.scrollRegion[1], line)
-            rendition = self.scrRendition.pop(self.curY)
-            for i in range(self.cols):
-                rendition[i] = self.curRendition
-            self.scrRendition.insert(self.scrollRegion[1], rendition)
-        glsLog.debug("TE: (DL) Delete Lines: %d @ (%d,%d) term.rows=%d"%
-                     (n, self.curY, self.scrollRegion[1], self.rows), 3)
+        self.__RotateRows(self.curY, self.scrollRegion[1], n, self.curRendition)
+        glsLog.debug("TE: (DL) Delete Lines: %d @ (%d,%d) term.rows=%d", 3,
+                     n, self.curY, self.scrollRegion[1], self.rows)
         return
     def __OnEscSeqDCH(self, first, params, last):
         # Handler DCH: Delete Characters
         n = int(params) if params != None else 1
-        for c in range(self.curX,self.cols):
-            if c + n < self.cols:
-                self.screen[self.curY][c] = self.screen[self.curY][c+n]
-                self.scrRendition[self.curY][c] = self.scrRendition[self.curY][c+n]
-            else:
-                self.screen[self.curY][c] = ' '
-                self.scrRendition[self.curY][c] = 0
-        glsLog.debug("TE: (DCH) Delete Characters: %d @ (%d,%d)"%
-                     (n, self.curY, self.curX), 3)
+        line = self.screen[self.curY]
+        rendition = self.scrRendition[self.curY]
+        col = min(self.curX, self.cols)
+        n = min(max(n, 0), self.cols - col)
+        line[col:self.cols-n] = line[col+n:]
+        line[self.cols-n:] = self.blankLine[:n]
+        rendition[col:self.cols-n] = rendition[col+n:]
+        rendition[self.cols-n:] = self.blankRendition[:n]
+        self.__MarkDirty(self.curY, self.curY)
+        glsLog.debug("TE: (DCH) Delete Characters: %d @ (%d,%d)", 3,
+                     n, self.curY, self.curX)
         return
     def __OnEscSeqVPA(self, first, params, last):
         # Handler VPA: Cursor Vertical Position Absolute
@@ -1191,9 +1500,8 @@ class V102Terminal:
         if row >= 0 and row < self.rows:
             self.curY = row
         else:
-            glsLog.debug("TE: (VPA) Cursor Vertical Position: %d out of bounds!"%
-                         (row), 1)
-        glsLog.debug("TE: (VPA) Cursor Vertical Position: %d"%(row), 3)
+            glsLog.debug("TE: (VPA) Cursor Vertical Position: %d out of bounds!", 1, row)
+        glsLog.debug("TE: (VPA) Cursor Vertical Position: %d", 3, row)
         return
     def __OnEscSeqSGR(self, first, params, last):
         # Handler SGR: Select Graphic Rendition
@@ -1201,57 +1509,13 @@ class V102Terminal:
             self.curRendition = 0
             glsLog.debug("TE: (SGR) Select Graphic Rendition: No Parameter; Reset.", 3)
             return
-        if '?' in params or '>' in params or '%' in params:
-            self.__UnhandledEscSeq(first+params+last)
-            return
-        if (params.startswith("38:5:") or params.startswith("38;5:") or
-            params.startswith("38;5;") or params.startswith("48:5:") or
-            params.startswith("48;5:") or params.startswith("48;5;")):
-            orig_params = params
-            params = params.replace(':',';')
-            params = params.split(';')
-            if len(params) != 3:
-                glsLog.debug("TE: (SGR) Select Graphic Rendition: Unsupported: '%s'."%
-                             (orig_params), 1)
+        delta = self.sgrCache.get(params)
+        if delta is None:
+            delta = self.__DecodeSGR(first, params, last)
+            if delta is None:
                 return
-            fg = True if params[0] == '38' else False
-            color = int(params[2])
-            if fg:
-                self.__SetRenditionBits(fg=color)
-            else:
-                self.__SetRenditionBits(bg=color)
-            glsLog.debug("TE: (SGR) Select Graphic Rendition: %scolor: %s."%
-                         ('fg' if fg else 'bg', color), 3)
-            return
-        renditions = params.split(';')
-        for rendition in renditions:
-            irendition = int(rendition)
-            if irendition == 0:
-                # reset rendition
-                self.curRendition = 0
-            elif irendition > 0 and irendition < 9:
-                # style
-                self.__SetRenditionBits(style=(1<<(irendition-1), True))
-            elif irendition >= 30 and irendition <= 37:
-                # foreground
-                self.__SetRenditionBits(fg=(irendition-30))
-            elif irendition >= 40 and irendition <= 47:
-                # background
-                self.__SetRenditionBits(bg=(irendition-40))
-            elif irendition == 27:
-                # reverse video off
-                self.__SetRenditionBits(style=(self.RENDITION_STYLE_INVERSE, False))
-            elif irendition == 39:
-                # set underline off, set default foreground color
-                self.__SetRenditionBits(style=(self.RENDITION_STYLE_UNDERLINE, False), fg=0)
-            elif irendition == 49:
-                # set default background color
-                self.__SetRenditionBits(bg=0)
-            else:
-                glsLog.debug("TE: (SGR) Select Graphic Rendition: Unsupported %d"%
-                             (irendition), 1)
-                pass
-        glsLog.debug("TE: (SGR) Select Graphic Rendition: '%s'"%(first+params+last), 5)
+        self.curRendition = (self.curRendition & ~delta[0]) | delta[1]
+        glsLog.debug("TE: (SGR) Select Graphic Rendition: '%s'", 5, first+params+last)
         return
     def __OnEscSeqDSR(self, first, params, last):
         # Handler DSR: Device Status Report
@@ -1269,8 +1533,8 @@ class V102Terminal:
             self.__UnhandledEscSeq(first+params+last)
             return
         self.__Callback(self.CALLBACK_SEND_DATA, reply)
-        glsLog.debug("TE: (DSR) Device Status Report: '%s' reply='%s'"%
-                     (first+params+last, reply), 3)
+        glsLog.debug("TE: (DSR) Device Status Report: '%s' reply='%s'", 3,
+                     first+params+last, reply)
         return
     def __OnEscSeqSMRM(self, first, params, last, enable):
         if enable:
@@ -1278,7 +1542,7 @@ class V102Terminal:
         else:
             label = "(RM) Reset Mode"
         if params == None or params == '':
-            glsLog.debug("TE: %s: No Parameter!"%(label), 1)
+            glsLog.debug("TE: %s: No Parameter!", 1, label)
             return
         if params.startswith('?'):
             params = params[1:]
@@ -1288,13 +1552,13 @@ class V102Terminal:
         for param in params.split(';'):
             param = prefix + param
             if param not in self.modes:
-                glsLog.debug("TE: %s: Unknown Mode: '%s'!"%(label, param), 1)
+                glsLog.debug("TE: %s: Unknown Mode: '%s'!", 1, label, param)
                 continue
             if param in self.modeHandlers:
                 self.modeHandlers[param](enable)
             self.modes[param] = enable
         self.__Callback(self.CALLBACK_UPDATE_MODE, self.modes)
-        glsLog.debug("TE: %s: '%s'"%(label, first+params+last), 3)
+        glsLog.debug("TE: %s: '%s'", 3, label, first+params+last)
         return
     def __OnEscSeqSM(self, first, params, last):
         # Handler SM: Sets Mode
@@ -1325,7 +1589,7 @@ class V102Terminal:
         if style != self.cursorStyle:
             self.cursorStyle = style
             self.__Callback(self.CALLBACK_UPDATE_CURSOR, self.cursorStyle)
-        glsLog.debug("TE: (DECSCUSR) Cursor Style: %d"%(style), 3)
+        glsLog.debug("TE: (DECSCUSR) Cursor Style: %d", 3, style)
         return
     def __OnEscSeqDECSTBM(self, first, params, last):
         # Handler DECSTBM: Set Top / Bottom Margins (Scroll Region)
@@ -1340,21 +1604,21 @@ class V102Terminal:
         top = int(top) - 1
         bottom = int(bottom) - 1
         top = max(top, 0)
-        bottom = min(bottom, self.cols-1)
+        bottom = min(bottom, self.rows-1)
         if top >= bottom:
             top = 0
             bottom = self.rows - 1
         self.scrollRegion = (top, bottom)
         self.curX = 0
         self.curY = 0
-        glsLog.debug("TE: (DECSTBM) Top/Bottom Margins: (%d,%d) '%s' rows=%d"%
-                     (top, bottom, first+params+last, self.rows), 3)
+        glsLog.debug("TE: (DECSTBM) Top/Bottom Margins: (%d,%d) '%s' rows=%d", 3,
+                     top, bottom, first+params+last, self.rows)
         return
     def __OnEscSeqDA2(self, first, params, last):
         # Handler DA2: Secondary Device Attributes
         reply = '\x1b[>1;' + glsVersion.replace('.','')  + ';0c'
         self.__Callback(self.CALLBACK_SEND_DATA, reply)
-        glsLog.debug("TE: (DA2) Device Attributes Secondary: Sending '%s'"%(reply), 3)
+        glsLog.debug("TE: (DA2) Device Attributes Secondary: Sending '%s'", 3, reply)
         return
     def __OnEscSeqCSZ(self, first, params, last):
         # Handler CSZ: Cursor Style / Size
@@ -1373,35 +1637,32 @@ class V102Terminal:
         if style != self.cursorStyle:
             self.cursorStyle = style
             self.__Callback(self.CALLBACK_UPDATE_CURSOR, self.cursorStyle)
-        glsLog.debug("TE: (CSZ) Cursor Style: %d"%(style), 3)
+        glsLog.debug("TE: (CSZ) Cursor Style: %d", 3, style)
         return
     def __OnEscSeqTWS(self, first, params, last):
         # Handler TWS: Terminal Window Settings
         if params == None:
             glsLog.debug("TE: (TWS) Terminal Window Settings: No Parameter!", 1)
             return
-        glsLog.debug("TE: (TWS) Not Implemented: '%s'."%(first+params+last), 1)
+        glsLog.debug("TE: (TWS) Not Implemented: '%s'.", 1, first+params+last)
         return
     ################################################################
     # Escape Handlers (Non-CSI)
     ################################################################
     def __OnEscIND(self):
         # Handler IND: Index (Linefeed)
-        glsLog.debug("TE: (IND) Index: @ (%d,%d)"%
-                     (self.curY, self.curX), 3)
+        glsLog.debug("TE: (IND) Index: @ (%d,%d)", 3, self.curY, self.curX)
         self.__NewLine()
         return
     def __OnEscNEL(self):
         # Handler NEL: Next Line
-        glsLog.debug("TE: (NEL) Next Line: @ (%d,%d)"%
-                     (self.curY, self.curX), 3)
+        glsLog.debug("TE: (NEL) Next Line: @ (%d,%d)", 3, self.curY, self.curX)
         self.curX = 0
         self.__NewLine()
         return
     def __OnEscRI(self):
         # Handler RI: Reverse Index (LineFeed)
-        glsLog.debug("TE: (RI) Reverse Index @ (%d,%d)"%
-                     (self.curY, self.curX), 3)
+        glsLog.debug("TE: (RI) Reverse Index @ (%d,%d)", 3, self.curY, self.curX)
         if self.curY == self.scrollRegion[0]:
             self.__ScrollDown()
             return
@@ -1445,7 +1706,7 @@ class V102Terminal:
     ################################################################
     # Extended Escape Sequence Handlers
     ################################################################
-    def __OnExICON_TITLE(self):
+    def __OnExICON_TITLE(self, first, params):
         # Handler: Window Title
         glsLog.debug("TE: Set Window Title: Unimplemented.", 1)
         #self.__Callback(self.CALLBACK_UPDATE_WINDOW_TITLE, params)
@@ -9,6 +9,7 @@ import wx
 
 from glsGLBuffer import glsGLBuffer
 from glsSettings import glsSettings
+from glsRepaint import glsRepaint
 from glsDirTree import glsFile
 from glsDirTree import glsDir
 from glsDirTree import glsDirTree
@@ -396,13 +397,12 @@ class glsGraphCanvas(GLCanvas):
         return
     def PushFrames(self):
         # Draw frames repeatedly.
-        wx.YieldIfNeeded()
         if self.closing:
             self.done = True
             return
         if not self.refresh:
             self.refresh = True
-            self.Refresh()
+            glsRepaint.Invalidate(self)
         wx.CallLater(int(1000.0/self.fps_max), self.PushFrames)
         return
     def OnChar(self, event):
@@ -6,20 +6,33 @@ from glsSettings import glsSettings
 
 class glsLogManager():
     __log = None
+    __level = None
     def __init__(self):
         if glsLogManager.__log is None:
             now = datetime.now().strftime("%m/%d/%Y %H:%M:%S")
             glsLogManager.__log = [ (now, "Begin GLShell Log") ]
+        if glsLogManager.__level is None:
+            glsLogManager.__level = glsSettings.Get('log_level')
+            glsSettings.AddWatcher(self.OnChangeSettings)
+        return
+    def OnChangeSettings(self):
+        # Cache the debug threshold so debug() does not query settings per call.
+        glsLogManager.__level = glsSettings.Get('log_level')
         return
     def add(self, text):
         now = datetime.now().strftime("%m/%d/%Y %H:%M:%S")
         #print(now, text)
         glsLogManager.__log.append( (now, text) )
         return
-    def debug(self, text, level):
-        if glsSettings.Get('log_level') >= level:
+    def debug(self, text, level, *args):
+        # Any args are only formatted into text when the level is enabled.
+        if glsLogManager.__level >= level:
+            if args:
+                text = text%args
             self.add("(debug-#%d) %s"%(level, text))
         return
+    def enabled(self, level):
+        return glsLogManager.__level >= level
     def get(self, index=None):
         if index is not None:
             return glsLogManager.__log[index]
@@ -0,0 +1,183 @@
+import os
+import select
+import traceback
+import selectors
+import threading
+
+from glsLog import glsLog
+
+################################################################
+
+class glsReactorManager():
+    """
+    One I/O thread for the master fds of all terminals. A terminal registers
+    its fd and child pid with two callbacks, both called on the reactor thread:
+    - on_output() when the fd becomes readable. The fd is then paused until
+      Resume(fd) is called, so the reader owns the fd until it has drained it.
+    - on_exit() once the child has exited; the child is reaped and the fd is
+      no longer watched.
+    The thread blocks in epoll without a timeout, except while a child whose
+    fd hung up is waited for; requests from other threads are queued and wake
+    it through a pipe.
+    """
+    __lock = None
+    __thread = None
+    __selector = None
+    __wakeup = None
+    __requests = None
+    __terminals = None
+    __reap_delay = 0.05
+    def __init__(self):
+        if glsReactorManager.__lock is None:
+            glsReactorManager.__lock = threading.Lock()
+            glsReactorManager.__requests = []
+            glsReactorManager.__terminals = {}
+        return
+    def Register(self, fd, pid, on_output, on_exit):
+        self.__Request(('register', fd, pid, on_output, on_exit))
+        return
+    def Resume(self, fd):
+        self.__Request(('resume', fd))
+        return
+    def Unregister(self, fd):
+        self.__Request(('unregister', fd))
+        return
+    def __Request(self, request):
+        with glsReactorManager.__lock:
+            glsReactorManager.__requests.append(request)
+            if glsReactorManager.__thread is None:
+                self.__Start()
+        try:
+            os.write(glsReactorManager.__wakeup[1], b'\0')
+        except BlockingIOError:
+            # The pipe is full, so the thread is already woken up.
+            pass
+        return
+    def __Start(self):
+        glsReactorManager.__selector = selectors.DefaultSelector()
+        glsReactorManager.__wakeup = os.pipe()
+        for fd in glsReactorManager.__wakeup:
+            os.set_blocking(fd, False)
+        glsReactorManager.__selector.register(glsReactorManager.__wakeup[0],
+                                              selectors.EVENT_READ, ('wakeup', None))
+        glsReactorManager.__thread = threading.Thread(target=self.__Run, daemon=True)
+        glsReactorManager.__thread.start()
+        return
+    def __Run(self):
+        selector = glsReactorManager.__selector
+        while True:
+            reaping = [ fd for fd, terminal in glsReactorManager.__terminals.items()
+                        if terminal['reaping'] ]
+            timeout = glsReactorManager.__reap_delay if reaping else None
+            for key, events in selector.select(timeout):
+                kind, fd = key.data
+                if kind == 'wakeup':
+                    self.__OnWakeup()
+                elif kind == 'output':
+                    self.__OnOutput(fd)
+                elif kind == 'exit':
+                    self.__OnExit(fd)
+            for fd in reaping:
+                self.__OnExit(fd)
+        return
+    def __OnWakeup(self):
+        try:
+            while os.read(glsReactorManager.__wakeup[0], 4096):
+                pass
+        except BlockingIOError:
+            pass
+        with glsReactorManager.__lock:
+            requests = glsReactorManager.__requests
+            glsReactorManager.__requests = []
+        for request in requests:
+            if request[0] == 'register':
+                self.__DoRegister(*request[1:])
+            elif request[0] == 'resume':
+                self.__Arm(request[1])
+            elif request[0] == 'unregister':
+                self.__DoUnregister(request[1])
+        return
+    def __DoRegister(self, fd, pid, on_output, on_exit):
+        try:
+            pidfd = os.pidfd_open(pid)
+        except (AttributeError, OSError):
+            # Without pidfd, child exit is detected by hangup of the fd.
+            pidfd = None
+        # Hangup is only reported by poll(); selectors hides it.
+        hangup = select.poll()
+        hangup.register(fd, select.POLLIN)
+        glsReactorManager.__terminals[fd] = { 'pid': pid,
+                                              'poll': hangup,
+                                              'pidfd': pidfd,
+                                              'on_output': on_output,
+                                              'on_exit': on_exit,
+                                              'armed': False,
+                                              'hangup': False,
+                                              'reaping': False }
+        if pidfd is not None:
+            glsReactorManager.__selector.register(pidfd, selectors.EVENT_READ,
+                                                  ('exit', fd))
+        self.__Arm(fd)
+        return
+    def __DoUnregister(self, fd):
+        terminal = glsReactorManager.__terminals.pop(fd, None)
+        if terminal is None:
+            return
+        if terminal['armed']:
+            glsReactorManager.__selector.unregister(fd)
+        if terminal['pidfd'] is not None:
+            glsReactorManager.__selector.unregister(terminal['pidfd'])
+            os.close(terminal['pidfd'])
+        return
+    def __Arm(self, fd):
+        terminal = glsReactorManager.__terminals.get(fd)
+        if terminal is None or terminal['armed'] or terminal['hangup']:
+            return
+        try:
+            glsReactorManager.__selector.register(fd, selectors.EVENT_READ, ('output', fd))
+            terminal['armed'] = True
+        except (OSError, ValueError):
+            terminal['hangup'] = True
+        return
+    def __OnOutput(self, fd):
+        terminal = glsReactorManager.__terminals.get(fd)
+        if terminal is None or not terminal['armed']:
+            # Unregistered earlier in the same batch of events.
+            return
+        glsReactorManager.__selector.unregister(fd)
+        terminal['armed'] = False
+        # After a hangup the fd stays ready forever, so it is not armed again.
+        for pfd, events in terminal['poll'].poll(0):
+            if events & (select.POLLHUP | select.POLLERR | select.POLLNVAL):
+                terminal['hangup'] = True
+        self.__Call(terminal['on_output'])
+        if terminal['hangup'] and terminal['pidfd'] is None:
+            self.__OnExit(fd)
+        return
+    def __OnExit(self, fd):
+        terminal = glsReactorManager.__terminals.get(fd)
+        if terminal is None:
+            return
+        try:
+            pid, status = os.waitpid(terminal['pid'], os.WNOHANG)
+        except ChildProcessError:
+            pid = terminal['pid']
+        if pid == 0:
+            # The fd hung up before the child exited; __Run() retries.
+            terminal['reaping'] = True
+            return
+        self.__DoUnregister(fd)
+        self.__Call(terminal['on_exit'])
+        return
+    def __Call(self, callback):
+        try:
+            callback()
+        except:
+            glsLog.add("Reactor: Exception in callback!\n%s"%(traceback.format_exc()))
+        return
+
+################################################################
+
+glsReactor = glsReactorManager()
+
+################################################################
@@ -0,0 +1,62 @@
+import wx
+from time import monotonic
+
+################################################################
+
+class glsRepaintManager():
+    """
+    Coalesces the repaints of all panels. Windows report damage with
+    Invalidate() instead of calling Refresh(); at most once per frame interval
+    the collected damage is handed to wx and painted at once with Update().
+    Invalidate() only records the damage, so it is safe to call from emulator
+    and timer callbacks, and nothing here re-enters the event loop. Flushing
+    goes through the wx.Window methods directly, so a window may route its own
+    Refresh() here. Main thread only.
+    """
+    __frame = 0.016
+    __dirty = None
+    __pending = False
+    __last = 0.0
+    def __init__(self):
+        if glsRepaintManager.__dirty is None:
+            glsRepaintManager.__dirty = {}
+        return
+    def Invalidate(self, window, rect=None):
+        # A rect of None damages the whole window.
+        dirty = glsRepaintManager.__dirty
+        if rect is None:
+            dirty[window] = None
+        elif window not in dirty:
+            dirty[window] = [ wx.Rect(rect) ]
+        elif dirty[window] is not None:
+            dirty[window].append(wx.Rect(rect))
+        if not glsRepaintManager.__pending:
+            glsRepaintManager.__pending = True
+            delay = glsRepaintManager.__last + glsRepaintManager.__frame - monotonic()
+            if delay > 0:
+                wx.CallLater(max(int(delay*1000), 1), self.Flush)
+            else:
+                wx.CallAfter(self.Flush)
+        return
+    def Flush(self):
+        glsRepaintManager.__pending = False
+        glsRepaintManager.__last = monotonic()
+        dirty = glsRepaintManager.__dirty
+        glsRepaintManager.__dirty = {}
+        # Skip windows destroyed since they were invalidated.
+        windows = [ window for window in dirty if window ]
+        for window in windows:
+            if dirty[window] is None:
+                wx.Window.Refresh(window, False)
+            else:
+                for rect in dirty[window]:
+                    wx.Window.RefreshRect(window, rect, False)
+        for window in windows:
+            wx.Window.Update(window)
+        return
+
+################################################################
+
+glsRepaint = glsRepaintManager()
+
+################################################################
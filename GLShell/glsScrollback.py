@@ -0,0 +1,468 @@
+import os
+import mmap
+import struct
+import traceback
+from time import monotonic
+from array import array
+from itertools import groupby
+from collections import OrderedDict
+
+from glsLog import glsLog
+
+################################################################
+
+class glsScrollback():
+    """
+    The lines scrolled off the top of a terminal, kept in a ring of at most
+    capacity lines. Once full, appending a line overwrites the oldest one.
+    Lines are indexed from the oldest, as in a list.
+    Lines are stored encoded: the text as UTF-8 without trailing blanks and
+    the renditions as (start, length, value) runs of non-default cells.
+    They are decoded when read, which is only done for rows on screen.
+    With a glsScrollbackSpill, lines leaving the ring are moved to disk
+    instead of being dropped; they come before the ring in the index.
+    For Find(), every line also has an absolute number that does not change
+    as older lines are dropped. Blocks of INDEX_BLOCK lines are summarized
+    by a bloom filter of their trigrams, built by UpdateIndex() when idle, so
+    a literal search only scans the blocks that may contain it.
+    On resize only the newest lines are reflowed with the screen; older
+    lines keep the width they were wrapped at.
+    """
+    CACHE_SIZE = 1024
+    INDEX_BLOCK = 1024
+    INDEX_BITS = 32768
+    INDEX_LINES = 4*1024*1024
+    REFLOW_LINES = 4096
+    def __init__(self, capacity, spill=None):
+        self.capacity = max(capacity, 0)
+        self.spill = spill
+        self.Clear()
+        # Absolute number of the line after the newest one.
+        self.total = 0
+        self.index = {}
+        self.index_next = 0
+        return
+    def __len__(self):
+        return len(self.lines) + self.Spilled()
+    def Spilled(self):
+        return len(self.spill) if self.spill is not None else 0
+    def Close(self):
+        if self.spill is not None:
+            self.spill.Close()
+            self.spill = None
+        return
+    def Clear(self):
+        self.lines = []
+        self.runs = []
+        self.wrapped = bytearray()
+        self.start = 0
+        self.cache = {}
+        return
+    def Encode(self, text, rendition, wrapped):
+        # A soft-wrapped line is kept whole so that reflow can join it.
+        keep = len(rendition)
+        if not wrapped:
+            keep = len(text.rstrip(u' '))
+            tail = rendition[keep:]
+            if tail.count(0) != len(tail):
+                keep = len(rendition)
+                while not rendition[keep-1]:
+                    keep -= 1
+        line = text[:keep].encode('utf-8', 'surrogatepass')
+        cells = rendition[:keep]
+        if cells.count(0) == keep:
+            return line, b''
+        runs = array('I')
+        start = 0
+        for value, group in groupby(cells):
+            length = len(tuple(group))
+            if value:
+                runs.extend((start, length, value))
+            start += length
+        return line, runs.tobytes()
+    def Decode(self, line, runs, cols=0):
+        # Text and renditions of an encoded line, padded to cols.
+        text = line.decode('utf-8', 'surrogatepass')
+        width = max(len(text), cols)
+        if width > len(text):
+            text += u' '*(width - len(text))
+        rendition = array('L', [0])*width
+        if runs:
+            triples = array('I')
+            triples.frombytes(runs)
+            for i in range(0, len(triples), 3):
+                start, length, value = triples[i:i+3]
+                rendition[start:start+length] = array('L', [value])*length
+        return text, rendition
+    def Append(self, text, rendition, wrapped):
+        line, runs = self.Encode(text, rendition, wrapped)
+        if len(self.lines) < self.capacity:
+            self.lines.append(line)
+            self.runs.append(runs)
+            self.wrapped.append(wrapped)
+        elif not self.capacity:
+            if self.spill is not None:
+                self.spill.Append(line, runs, wrapped)
+        else:
+            slot = self.start
+            if self.spill is not None:
+                self.spill.Append(self.lines[slot], self.runs[slot], self.wrapped[slot])
+            self.lines[slot] = line
+            self.runs[slot] = runs
+            self.wrapped[slot] = wrapped
+            self.cache.pop(slot, None)
+            self.start = (slot + 1) % self.capacity
+        self.total += 1
+        return
+    def GetLine(self, index, cols):
+        # Decoded lines are cached, as a frame reads the same rows repeatedly.
+        # Ring lines are keyed by slot, spilled lines by their number.
+        spilled = self.Spilled()
+        if index < spilled:
+            key = -1 - (self.spill.first + index)
+        else:
+            key = (self.start + index - spilled) % len(self.lines)
+        cached = self.cache.get(key)
+        if cached is not None and cached[0] == cols:
+            return cached[1], cached[2]
+        if len(self.cache) >= self.CACHE_SIZE:
+            self.cache.clear()
+        if key < 0:
+            line, runs, wrapped = self.spill.Read(index)
+        else:
+            line, runs = self.lines[key], self.runs[key]
+        text, rendition = self.Decode(line, runs, cols)
+        self.cache[key] = (cols, text, rendition)
+        return text, rendition
+    def GetLines(self, start, end, cols=0):
+        # Texts and renditions of lines start to end, clipped to the history
+        # and padded to cols.
+        texts = []
+        renditions = []
+        for index in range(max(start, 0), min(end, len(self))):
+            text, rendition = self.GetLine(index, cols)
+            texts.append(text)
+            renditions.append(rendition)
+        return texts, renditions
+    def GetHistory(self, count):
+        # Decoded lists of texts, renditions and wrapped flags of the newest
+        # count lines of the ring, oldest first, for reflow. More lines are
+        # taken, up to REFLOW_LINES, to start after a hard line break.
+        # Spilled lines are not included.
+        size = len(self.lines)
+        first = max(size - count, 0)
+        limit = max(first - self.REFLOW_LINES, 0)
+        while first > limit and self.wrapped[(self.start + first - 1) % size]:
+            first -= 1
+        texts = []
+        renditions = []
+        wrapped = []
+        for index in range(first, size):
+            slot = (self.start + index) % size
+            text, rendition = self.Decode(self.lines[slot], self.runs[slot])
+            texts.append(text)
+            renditions.append(rendition)
+            wrapped.append(self.wrapped[slot])
+        return texts, renditions, wrapped
+    def SetHistory(self, texts, renditions, wrapped, count):
+        # Replaces the newest count lines of the ring, as from GetHistory().
+        # Past capacity the oldest lines are spilled or dropped. The new lines
+        # are numbered from the first replaced line on, and their index blocks
+        # are rebuilt.
+        size = len(self.lines)
+        first = size - count
+        self.total -= count
+        self.DropIndex(self.total // self.INDEX_BLOCK)
+        self.cache = {}
+        replace = min(count, len(texts))
+        for index in range(replace):
+            slot = (self.start + first + index) % size
+            line, runs = self.Encode(texts[index], renditions[index], wrapped[index])
+            self.lines[slot] = line
+            self.runs[slot] = runs
+            self.wrapped[slot] = wrapped[index]
+        self.total += replace
+        if replace < count:
+            # Fewer lines: unroll the ring to cut its end.
+            self.Unroll()
+            del self.lines[first + replace:]
+            del self.runs[first + replace:]
+            del self.wrapped[first + replace:]
+        for index in range(replace, len(texts)):
+            self.Append(texts[index], renditions[index], wrapped[index])
+        return
+    def Unroll(self):
+        # Puts the lines of the ring in order, oldest first, at slot 0.
+        start = self.start
+        self.lines = self.lines[start:] + self.lines[:start]
+        self.runs = self.runs[start:] + self.runs[:start]
+        self.wrapped = self.wrapped[start:] + self.wrapped[:start]
+        self.start = 0
+        self.cache = {}
+        return
+    def SetCapacity(self, capacity):
+        # Only the newest capacity lines are kept; older ones are spilled or
+        # dropped.
+        capacity = max(capacity, 0)
+        if capacity == self.capacity:
+            return
+        self.Unroll()
+        keep = max(len(self.lines) - capacity, 0)
+        if self.spill is not None:
+            for index in range(keep):
+                self.spill.Append(self.lines[index], self.runs[index], self.wrapped[index])
+        self.capacity = capacity
+        del self.lines[:keep]
+        del self.runs[:keep]
+        del self.wrapped[:keep]
+        return
+    def GetFirst(self):
+        # Absolute number of the oldest line.
+        return self.total - len(self)
+    def GetEncoded(self, index):
+        spilled = self.Spilled()
+        if index < spilled:
+            return self.spill.Read(index)[0]
+        return self.lines[(self.start + index - spilled) % len(self.lines)]
+    def GetText(self, index):
+        # Text and wrapped flag of a line, without decoding its renditions.
+        # Only soft-wrapped lines keep their trailing blanks.
+        spilled = self.Spilled()
+        if index < spilled:
+            line, runs, wrapped = self.spill.Read(index)
+        else:
+            slot = (self.start + index - spilled) % len(self.lines)
+            line, wrapped = self.lines[slot], self.wrapped[slot]
+        return line.decode('utf-8', 'surrogatepass'), wrapped
+    def DropIndex(self, block):
+        # Forgets the summaries of block and newer ones.
+        for old in [ old for old in self.index if old >= block ]:
+            del self.index[old]
+        self.index_next = min(self.index_next, block)
+        return
+    def IndexPending(self):
+        return (self.index_next + 1)*self.INDEX_BLOCK <= self.total
+    def UpdateIndex(self, deadline):
+        # Summarizes complete blocks until the deadline. Only the newest
+        # INDEX_LINES lines are summarized. Returns True if blocks are left.
+        first = self.GetFirst()
+        oldest = max(first, self.total - self.INDEX_LINES) // self.INDEX_BLOCK
+        for old in [ old for old in self.index if old < oldest ]:
+            del self.index[old]
+        self.index_next = max(self.index_next, oldest)
+        while self.IndexPending() and monotonic() < deadline:
+            start = max(self.index_next*self.INDEX_BLOCK, first)
+            end = (self.index_next + 1)*self.INDEX_BLOCK
+            if start < end:
+                self.index[self.index_next] = self.IndexLines(start - first, end - first)
+            self.index_next += 1
+        return self.IndexPending()
+    def IndexLines(self, start, end):
+        data = b'\n'.join([ self.GetEncoded(index) for index in range(start, end) ]).lower()
+        bits = bytearray(self.INDEX_BITS // 8)
+        for gram in set(zip(data, data[1:], data[2:])):
+            bit = self.GramBit(gram)
+            bits[bit >> 3] |= 1 << (bit & 7)
+        return bytes(bits)
+    def GramBit(self, gram):
+        value = (gram[0] << 16) | (gram[1] << 8) | gram[2]
+        return ((value * 0x9E3779B1) >> 11) & (self.INDEX_BITS - 1)
+    def FindGrams(self, text, case=True):
+        # Bloom bits a line containing the literal text must have. Index
+        # data is folded to ASCII lower case; without case, grams outside
+        # ASCII are left out as they may match in another case.
+        data = text.encode('utf-8', 'surrogatepass').lower()
+        grams = set(zip(data, data[1:], data[2:]))
+        if not case:
+            grams = [ gram for gram in grams if max(gram) < 128 ]
+        return [ self.GramBit(gram) for gram in grams ]
+    def Find(self, pattern, bits=()):
+        # Yields (line, col, length) of the matches of a compiled pattern,
+        # newest first, with absolute line numbers. Blocks are searched from
+        # the newest one; None is yielded after each block so that callers
+        # can spread a search over several frames.
+        block = (self.total - 1) // self.INDEX_BLOCK
+        while block >= 0:
+            first = self.GetFirst()
+            start = max(block*self.INDEX_BLOCK, first)
+            end = min((block + 1)*self.INDEX_BLOCK, self.total)
+            if start >= end:
+                break
+            summary = self.index.get(block)
+            if summary is None or all(summary[bit >> 3] & (1 << (bit & 7)) for bit in bits):
+                found = self.FindInLines(pattern, start - first, end - first)
+                for line, col, length in reversed(found):
+                    yield first + line, col, length
+            yield None
+            block -= 1
+        return
+    def FindInLines(self, pattern, start, end):
+        # Matches in lines start to end, in order; matches do not span lines.
+        lines = [ self.GetEncoded(index) for index in range(start, end) ]
+        text = b'\n'.join(lines).decode('utf-8', 'surrogatepass')
+        found = []
+        line = start
+        line_start = 0
+        scanned = 0
+        for match in pattern.finditer(text):
+            pos = match.start()
+            if match.end() == pos:
+                continue
+            newlines = text.count('\n', scanned, pos)
+            if newlines:
+                line += newlines
+                line_start = text.rindex('\n', scanned, pos) + 1
+            scanned = pos
+            line_end = text.find('\n', pos)
+            if line_end == -1:
+                line_end = len(text)
+            if line_end > pos:
+                found.append( (line, pos - line_start, min(match.end(), line_end) - pos) )
+        return found
+
+################################################################
+
+class glsScrollbackSpill():
+    """
+    Append-only disk store for scrollback lines, in segment files of
+    SEGMENT_LINES encoded lines each. A full segment is sealed by writing its
+    line-offset index at its end; it is then read through mmap, so only the
+    pages of the lines read are loaded. The segments of a terminal are
+    removed by Close(), and the oldest are dropped past max_lines (0 for no
+    limit). Segments left behind by exited processes are removed on start.
+    """
+    SEGMENT_LINES = 65536
+    MAX_MAPS = 8
+    RECORD = struct.Struct('<IIB')
+    TRAILER = struct.Struct('<Q')
+    __serial = 0
+    __cleaned = False
+    def __init__(self, path, max_lines=0):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.max_lines = max(max_lines, 0)
+        self.segments = []
+        self.active = None
+        self.maps = OrderedDict()
+        # Number of the first stored line among all lines ever appended.
+        self.first = 0
+        self.count = 0
+        self.failed = False
+        return
+    def __len__(self):
+        return self.count
+    def Append(self, line, runs, wrapped):
+        if self.failed:
+            return
+        try:
+            if self.active is None:
+                self.OpenSegment()
+            record = self.RECORD.pack(len(line), len(runs), wrapped) + line + runs
+            active = self.active
+            active['offsets'].append(active['size'])
+            active['file'].write(record)
+            active['size'] += len(record)
+            self.count += 1
+            if len(active['offsets']) == self.SEGMENT_LINES:
+                self.SealSegment()
+            while (self.max_lines and len(self.segments) > 1 and
+                   self.count - self.SEGMENT_LINES >= self.max_lines):
+                self.DropSegment()
+        except OSError:
+            glsLog.add("Scrollback: Can not spill to '%s', lines are dropped!\n%s"%
+                       (self.path, traceback.format_exc()))
+            self.failed = True
+        return
+    def Read(self, index):
+        # Encoded line, renditions and wrapped flag of a stored line.
+        segment = self.segments[index // self.SEGMENT_LINES]
+        line = index % self.SEGMENT_LINES
+        if segment is self.active:
+            offsets = segment['offsets']
+            start = offsets[line]
+            end = offsets[line+1] if line+1 < len(offsets) else segment['size']
+            segment['file'].flush()
+            data = os.pread(segment['file'].fileno(), end - start, start)
+            start = 0
+        else:
+            data = self.GetMap(segment)
+            count, = self.TRAILER.unpack_from(data, len(data) - self.TRAILER.size)
+            table = len(data) - self.TRAILER.size - count*8
+            start, = self.TRAILER.unpack_from(data, table + line*8)
+        length, runs, wrapped = self.RECORD.unpack_from(data, start)
+        start += self.RECORD.size
+        return (bytes(data[start:start+length]),
+                bytes(data[start+length:start+length+runs]), wrapped)
+    def OpenSegment(self):
+        if not glsScrollbackSpill.__cleaned:
+            glsScrollbackSpill.__cleaned = True
+            self.RemoveStale()
+        os.makedirs(self.path, mode=0o700, exist_ok=True)
+        glsScrollbackSpill.__serial += 1
+        path = os.path.join(self.path, "%d-%d.seg"%(os.getpid(), glsScrollbackSpill.__serial))
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        self.active = { 'path': path,
+                        'file': os.fdopen(fd, 'w+b'),
+                        'offsets': array('Q'),
+                        'size': 0 }
+        self.segments.append(self.active)
+        return
+    def SealSegment(self):
+        active = self.active
+        active['file'].write(active['offsets'].tobytes())
+        active['file'].write(self.TRAILER.pack(len(active['offsets'])))
+        active['file'].close()
+        self.segments[-1] = { 'path': active['path'] }
+        self.active = None
+        return
+    def DropSegment(self):
+        segment = self.segments.pop(0)
+        data = self.maps.pop(segment['path'], None)
+        if data is not None:
+            data.close()
+        os.remove(segment['path'])
+        self.first += self.SEGMENT_LINES
+        self.count -= self.SEGMENT_LINES
+        return
+    def GetMap(self, segment):
+        # A few sealed segments stay mapped, least recently used is unmapped.
+        path = segment['path']
+        data = self.maps.get(path)
+        if data is not None:
+            self.maps.move_to_end(path)
+            return data
+        if len(self.maps) >= self.MAX_MAPS:
+            self.maps.popitem(last=False)[1].close()
+        with open(path, 'rb') as segment_file:
+            data = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.maps[path] = data
+        return data
+    def RemoveStale(self):
+        if not os.path.isdir(self.path):
+            return
+        for name in os.listdir(self.path):
+            if not name.endswith('.seg'):
+                continue
+            try:
+                os.kill(int(name.split('-')[0]), 0)
+            except ProcessLookupError:
+                os.remove(os.path.join(self.path, name))
+            except (ValueError, OSError):
+                pass
+        return
+    def Close(self):
+        for data in self.maps.values():
+            data.close()
+        self.maps.clear()
+        if self.active is not None:
+            self.active['file'].close()
+            self.active = None
+        for segment in self.segments:
+            try:
+                os.remove(segment['path'])
+            except OSError:
+                pass
+        self.segments = []
+        self.count = 0
+        return
+
+################################################################
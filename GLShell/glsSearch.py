@@ -11,6 +11,7 @@ from multiprocessing import Process, Queue, Event
 from glsDirTree import glsFile
 from glsIcons import glsIcons
 from glsLog import glsLog
+from glsRepaint import glsRepaint
 
 ################################################################
 
@@ -424,8 +425,7 @@ class glsSearchResultList(wx.VListBox):
         for result in results:
             self.search.AddResult(result)
         self.SetItemCount(len(self.search.GetResults()) + 1)
-        self.Refresh()
-        wx.YieldIfNeeded()
+        glsRepaint.Invalidate(self)
         return
     def PollResults(self):
         if self.closing:
@@ -443,8 +443,6 @@ class glsSearchResultList(wx.VListBox):
                 results.append(result)
                 if len(results) >= 10000:
                     break
-                if not len(results)%1000:
-                    wx.YieldIfNeeded()
                 if self.closing:
                     self.result_poll_done = True
                     return
@@ -453,7 +451,7 @@ class glsSearchResultList(wx.VListBox):
         self.ProcessResults(results)
         if self.proc is None:
             self.result_poll_done = True
-            self.Refresh()
+            glsRepaint.Invalidate(self)
             log = "Search Done:"
             log += " name=('%s',%s)"%(self.search.name_text,
                                       "regex" if self.search.name_regx else "str")
@@ -462,7 +460,6 @@ class glsSearchResultList(wx.VListBox):
             log += " " + str(len(self.search.GetResults())) + " results\n"
             log += "\n".join([dt.abspath for dt in self.search.dirtrees])
             glsLog.add(log)
-            wx.YieldIfNeeded()
             return
         wx.CallLater(150, self.PollResults)
         return
@@ -21,6 +21,14 @@ class glsSettingsManager():
                                   "-z0123456789,./?%&#:_=+@~",
                    "term_font": "Monospace",
                    "term_font_size": 11,
+                   "term_read_max": 262144,
+                   "term_threaded": False,
+                   "term_backlog_max": 1048576,
+                   "term_scrollback": 10000,
+                   "term_spill": False,
+                   "term_spill_path": "~/.glshell_scrollback",
+                   "term_spill_max": 0,
+                   "term_gl": False,
                    "graph_3D": True,
                    "graph_ignore": (".git", ".svn"),
                    "graph_font": "Monospace",
@@ -141,13 +141,46 @@ class TabTerminal(wx.Panel):
         self.cb_termscrlkp = wx.CheckBox(self, wx.ID_ANY, "Scroll on Keypress")
         self.cb_termscrlkp.SetValue(glsSettings.Get('term_scroll_keypress'))
         row3.Add(self.cb_termscrlkp, 0, wx.ALIGN_CENTER | wx.LEFT | wx.RIGHT, 5)
+        self.cb_termthread = wx.CheckBox(self, wx.ID_ANY, "Parse in Background")
+        self.cb_termthread.SetValue(glsSettings.Get('term_threaded'))
+        row3.Add(self.cb_termthread, 0, wx.ALIGN_CENTER | wx.LEFT | wx.RIGHT, 5)
         vbox.Add(row3, 0, wx.EXPAND | wx.BOTTOM, 5)
         # Row four.
         row4 = wx.BoxSizer(wx.HORIZONTAL)
         self.cb_termcolor = wx.CheckBox(self, wx.ID_ANY, "Support Text Color")
         self.cb_termcolor.SetValue(glsSettings.Get('term_color'))
         row4.Add(self.cb_termcolor, 0, wx.ALIGN_CENTER | wx.LEFT | wx.RIGHT, 5)
+        self.st_readmax = wx.StaticText(self, wx.ID_ANY, "Max Read (KiB):")
+        row4.Add(self.st_readmax, 0, wx.ALIGN_CENTER | wx.LEFT | wx.RIGHT, 5)
+        read_max = glsSettings.Get('term_read_max') // 1024
+        self.sp_readmax = wx.SpinCtrl(self, id=wx.ID_ANY, value=str(read_max),
+                                      style=wx.SP_ARROW_KEYS, min=4, max=16384,
+                                      initial=read_max)
+        row4.Add(self.sp_readmax, 0, wx.ALIGN_CENTER | wx.LEFT | wx.RIGHT, 5)
+        self.st_backlog = wx.StaticText(self, wx.ID_ANY, "Max Backlog (KiB):")
+        row4.Add(self.st_backlog, 0, wx.ALIGN_CENTER | wx.LEFT | wx.RIGHT, 5)
+        backlog_max = glsSettings.Get('term_backlog_max') // 1024
+        self.sp_backlog = wx.SpinCtrl(self, id=wx.ID_ANY, value=str(backlog_max),
+                                      style=wx.SP_ARROW_KEYS, min=64, max=262144,
+                                      initial=backlog_max)
+        row4.Add(self.sp_backlog, 0, wx.ALIGN_CENTER | wx.LEFT | wx.RIGHT, 5)
         vbox.Add(row4, 0, wx.EXPAND | wx.BOTTOM, 5)
+        # Row five.
+        row5 = wx.BoxSizer(wx.HORIZONTAL)
+        self.st_scrollback = wx.StaticText(self, wx.ID_ANY, "Scrollback Lines:")
+        row5.Add(self.st_scrollback, 0, wx.ALIGN_CENTER | wx.LEFT | wx.RIGHT, 5)
+        scrollback = glsSettings.Get('term_scrollback')
+        self.sp_scrollback = wx.SpinCtrl(self, id=wx.ID_ANY, value=str(scrollback),
+                                         style=wx.SP_ARROW_KEYS, min=0, max=10000000,
+                                         initial=scrollback)
+        row5.Add(self.sp_scrollback, 0, wx.ALIGN_CENTER | wx.LEFT | wx.RIGHT, 5)
+        self.cb_termspill = wx.CheckBox(self, wx.ID_ANY, "Spill Scrollback to Disk")
+        self.cb_termspill.SetValue(glsSettings.Get('term_spill'))
+        row5.Add(self.cb_termspill, 0, wx.ALIGN_CENTER | wx.LEFT | wx.RIGHT, 5)
+        self.cb_termgl = wx.CheckBox(self, wx.ID_ANY, "Draw with OpenGL")
+        self.cb_termgl.SetValue(glsSettings.Get('term_gl'))
+        row5.Add(self.cb_termgl, 0, wx.ALIGN_CENTER | wx.LEFT | wx.RIGHT, 5)
+        vbox.Add(row5, 0, wx.EXPAND | wx.BOTTOM, 5)
         # Row four is a 2x2 grid.
         grid2 = wx.GridSizer(2,2,5,5)
         self.st_fgcolor = wx.StaticText(self, wx.ID_ANY, "Foreground Color:")
@@ -217,7 +250,13 @@ class TabTerminal(wx.Panel):
         self.tc_termtype.SetValue(glsSettings.Get('term_type'))
         self.cb_termscrlop.SetValue(glsSettings.Get('term_scroll_output'))
         self.cb_termscrlkp.SetValue(glsSettings.Get('term_scroll_keypress'))
+        self.cb_termthread.SetValue(glsSettings.Get('term_threaded'))
         self.cb_termcolor.SetValue(glsSettings.Get('term_color'))
+        self.sp_readmax.SetValue(glsSettings.Get('term_read_max') // 1024)
+        self.sp_backlog.SetValue(glsSettings.Get('term_backlog_max') // 1024)
+        self.sp_scrollback.SetValue(glsSettings.Get('term_scrollback'))
+        self.cb_termspill.SetValue(glsSettings.Get('term_spill'))
+        self.cb_termgl.SetValue(glsSettings.Get('term_gl'))
         self.cp_fgcolor.SetColour(glsSettings.Get('term_fgcolor'))
         self.cp_bgcolor.SetColour(glsSettings.Get('term_bgcolor'))
         self.p_sample.SetBackgroundColour(glsSettings.Get('term_bgcolor'))
@@ -235,7 +274,13 @@ class TabTerminal(wx.Panel):
         settings.append( ('term_type', self.tc_termtype.GetValue()) )
         settings.append( ('term_scroll_output', self.cb_termscrlop.IsChecked()) )
         settings.append( ('term_scroll_keypress', self.cb_termscrlkp.IsChecked()) )
+        settings.append( ('term_threaded', self.cb_termthread.IsChecked()) )
         settings.append( ('term_color', self.cb_termcolor.IsChecked()) )
+        settings.append( ('term_read_max', self.sp_readmax.GetValue() * 1024) )
+        settings.append( ('term_backlog_max', self.sp_backlog.GetValue() * 1024) )
+        settings.append( ('term_scrollback', self.sp_scrollback.GetValue()) )
+        settings.append( ('term_spill', self.cb_termspill.IsChecked()) )
+        settings.append( ('term_gl', self.cb_termgl.IsChecked()) )
         color = self.cp_fgcolor.GetColour()
         settings.append( ('term_fgcolor', (color.GetRed(), color.GetGreen(), color.GetBlue())) )
         color = self.cp_bgcolor.GetColour()
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Headless throughput benchmark for the V102Terminal emulator.
+
+Replays byte streams through V102Terminal without wx or a PTY, decoding them
+in PTY-sized chunks the way glsTerminalPanel does. Built-in streams are
+generated deterministically; recorded streams (for example captured with
+`script -q`) can be added with --stream NAME=PATH.
+
+Run with: cd GLShell && python3 glsTermBench.py
+Compare against another git revision: python3 glsTermBench.py --rev HEAD~1
+Save / compare results: python3 glsTermBench.py --save a.json; --baseline a.json
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import codecs
+import pstats
+import random
+import cProfile
+import argparse
+import tempfile
+import subprocess
+import importlib.util
+
+################################################################
+
+class glsTermBenchStreams():
+    WORDS = ( "the", "quick", "brown", "fox", "jumps", "over", "lazy", "dog",
+              "error:", "warning:", "src/main.c:42:7", "make[2]:", "gcc", "-O2",
+              "Entering", "directory", "Compiling", "Linking", "ok", "FAILED" )
+    def __init__(self, size, seed=1):
+        self.size = size
+        self.seed = seed
+        return
+    def Names(self):
+        return [ 'text', 'ls_color', 'vim', 'htop', 'scroll_region', 'color256', 'utf8' ]
+    def Get(self, name):
+        rand = random.Random(self.seed)
+        builder = getattr(self, 'Build_' + name)
+        # size counts encoded bytes, so multibyte streams are not larger.
+        parts = []
+        total = 0
+        while total < self.size:
+            part = builder(rand).encode('utf-8')
+            parts.append(part)
+            total += len(part)
+        return b"".join(parts)
+    def Line(self, rand, width=78):
+        words = []
+        length = 0
+        while length < width - 12:
+            word = rand.choice(self.WORDS)
+            words.append(word)
+            length += len(word) + 1
+        return " ".join(words)
+    def Build_text(self, rand):
+        # Plain text flood, like a build log or cat of a large file.
+        return self.Line(rand) + "\r\n"
+    def Build_ls_color(self, rand):
+        # SGR-heavy output of ls --color.
+        colors = ( "01;34", "01;32", "01;36", "00", "01;31", "40;33;01" )
+        entries = []
+        for i in range(6):
+            name = rand.choice(self.WORDS).strip(':')
+            entries.append("\x1b[0m\x1b[%sm%s\x1b[0m"%(rand.choice(colors), name))
+        return "  ".join(entries) + "\r\n"
+    def Build_vim(self, rand):
+        # Full-screen redraw of an editor with syntax highlighting.
+        out = [ "\x1b[?25l" ]
+        for row in range(1, 24):
+            out.append("\x1b[%d;1H\x1b[38;5;%dm%4d \x1b[m"%(row, 130, row))
+            for word in self.Line(rand, 70).split(" "):
+                out.append("\x1b[38;5;%dm%s\x1b[m "%(rand.randrange(256), word))
+            out.append("\x1b[K")
+        out.append("\x1b[24;1H\x1b[7m-- INSERT --  main.c  42,7  Top\x1b[27m\x1b[K")
+        out.append("\x1b[%d;%dH\x1b[?25h"%(rand.randrange(1, 24), rand.randrange(1, 80)))
+        return "".join(out)
+    def Build_htop(self, rand):
+        # Full-screen redraw of a process monitor with meters.
+        out = [ "\x1b[H" ]
+        for cpu in range(4):
+            used = rand.randrange(40)
+            out.append("\x1b[%d;3H\x1b[1m%d\x1b[m\x1b[1;36m[\x1b[32m%s\x1b[31m%s\x1b[m%s"
+                       "\x1b[1;36m]\x1b[m"%(cpu + 1, cpu, "|"*used, "|"*(used//4),
+                                           " "*(50 - used - used//4)))
+        out.append("\x1b[7;1H\x1b[30;42m  PID USER      PRI  NI  VIRT   RES %CPU Command\x1b[K")
+        for row in range(8, 24):
+            out.append("\x1b[%d;1H\x1b[m%5d \x1b[1muser\x1b[m     20   0 %5dM %4dM "
+                       "\x1b[32m%4.1f\x1b[m %s\x1b[K"%(row, rand.randrange(99999),
+                                                    rand.randrange(9999), rand.randrange(999),
+                                                    rand.random()*100, rand.choice(self.WORDS)))
+        return "".join(out)
+    def Build_scroll_region(self, rand):
+        # Output confined to a scroll region, with inserts and reverse index.
+        out = [ "\x1b[3;20r\x1b[20;1H" ]
+        for i in range(20):
+            out.append(self.Line(rand) + "\r\n")
+        out.append("\x1b[3;1H\x1bM\x1bM\x1b[2L\x1b[10;1H\x1b[3M")
+        out.append("\x1b[r\x1b[24;1H")
+        return "".join(out)
+    def Build_color256(self, rand):
+        # Dense 256-color foreground / background output.
+        out = []
+        for i in range(16):
+            out.append("\x1b[38;5;%d;48;5;%dm%s"%(rand.randrange(256), rand.randrange(256),
+                                                 rand.choice(self.WORDS)))
+        out.append("\x1b[0m\r\n")
+        return "".join(out)
+    def Build_utf8(self, rand):
+        # Multi-byte UTF-8 text, like ls with icons or localized diagnostics.
+        chars = "αβγδεжзийк漢字仮名文字→✓✗…📁📄"
+        return "".join(rand.choice(chars) for i in range(60)) + " " + self.Line(rand, 20) + "\r\n"
+
+################################################################
+
+class glsTermBench():
+    def __init__(self, module, rows=24, cols=80, chunk=4096, repeat=3):
+        self.module = module
+        self.rows = rows
+        self.cols = cols
+        self.chunk = chunk
+        self.repeat = repeat
+        return
+    def NewTerminal(self):
+        terminal = self.module.V102Terminal(self.rows, self.cols)
+        for name in dir(terminal):
+            if name.startswith('CALLBACK_'):
+                terminal.SetCallback(getattr(terminal, name), lambda *args: None)
+        return terminal
+    def Replay(self, terminal, data):
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        for start in range(0, len(data), self.chunk):
+            terminal.ProcessInput(decoder.decode(data[start:start+self.chunk]))
+        return
+    def Run(self, data):
+        best = None
+        for i in range(self.repeat):
+            terminal = self.NewTerminal()
+            start = time.perf_counter()
+            self.Replay(terminal, data)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        lines = data.count(b'\n')
+        return { 'seconds': best,
+                 'mb_s': len(data) / best / 1e6,
+                 'lines_s': lines / best if lines else None }
+    def Profile(self, data, top):
+        terminal = self.NewTerminal()
+        profiler = cProfile.Profile()
+        profiler.enable()
+        self.Replay(terminal, data)
+        profiler.disable()
+        stats = pstats.Stats(profiler).stats
+        handlers = []
+        source = os.path.basename(self.module.__file__)
+        for (path, line, func), (cc, nc, tottime, cumtime, callers) in stats.items():
+            if os.path.basename(path) == source:
+                handlers.append((tottime, nc, func.replace('_V102Terminal', '')))
+        handlers.sort(reverse=True)
+        return handlers[:top]
+
+################################################################
+
+def LoadEmulator(rev=None):
+    here = os.path.dirname(os.path.abspath(__file__))
+    if here not in sys.path:
+        sys.path.insert(0, here)
+    if rev is None:
+        path = os.path.join(here, 'TermEmulator.py')
+        name = 'TermEmulator'
+    else:
+        source = subprocess.check_output(['git', 'show', rev + ':./TermEmulator.py'], cwd=here)
+        path = os.path.join(tempfile.mkdtemp(prefix='glsTermBench'), 'TermEmulator.py')
+        with open(path, 'wb') as out:
+            out.write(source)
+        name = 'TermEmulator_' + rev.replace('~', '_').replace('^', '_')
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def FormatRate(value, scale=1.0):
+    return "%10.2f"%(value / scale) if value is not None else "%10s"%("-")
+
+def main():
+    parser = argparse.ArgumentParser(description="V102Terminal throughput benchmark.")
+    parser.add_argument('--size', type=float, default=2.0, help="MB per generated stream")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per stream, best is kept")
+    parser.add_argument('--chunk', type=int, default=4096, help="bytes per ProcessInput call")
+    parser.add_argument('--rows', type=int, default=24)
+    parser.add_argument('--cols', type=int, default=80)
+    parser.add_argument('--only', action='append', help="run only the named stream(s)")
+    parser.add_argument('--stream', action='append', default=[],
+                        help="add a recorded stream as NAME=PATH")
+    parser.add_argument('--profile', type=int, default=0, metavar='N',
+                        help="show the N most expensive emulator functions per stream")
+    parser.add_argument('--rev', help="also run the emulator from this git revision and compare")
+    parser.add_argument('--baseline', help="compare with results saved by --save")
+    parser.add_argument('--save', help="save results as JSON")
+    parser.add_argument('--threshold', type=float, default=5.0,
+                        help="percent slowdown reported as a regression")
+    args = parser.parse_args()
+
+    streams = glsTermBenchStreams(int(args.size * 1e6))
+    names = args.only if args.only else streams.Names()
+    data = {}
+    for name in names:
+        data[name] = streams.Get(name)
+    for spec in args.stream:
+        name, path = spec.split('=', 1)
+        with open(path, 'rb') as recorded:
+            data[name] = recorded.read()
+
+    bench = glsTermBench(LoadEmulator(), args.rows, args.cols, args.chunk, args.repeat)
+    other = None
+    if args.rev is not None:
+        other = glsTermBench(LoadEmulator(args.rev), args.rows, args.cols,
+                             args.chunk, args.repeat)
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as saved:
+            baseline = json.load(saved)
+    if other is None and baseline is not None:
+        reference = "baseline"
+    else:
+        reference = args.rev
+
+    results = {}
+    regressions = []
+    header = "%-16s %10s %10s %10s"%("stream", "MB", "MB/s", "lines/s")
+    if reference is not None:
+        header += " %10s %8s"%("ref MB/s", "change")
+    print(header)
+    for name, stream in data.items():
+        result = bench.Run(stream)
+        results[name] = result
+        line = "%-16s %10.2f %s %s"%(name, len(stream) / 1e6, FormatRate(result['mb_s']),
+                                     FormatRate(result['lines_s']))
+        ref = None
+        if other is not None:
+            ref = other.Run(stream)
+        elif baseline is not None and name in baseline:
+            ref = baseline[name]
+        if ref is not None:
+            change = (result['mb_s'] / ref['mb_s'] - 1.0) * 100.0
+            line += " %s %+7.1f%%"%(FormatRate(ref['mb_s']), change)
+            if change < -args.threshold:
+                regressions.append(name)
+        print(line)
+        if args.profile:
+            for tottime, calls, func in bench.Profile(stream, args.profile):
+                print("    %-36s %10d calls %9.3fs"%(func, calls, tottime))
+    if args.save is not None:
+        with open(args.save, 'w') as out:
+            json.dump(results, out, indent=2)
+    if regressions:
+        print("Regressions (> %.1f%% slower than %s): %s"%
+              (args.threshold, reference, ", ".join(regressions)))
+        return 1
+    return 0
+
+################################################################
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+################################################################
@@ -0,0 +1,291 @@
+import wx
+import numpy as np
+from wx.glcanvas import GLCanvas, GLContext, WX_GL_RGBA, WX_GL_DOUBLEBUFFER
+from OpenGL.GL import *
+
+from glsGLBuffer import glsGLBuffer
+
+################################################################
+
+class glsTermGlyphAtlas():
+    """
+    Glyphs of the terminal font in one texture of SLOTS_X x SLOTS_Y cells,
+    drawn on first use. Glyphs are keyed by code point, plus BOLD for the bold
+    face. Slot 0 is solid, for underlines; slot 1 stays empty. Once the atlas
+    is full it is cleared and refilled with the glyphs of the current frame.
+    """
+    SLOTS_X = 64
+    SLOTS_Y = 64
+    BOLD = 1 << 21
+    def __init__(self, font_name, font_size, char_w, char_h):
+        self.char_w = char_w
+        self.char_h = char_h
+        fontinfo = wx.FontInfo(font_size).FaceName(font_name)
+        self.fonts = [ wx.Font(fontinfo), wx.Font(fontinfo.Bold()) ]
+        self.buff = glsGLBuffer(char_w*self.SLOTS_X, char_h*self.SLOTS_Y)
+        self.buff.dc.SetTextForeground([255,255,255])
+        self.buff.dc.SetTextBackground(wx.NullColour)
+        self.buff.dc.SetBackgroundMode(wx.TRANSPARENT)
+        # Texture coordinates of the corners of each slot, in quad order.
+        slots = np.arange(self.SLOTS_X*self.SLOTS_Y)
+        u0 = (slots % self.SLOTS_X) / self.SLOTS_X
+        v0 = (slots // self.SLOTS_X) / self.SLOTS_Y
+        u1 = u0 + 1.0 / self.SLOTS_X
+        v1 = v0 + 1.0 / self.SLOTS_Y
+        self.coords = np.stack([u0, v0, u0, v1, u1, v1, u1, v0], axis=1)
+        self.coords = self.coords.reshape(-1, 4, 2).astype(np.single)
+        self.Clear()
+        return
+    def Clear(self):
+        self.buff.Clear()
+        self.slots = {}
+        self.used = 2
+        self.dirty = True
+        return
+    def Delete(self):
+        if self.buff.tex is not None:
+            glDeleteTextures([self.buff.tex])
+            self.buff.tex = None
+        return
+    def Lookup(self, keys):
+        # Returns the slot of each key, adding missing glyphs.
+        uniq, inverse = np.unique(keys, return_inverse=True)
+        uniq = uniq.tolist()
+        missing = [ key for key in uniq if key not in self.slots ]
+        if self.used + len(missing) > self.SLOTS_X*self.SLOTS_Y:
+            self.Clear()
+            missing = uniq
+        for key in missing:
+            self.AddGlyph(key)
+        slots = np.array([ self.slots[key] for key in uniq ], dtype=np.intp)
+        return slots[inverse]
+    def AddGlyph(self, key):
+        if self.used >= self.SLOTS_X*self.SLOTS_Y:
+            self.slots[key] = 1
+            return
+        slot = self.used
+        self.used += 1
+        x = (slot % self.SLOTS_X) * self.char_w
+        y = (slot // self.SLOTS_X) * self.char_h
+        dc = self.buff.dc
+        dc.SetFont(self.fonts[1 if key & self.BOLD else 0])
+        dc.SetClippingRegion(x, y, self.char_w, self.char_h)
+        try:
+            dc.DrawText(chr(key & (self.BOLD - 1)), x, y)
+        except (ValueError, UnicodeError):
+            pass
+        dc.DestroyClippingRegion()
+        self.slots[key] = slot
+        self.dirty = True
+        return
+    def BindTexture(self):
+        # Upload the atlas if glyphs were added since the last frame.
+        if self.dirty:
+            self.buff.SyncBuffer()
+            pixels = self.buff.buff.reshape(self.buff.height, self.buff.width, 4)
+            pixels[:self.char_h, :self.char_w] = 255
+            self.buff.SyncTexture()
+            self.dirty = False
+        self.buff.BindTexture()
+        return
+
+################################################################
+
+class glsTermCanvas(GLCanvas):
+    """
+    Draws the screen of a glsTerminalPanel with OpenGL. Cell backgrounds are
+    one batch of quads and glyphs from a glsTermGlyphAtlas (with underlines)
+    are another, each drawn from vertex arrays with one glDrawArrays call.
+    Only the fixed-function pipeline is used, so Mesa's software renderers
+    work too. Mouse events go to the handlers of the panel, which keeps the
+    keyboard focus.
+    """
+    def __init__(self, term):
+        attrs = [ WX_GL_RGBA, WX_GL_DOUBLEBUFFER, 0 ]
+        GLCanvas.__init__(self, term, -1, size=term.Size, attribList=attrs)
+        self.term = term
+        self.glctx = None
+        self.atlas = None
+        self.atlas_font = None
+        self.grid = None
+        self.grid_quads = None
+        self.palettes = None
+        self.palettes_src = None
+        self.SetCursor(wx.Cursor(wx.CURSOR_IBEAM))
+        self.Bind(wx.EVT_PAINT, self.OnPaint)
+        self.Bind(wx.EVT_ERASE_BACKGROUND, lambda event: None)
+        self.Bind(wx.EVT_SET_FOCUS, self.OnSetFocus)
+        self.Bind(wx.EVT_LEFT_DOWN, term.OnLeftDown)
+        self.Bind(wx.EVT_LEFT_UP, term.OnLeftUp)
+        self.Bind(wx.EVT_LEFT_DCLICK, term.OnLeftDouble)
+        self.Bind(wx.EVT_MIDDLE_DOWN, term.OnMiddleDown)
+        self.Bind(wx.EVT_RIGHT_DOWN, term.OnRightDown)
+        self.Bind(wx.EVT_MOUSEWHEEL, term.OnWheel)
+        self.Bind(wx.EVT_MOTION, term.OnMove)
+        return
+    def InitGL(self):
+        self.glctx = GLContext(self)
+        self.glctx.SetCurrent(self)
+        glDisable(GL_LIGHTING)
+        glDisable(GL_DEPTH_TEST)
+        glEnable(GL_BLEND)
+        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+        return
+    def OnSetFocus(self, event):
+        self.term.SetFocus()
+        return
+    def OnPaint(self, event):
+        dc = wx.PaintDC(self)
+        if not self.IsShownOnScreen():
+            return
+        if self.glctx is None:
+            self.InitGL()
+        self.glctx.SetCurrent(self)
+        term = self.term
+        term.UpdateScroll()
+        font = (term.font_name, term.font_size, term.char_w, term.char_h)
+        if font != self.atlas_font:
+            if self.atlas is not None:
+                self.atlas.Delete()
+            self.atlas = glsTermGlyphAtlas(*font)
+            self.atlas_font = font
+        glViewport(0, 0, self.Size[0], self.Size[1])
+        glMatrixMode(GL_PROJECTION)
+        glLoadIdentity()
+        glOrtho(0.0, self.Size[0], self.Size[1], 0.0, -1.0, 1.0)
+        glMatrixMode(GL_MODELVIEW)
+        glLoadIdentity()
+        glClearColor(*[ c / 255.0 for c in term.color_bg ], 1.0)
+        glClear(GL_COLOR_BUFFER_BIT)
+        self.DrawScreen()
+        self.DrawCursor()
+        self.DrawSelection()
+        self.SwapBuffers()
+        return
+    def GetQuads(self, rows, cols):
+        # Corners of every cell of the grid, rebuilt when the grid changes.
+        grid = (rows, cols, self.term.char_w, self.term.char_h)
+        if grid != self.grid:
+            w, h = self.term.char_w, self.term.char_h
+            x = np.tile(np.arange(cols) * w, rows)
+            y = np.repeat(np.arange(rows) * h, cols)
+            quads = np.empty((rows*cols, 4, 2), dtype=np.single)
+            quads[:,0,0] = quads[:,1,0] = x
+            quads[:,2,0] = quads[:,3,0] = x + w
+            quads[:,0,1] = quads[:,3,1] = y
+            quads[:,1,1] = quads[:,2,1] = y + h
+            self.grid = grid
+            self.grid_quads = quads
+        return self.grid_quads
+    def GetColors(self, indices, palette):
+        # Vectorized glsTerminalPanel.GetColors() for one of fg or bg.
+        colors = palette[np.minimum(indices, 255)]
+        if not self.term.color_en:
+            return colors
+        truecolor = indices >= 256
+        if truecolor.any():
+            for index in np.unique(indices[truecolor]).tolist():
+                colors[indices == index] = self.term.terminal.GetTrueColor(index - 256)
+        return colors
+    def DrawScreen(self):
+        term = self.term
+        terminal = term.terminal
+        screen, rendition = term.GetScrolledScreen()
+        rows = min(term.rows, len(screen))
+        cols = term.cols
+        if rows <= 0 or cols <= 0:
+            return
+        text = [ (line if isinstance(line, str) else line.tounicode())[:cols].ljust(cols)
+                 for line in screen[:rows] ]
+        codes = np.frombuffer(''.join(text).encode('utf-32-le'), dtype=np.uint32)
+        rend = np.zeros((rows, cols), dtype=np.uint32)
+        for row in range(rows):
+            line = np.asarray(rendition[row])[:cols]
+            rend[row, :len(line)] = line
+        rend = rend.ravel()
+        style = rend & 0xff
+        # The panel builds new palettes when the settings change.
+        if self.palettes_src != (term.palette_fg, term.palette_bg):
+            self.palettes_src = (term.palette_fg, term.palette_bg)
+            self.palettes = [ np.array(palette, dtype=np.uint8) for palette in self.palettes_src ]
+        fg = self.GetColors(((rend >> 16) & 255) | (rend & 0x100), self.palettes[0])
+        bg = self.GetColors(((rend >> 24) & 255) | ((rend & 0x200) >> 1), self.palettes[1])
+        low = np.abs((fg.astype(np.int32) - bg).sum(axis=1)) < 64
+        fg[low] = 255 - fg[low]
+        inverse = (style & terminal.RENDITION_STYLE_INVERSE) != 0
+        fg[inverse], bg[inverse] = bg[inverse], fg[inverse]
+        quads = self.GetQuads(rows, cols)
+        # Backgrounds that differ from the clear color.
+        cells = np.nonzero((bg != np.array(term.color_bg, dtype=np.uint8)).any(axis=1))[0]
+        self.DrawQuads(quads[cells], bg[cells])
+        # Glyphs, then underlines from the solid slot, in one batch.
+        cells = np.nonzero((codes != 32) & (codes != 0))[0]
+        keys = codes[cells].astype(np.int64)
+        keys[(style[cells] & terminal.RENDITION_STYLE_BOLD) != 0] |= self.atlas.BOLD
+        slots = self.atlas.Lookup(keys)
+        under = np.nonzero(style & terminal.RENDITION_STYLE_UNDERLINE)[0]
+        lines = quads[under]
+        lines[:,(0,3),1] = lines[:,(1,2),1] - 1
+        self.DrawQuads(np.concatenate((quads[cells], lines)),
+                       np.concatenate((fg[cells], fg[under])),
+                       np.concatenate((self.atlas.coords[slots],
+                                       self.atlas.coords[np.zeros(len(under), dtype=np.intp)])))
+        return
+    def DrawQuads(self, quads, colors, coords=None):
+        # One draw call for all quads; with coords they sample the atlas.
+        if not len(quads):
+            return
+        colors = np.ascontiguousarray(np.repeat(colors, 4, axis=0))
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glVertexPointer(2, GL_FLOAT, 0, np.ascontiguousarray(quads))
+        glEnableClientState(GL_COLOR_ARRAY)
+        glColorPointer(3, GL_UNSIGNED_BYTE, 0, colors)
+        if coords is not None:
+            glEnable(GL_TEXTURE_2D)
+            self.atlas.BindTexture()
+            glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+            glTexCoordPointer(2, GL_FLOAT, 0, np.ascontiguousarray(coords))
+        glDrawArrays(GL_QUADS, 0, len(quads)*4)
+        if coords is not None:
+            glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+            glBindTexture(GL_TEXTURE_2D, 0)
+            glDisable(GL_TEXTURE_2D)
+        glDisableClientState(GL_COLOR_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        return
+    def DrawRect(self, x, y, w, h, color):
+        glColor4ub(*color)
+        glRectf(x, y, x + w, y + h)
+        return
+    def DrawCursor(self):
+        term = self.term
+        terminal = term.terminal
+        cell = term.GetCursorCell()
+        if cell is None:
+            return
+        row, col = cell
+        x, y = col*term.char_w, row*term.char_h
+        color = (0,255,0,255) if term.HasFocus() else (255,128,0,255)
+        if (term.cursor_style == terminal.CURSOR_STYLE_DEFAULT or
+            term.cursor_style == terminal.CURSOR_STYLE_BLOCK):
+            self.DrawRect(x, y, term.char_w, term.char_h, color)
+            screen, rendition = term.GetScrolledScreen()
+            char = screen[row][col]
+            if char != ' ':
+                slots = self.atlas.Lookup(np.array([ord(char) | self.atlas.BOLD]))
+                self.DrawQuads(self.GetQuads(term.rows, term.cols)[[row*term.cols + col]],
+                               np.zeros((1, 3), dtype=np.uint8),
+                               self.atlas.coords[slots])
+        elif term.cursor_style == terminal.CURSOR_STYLE_BAR:
+            self.DrawRect(x, y, 2, term.char_h, color)
+        elif term.cursor_style == terminal.CURSOR_STYLE_UNDERLINE:
+            self.DrawRect(x, y + term.char_h - 2, term.char_w, 2, color)
+        return
+    def DrawSelection(self):
+        term = self.term
+        for col, row, count in term.GetSelectionRects():
+            self.DrawRect(col*term.char_w, row*term.char_h,
+                          count*term.char_w, term.char_h, (255,255,0,64))
+        return
+
+################################################################
@@ -1,18 +1,20 @@
 import os
+import re
 import wx
 import pty
+import codecs
 import tty
 import fcntl
 import termios
 import struct
 import select
 import string
-import cProfile
 import threading
 import traceback
-import numpy as np
-from time import sleep
+from bisect import bisect_right
+from time import monotonic
 from array import *
+from collections import deque, OrderedDict
 from datetime import datetime
 
 from glsPlaceHolder import glsPlaceHolder
@@ -20,6 +22,10 @@ from glsStatusBar import glsLog
 from glsSettings import glsSettings
 from glsKeyPress import glsKeyPress
 from glsEvents import glsEvents
+from glsReactor import glsReactor
+from glsRepaint import glsRepaint
+from glsScrollback import glsScrollback, glsScrollbackSpill
+from glsTermGL import glsTermCanvas
 from glsIcons import glsIcons
 
 import TermEmulator
@@ -37,6 +43,7 @@ class glsTermPanelPopupMenu(wx.Menu):
     ID_FONT_UP         = 1007
     ID_FONT_DOWN       = 1008
     ID_EXIT            = 1009
+    ID_FIND            = 1010
     def __init__(self, parent, selection_available, paste_available):
         super(glsTermPanelPopupMenu, self).__init__()
         item = wx.MenuItem(self, self.ID_NEW_TERM, 'New Terminal')
@@ -67,6 +74,9 @@ class glsTermPanelPopupMenu(wx.Menu):
         self.Append(item)
         if not selection_available:
             item.Enable(False)
+        item = wx.MenuItem(self, self.ID_FIND, 'Find in Terminal')
+        item.SetBitmap(glsIcons.Get('zoom_in'))
+        self.Append(item)
         item = wx.MenuItem(self, self.ID_NAME, 'Set Tab Name')
         item.SetBitmap(glsIcons.Get('pencil'))
         self.Append(item)
@@ -83,6 +93,67 @@ class glsTermPanelPopupMenu(wx.Menu):
 
 ################################################################
 
+class glsTermFindBar(wx.Panel):
+    def __init__(self, parent, callback_find, callback_next, callback_close):
+        super(glsTermFindBar, self).__init__(parent, style=wx.SIMPLE_BORDER)
+        self.callback_find = callback_find
+        self.callback_next = callback_next
+        self.callback_close = callback_close
+        box_main = wx.BoxSizer(wx.HORIZONTAL)
+        self.tc_find = wx.TextCtrl(self, wx.ID_ANY, size=(200,-1), style=wx.TE_PROCESS_ENTER)
+        self.tc_find.Bind(wx.EVT_TEXT, self.OnFind)
+        self.tc_find.Bind(wx.EVT_TEXT_ENTER, self.OnEnter)
+        box_main.Add(self.tc_find, 1, wx.ALIGN_CENTER | wx.ALL, 2)
+        self.cb_case = wx.CheckBox(self, wx.ID_ANY, "Aa")
+        self.cb_case.SetToolTip("Match Case")
+        self.cb_case.Bind(wx.EVT_CHECKBOX, self.OnFind)
+        box_main.Add(self.cb_case, 0, wx.ALIGN_CENTER | wx.LEFT | wx.RIGHT, 2)
+        self.cb_regx = wx.CheckBox(self, wx.ID_ANY, ".*")
+        self.cb_regx.SetToolTip("Regular Expression")
+        self.cb_regx.Bind(wx.EVT_CHECKBOX, self.OnFind)
+        box_main.Add(self.cb_regx, 0, wx.ALIGN_CENTER | wx.LEFT | wx.RIGHT, 2)
+        self.btn_older = wx.Button(self, wx.ID_ANY, "^", style=wx.BU_EXACTFIT)
+        self.btn_older.SetToolTip("Older Match (Enter)")
+        self.btn_older.Bind(wx.EVT_BUTTON, lambda event: self.callback_next(True))
+        box_main.Add(self.btn_older, 0, wx.ALIGN_CENTER | wx.ALL, 2)
+        self.btn_newer = wx.Button(self, wx.ID_ANY, "v", style=wx.BU_EXACTFIT)
+        self.btn_newer.SetToolTip("Newer Match (Shift+Enter)")
+        self.btn_newer.Bind(wx.EVT_BUTTON, lambda event: self.callback_next(False))
+        box_main.Add(self.btn_newer, 0, wx.ALIGN_CENTER | wx.ALL, 2)
+        self.st_count = wx.StaticText(self, wx.ID_ANY, "", size=(90,-1))
+        box_main.Add(self.st_count, 0, wx.ALIGN_CENTER | wx.LEFT | wx.RIGHT, 4)
+        self.btn_close = wx.BitmapButton(self, wx.ID_ANY, glsIcons.Get('cross'))
+        self.btn_close.Bind(wx.EVT_BUTTON, lambda event: self.callback_close())
+        box_main.Add(self.btn_close, 0, wx.ALIGN_CENTER | wx.ALL, 2)
+        self.Bind(wx.EVT_CHAR_HOOK, self.OnCharHook)
+        self.SetSizerAndFit(box_main)
+        return
+    def OnFind(self, event):
+        self.callback_find(self.tc_find.GetValue(), self.cb_case.IsChecked(),
+                           self.cb_regx.IsChecked())
+        return
+    def OnEnter(self, event):
+        self.callback_next(not wx.GetKeyState(wx.WXK_SHIFT))
+        return
+    def OnCharHook(self, event):
+        if event.GetKeyCode() == wx.WXK_ESCAPE:
+            self.callback_close()
+            return
+        event.Skip()
+        return
+    def SetText(self, text):
+        self.tc_find.SetValue(text)
+        self.tc_find.SelectAll()
+        return
+    def SetCount(self, text):
+        self.st_count.SetLabel(text)
+        return
+    def Focus(self):
+        self.tc_find.SetFocus()
+        return
+
+################################################################
+
 class glsTerminalPanel(wx.Window):
     # Color table for 256-color mode.
     # Inspired by:
@@ -122,12 +193,12 @@ class glsTerminalPanel(wx.Window):
         # Give the term panel a default size to avoid errors on creation.
         # This also appears to influence some aspects of minimum size.
         super(glsTerminalPanel, self).__init__(parent, size=(200,100), style=style)
-        self.profiler = cProfile.Profile()
-        self.pcount = 0
         self.SetMinSize(min_size)
         self.SetCursor(wx.Cursor(wx.CURSOR_IBEAM))
         glsSettings.AddWatcher(self.OnChangeSettings)
-        self.word_chars = glsSettings.Get('term_wchars')
+        # Words are followed over at most word_lines soft-wrapped lines.
+        self.word_lines = 64
+        self.SetWordChars(glsSettings.Get('term_wchars'))
         self.color_en = glsSettings.Get('term_color')
         self.color_fg = glsSettings.Get('term_fgcolor')
         self.color_bg = glsSettings.Get('term_bgcolor')
@@ -152,11 +223,14 @@ class glsTerminalPanel(wx.Window):
         self.Bind(wx.EVT_MOTION, self.OnMove)
         self.Bind(wx.EVT_SET_FOCUS, self.OnSetFocus)
         self.Bind(wx.EVT_KILL_FOCUS, self.OnKillFocus)
-        self.Bind(glsEvents.EVT_CHILD_EXIT, self.OnChildOutputThreadExit)
+        self.Bind(glsEvents.EVT_CHILD_EXIT, self.OnChildExit)
         self.dbl_click = False
         self.left_down = False
+        # Selection ends are absolute (line, col) positions over history and
+        # screen, as from PointToCursor(); sel_end is exclusive once ordered.
         self.sel_start = None
         self.sel_end = None
+        self.sel_extend = False
         self.selected = None
         self.select_delay = 0.15
         # Set font.
@@ -169,6 +243,9 @@ class glsTerminalPanel(wx.Window):
         self.font_max = 32
         self.font_step = 2
         self.SetFont()
+        # With term_gl the screen is drawn by a glsTermCanvas on top of the
+        # panel instead of through dc_buffer.
+        self.gl_canvas = None
         # Add scrollbar.
         self.scroll_outp = glsSettings.Get('term_scroll_output')
         self.scroll_keyp = glsSettings.Get('term_scroll_keypress')
@@ -178,27 +255,83 @@ class glsTerminalPanel(wx.Window):
                                       size=(self.scrollbar_w, self.Size[1]),
                                       style=wx.SB_VERTICAL)
         self.scrollbar.Bind(wx.EVT_SCROLL, self.OnScroll)
-        self.scrolled_text = []
-        self.scrolled_rendition = []
-        self.max_scroll_history = 10000
+        spill = None
+        if glsSettings.Get('term_spill'):
+            spill = glsScrollbackSpill(glsSettings.Get('term_spill_path'),
+                                       glsSettings.Get('term_spill_max'))
+        self.scrollback = glsScrollback(glsSettings.Get('term_scrollback'), spill)
+        # The scrollback index is brought up to date index_gap ms after new
+        # lines are added, in steps of frame_budget.
+        self.index_gap = 250
+        self.index_timer = None
+        # Find results are (line, col, length) with absolute line numbers,
+        # newest first; the search of the scrollback runs over several frames.
+        self.find_bar = None
+        self.find_results = []
+        self.find_current = -1
+        self.find_search = None
+        self.find_serial = 0
+        # Output is parsed for up to frame_budget seconds per frame, then the
+        # updates of the frame are painted at once (jump scroll).
+        self.frame_budget = 0.012
+        self.frame_gap = 1
+        # A hidden terminal (a background tab) only runs the emulator, with
+        # hidden_gap ms between frames; its damage is painted once shown.
+        self.visible = True
+        self.hidden_gap = 50
+        self.damaged_rows = set()
+        self.scrolled_new = 0
+        # Resizing is applied once the size has settled for resize_delay ms.
+        self.resize_timer = None
+        self.resize_delay = 100
         # Setup terminal emulator.
         self.rows = int((self.Size[1]) / self.char_h)
         self.cols = int((self.Size[0]-self.scrollbar_w) / self.char_w)
         self.cursor_pos = (0,0)
+        self.scroll = 0
         self.terminal = TermEmulator.V102Terminal(self.rows,
                                                   self.cols)
-        self.terminal.SetCallback(self.terminal.CALLBACK_SCROLL_UP_SCREEN,
-                                  self.OnTermScrollUpScreen)
-        self.terminal.SetCallback(self.terminal.CALLBACK_UPDATE_LINES,
-                                  self.OnTermUpdateLines)
-        self.terminal.SetCallback(self.terminal.CALLBACK_UPDATE_CURSOR_POS,
-                                  self.OnTermUpdateCursorPos)
-        self.terminal.SetCallback(self.terminal.CALLBACK_UPDATE_WINDOW_TITLE,
-                                  self.OnTermUpdateWindowTitle)
-        self.terminal.SetCallback(self.terminal.CALLBACK_UPDATE_MODE,
-                                  self.OnTermUpdateMode)
-        self.terminal.SetCallback(self.terminal.CALLBACK_UPDATE_CURSOR,
-                                  self.OnTermUpdateCursor)
+        # With term_threaded the emulator runs on a worker thread, which
+        # publishes snapshots of the screen for painting; term_lock is held
+        # while the worker parses.
+        self.threaded = glsSettings.Get('term_threaded')
+        self.term_lock = threading.Lock()
+        self.snapshot = None
+        self.snapshots = deque()
+        self.snapshot_posted = False
+        if self.threaded:
+            self.worker_scrolled = []
+            self.worker_damaged = set()
+            self.worker_stop = False
+            self.worker_wake = threading.Event()
+            self.terminal.SetCallback(self.terminal.CALLBACK_SCROLL_UP_LINES,
+                                      self.OnWorkerScrollUpLines)
+            self.terminal.SetCallback(self.terminal.CALLBACK_UPDATE_LINES,
+                                      self.OnWorkerUpdateLines)
+            self.terminal.SetCallback(self.terminal.CALLBACK_UPDATE_CURSOR_POS,
+                                      lambda: None)
+            self.terminal.SetCallback(self.terminal.CALLBACK_UPDATE_WINDOW_TITLE,
+                                      lambda title: wx.CallAfter(self.OnTermUpdateWindowTitle,
+                                                                 title))
+            self.terminal.SetCallback(self.terminal.CALLBACK_UPDATE_MODE,
+                                      lambda modes: wx.CallAfter(self.OnTermUpdateMode,
+                                                                 dict(modes)))
+            self.terminal.SetCallback(self.terminal.CALLBACK_UPDATE_CURSOR,
+                                      lambda style: wx.CallAfter(self.OnTermUpdateCursor,
+                                                                 style))
+        else:
+            self.terminal.SetCallback(self.terminal.CALLBACK_SCROLL_UP_LINES,
+                                      self.AddScrolledLines)
+            self.terminal.SetCallback(self.terminal.CALLBACK_UPDATE_LINES,
+                                      self.OnTermUpdateLines)
+            self.terminal.SetCallback(self.terminal.CALLBACK_UPDATE_CURSOR_POS,
+                                      self.OnTermUpdateCursorPos)
+            self.terminal.SetCallback(self.terminal.CALLBACK_UPDATE_WINDOW_TITLE,
+                                      self.OnTermUpdateWindowTitle)
+            self.terminal.SetCallback(self.terminal.CALLBACK_UPDATE_MODE,
+                                      self.OnTermUpdateMode)
+            self.terminal.SetCallback(self.terminal.CALLBACK_UPDATE_CURSOR,
+                                      self.OnTermUpdateCursor)
         self.terminal.SetCallback(self.terminal.CALLBACK_SEND_DATA,
                                   self.OnTermSendData)
         self.cursor_style = self.terminal.CURSOR_STYLE_DEFAULT
@@ -222,73 +355,251 @@ class glsTerminalPanel(wx.Window):
         tcattrib = termios.tcgetattr(self.io)
         tcattrib[3] = tcattrib[3] & ~termios.ICANON
         termios.tcsetattr(self.io, termios.TCSAFLUSH, tcattrib)
+        os.set_blocking(self.io, False)
         self.notified_parent_closed = False
-        self.child_output_notifier_thread = threading.Thread(
-            target = self.ChildOuputNotifier)
-        self.output_wait = True
-        self.stop_output_notifier = False
-        self.child_output_notifier_thread.start()
+        # Reads go straight into one reusable buffer and are parsed in batches
+        # of read_size bytes, adapting between read_min and term_read_max. A
+        # partial UTF-8 sequence stays at the start of the buffer.
+        self.read_min = 4096
+        self.read_size = self.read_min
+        self.read_keep = 0
+        self.read_max = None
+        self.SetReadBuffer(glsSettings.Get('term_read_max'))
+        # Output read from the PTY but not yet painted is the backlog. Past
+        # term_backlog_max the fd is left unread, so the full PTY buffer
+        # blocks the child until the screen catches up.
+        self.backlog_max = glsSettings.Get('term_backlog_max')
+        self.backlog_read = 0
+        self.backlog_painted = 0
+        self.backlog_published = 0
+        # Depth metric: the peak backlog is logged every backlog_report_gap.
+        self.backlog_peak = 0
+        self.backlog_reported = monotonic()
+        self.backlog_report_gap = 1.0
+        self.throttled = False
         self.child_running = True
+        if self.threaded:
+            self.snapshot = self.BuildSnapshot()
+            self.worker_thread = threading.Thread(target=self.TerminalWorker, daemon=True)
+            self.worker_thread.start()
+        glsReactor.Register(self.io, self.pid, self.OnChildOutputReady, self.OnChildExited)
         # Setup buffer for double-buffered rendering.
         self.dc_buffer = wx.Bitmap(*self.Size)
+        if glsSettings.Get('term_gl'):
+            self.gl_canvas = glsTermCanvas(self)
+            self.gl_canvas.SetSize(0, 0, self.Size[0]-self.scrollbar_w, self.Size[1])
         # Update scrollbar.
         self.UpdateScrollbar()
         return
-    def ChildIsAlive(self):
-        try:
-            pid, status = os.waitpid(self.pid, os.WNOHANG)
-            if pid == self.pid and os.WIFEXITED(status):
-                return False
-        except:
-            return False
-        return True
-    def ChildOuputNotifier(self):
-        inp_set = [ self.io ]
-        while not self.stop_output_notifier and self.ChildIsAlive():
-            if self.output_wait:
-                inp_ready, out_ready, err_ready = select.select(inp_set, [], [], 0.01)
-                if self.io in inp_ready:
-                    self.output_wait = False
-                    if self:
-                        wx.CallAfter(self.ReadProcessOutput)
-            else:
-                sleep(0.001)
-        if not self.ChildIsAlive():
-            self.child_running = False
-            if self:
-                wx.CallAfter(self.ReadProcessOutput)
+    def OnChildOutputReady(self):
+        # Called on the reactor thread; the fd stays paused until Resume().
+        if self.threaded:
+            self.worker_wake.set()
+        elif self:
+            wx.CallAfter(self.ReadProcessOutput)
+        return
+    def OnChildExited(self):
+        # Called on the reactor thread once the child has been reaped.
+        self.child_running = False
+        if self.threaded:
+            self.worker_wake.set()
+        elif self:
+            wx.CallAfter(self.ReadProcessOutput)
         if self:
             wx.PostEvent(self, glsEvents.ChildExit(wx.ID_ANY))
         return
+    def SetReadBuffer(self, read_max):
+        # Room for read_max bytes after a partial UTF-8 sequence.
+        read_max = max(read_max, self.read_min)
+        if read_max == self.read_max:
+            return
+        keep = self.read_buffer[:self.read_keep] if self.read_max else b''
+        self.read_max = read_max
+        self.read_size = min(self.read_size, self.read_max)
+        self.read_buffer = bytearray(self.read_max + 4)
+        self.read_buffer[:len(keep)] = keep
+        self.read_view = memoryview(self.read_buffer)
+        return
     def ReadProcessOutput(self):
-        output = bytes("",'utf8')
-        try:
-            while True:
-                data = os.read(self.io, 512)
-                datalen = len(data)
-                output += data
-                if datalen < 512:
+        # Parse everything that arrived for up to frame_budget seconds and
+        # paint only the final state; leftover output waits for the next frame.
+        if not self:
+            return
+        if self.scroll_outp and self.scroll:
+            self.ScrollToEnd()
+        pending = self.ParseOutput(monotonic() + self.frame_budget)
+        self.PaintFrame()
+        self.ReportBacklog()
+        self.backlog_painted = self.backlog_read
+        if pending:
+            # Let paint and input events run before the next frame.
+            wx.CallLater(self.frame_gap if self.visible else self.hidden_gap,
+                         self.ReadProcessOutput)
+        else:
+            glsReactor.Resume(self.io)
+            self.ScheduleIndex()
+        return
+    def GetBacklog(self):
+        # Bytes read from the PTY that are not yet on screen.
+        return self.backlog_read - self.backlog_painted
+    def ReportBacklog(self):
+        # Logs the current and peak depth about once a second while output
+        # flows; called before a paint catches up.
+        depth = self.GetBacklog()
+        self.backlog_peak = max(self.backlog_peak, depth)
+        now = monotonic()
+        if self.backlog_peak and now - self.backlog_reported >= self.backlog_report_gap:
+            glsLog.debug("Terminal: Backlog %d bytes, peak %d of %d.", 2,
+                         depth, self.backlog_peak, self.backlog_max)
+            self.backlog_peak = 0
+            self.backlog_reported = now
+        return
+    def ParseOutput(self, deadline):
+        # Read and parse output until drained, past the deadline or over the
+        # backlog budget. Returns True if output is still pending.
+        pending = True
+        while pending and monotonic() < deadline:
+            if self.GetBacklog() >= self.backlog_max:
+                break
+            # Fill the batch with as many reads as the PTY needs.
+            end = self.read_keep
+            room = max(self.backlog_max - self.GetBacklog(), self.read_min)
+            limit = end + min(self.read_size, room)
+            while end < limit:
+                try:
+                    count = os.readv(self.io, [ self.read_view[end:limit] ])
+                except OSError:
+                    # EAGAIN once drained, EIO once the child closed the PTY.
+                    count = 0
+                if count == 0:
+                    pending = False
                     break
-        except:
-            output = bytes("",'utf8')
-        if output == bytes("",'utf8'):
-            self.output_wait = True
+                end += count
+                self.backlog_read += count
+            # Grow the batch while it fills, shrink it when it doesn't.
+            if end == limit:
+                self.read_size = min(self.read_size*2, self.read_max)
+            elif end - self.read_keep < self.read_size//4:
+                self.read_size = max(self.read_size//2, self.read_min)
+            output, used = codecs.utf_8_decode(self.read_view[:end], 'replace',
+                                               not self.child_running)
+            self.read_keep = end - used
+            if self.read_keep:
+                self.read_buffer[:self.read_keep] = self.read_buffer[used:end]
+            if output == "":
+                continue
+            try:
+                self.terminal.ProcessInput(output)
+            except:
+                glsLog.add("Terminal: Exception in ProcessInput()!\n%s"%
+                           (traceback.format_exc()))
+        return pending
+    def TerminalWorker(self):
+        # Worker thread for term_threaded: parses output one frame budget at a
+        # time and publishes a snapshot after each.
+        while True:
+            self.worker_wake.wait()
+            self.worker_wake.clear()
+            pending = True
+            while pending and not self.worker_stop:
+                if self.GetBacklog() >= self.backlog_max:
+                    # Wait for ApplySnapshots(); set first so its wakeup
+                    # can not be missed.
+                    self.throttled = True
+                    if self.GetBacklog() >= self.backlog_max:
+                        glsLog.debug("Terminal: Throttled at %d bytes of backlog.", 2,
+                                     self.GetBacklog())
+                        break
+                    self.throttled = False
+                with self.term_lock:
+                    pending = self.ParseOutput(monotonic() + self.frame_budget)
+                    self.PublishSnapshot()
+            if self.worker_stop:
+                break
+            if self.child_running and not pending:
+                glsReactor.Resume(self.io)
+        return
+    def BuildSnapshot(self):
+        # Copies the screen state; a published snapshot is never modified.
+        snapshot = { 'screen':    [ array('u', row) for row in self.terminal.GetScreen() ],
+                     'rendition': [ array('L', row) for row in self.terminal.GetRendition() ],
+                     'wrapped':   bytearray(self.terminal.GetLineWrapped()),
+                     'cursor':    self.terminal.GetCursorPos(),
+                     'read':      self.backlog_read,
+                     'scrolled':  self.worker_scrolled,
+                     'damaged':   self.worker_damaged }
+        self.worker_scrolled = []
+        self.worker_damaged = set()
+        return snapshot
+    def PublishSnapshot(self):
+        # Output without visible effect is still published, as only a snapshot
+        # moves backlog_painted and so lifts the throttle.
+        if not self.worker_damaged and not self.worker_scrolled:
+            if (self.terminal.GetCursorPos() == self.snapshot['cursor'] and
+                self.backlog_read == self.backlog_published):
+                return
+        self.backlog_published = self.backlog_read
+        self.snapshots.append(self.BuildSnapshot())
+        if not self.snapshot_posted:
+            self.snapshot_posted = True
+            wx.CallAfter(self.ApplySnapshots)
+        return
+    def TakeSnapshots(self):
+        # Adds the scrolled lines of all published snapshots to the history and
+        # makes the newest one current.
+        while self.snapshots:
+            snapshot = self.snapshots.popleft()
+            self.AddScrolledLines(snapshot['scrolled'])
+            self.damaged_rows.update(snapshot['damaged'])
+            self.snapshot = snapshot
+        return
+    def ApplySnapshots(self):
+        self.snapshot_posted = False
+        if not self:
             return
-        if self.scroll_outp:
+        if self.scroll_outp and self.scroll:
             self.ScrollToEnd()
-        try:
-            output = output.decode()
-            #self.profiler.enable()
-            self.terminal.ProcessInput(output)
-            #self.profiler.disable()
-            #self.pcount += 1
-        except:
-            glsLog.add("Terminal: Exception in ProcessInput()!\n%s"%
-                       (traceback.format_exc()))
-        self.output_wait = True
-        #print(self.pcount)
-        #if self.pcount % 50 == 0:
-        #    self.profiler.print_stats()
+        self.TakeSnapshots()
+        self.UpdateCursorPos(self.snapshot['cursor'])
+        self.PaintFrame()
+        self.ReportBacklog()
+        self.backlog_painted = self.snapshot['read']
+        self.ScheduleIndex()
+        if self.throttled:
+            self.throttled = False
+            self.worker_wake.set()
+        return
+    def PaintFrame(self):
+        # Apply the updates collected during one frame; glsRepaint paints them.
+        if not self.visible:
+            return
+        if self.scrolled_new:
+            self.UpdateScrollbar(new_lines=self.scrolled_new)
+            self.scrolled_new = 0
+        if self.damaged_rows:
+            self.RefreshRows(sorted(self.damaged_rows))
+            # Drop the selection if output changed its text.
+            selection = self.GetSelection()
+            if selection is not None and self.left_down == False:
+                total = self.scrollback.total
+                if any(selection[0][0] <= total + row <= selection[1][0]
+                       for row in self.damaged_rows):
+                    if self.GetSelectedText() != self.selected:
+                        self.sel_start = None
+                        self.sel_end = None
+                        self.selected = None
+            self.damaged_rows.clear()
+        return
+    def SetVisible(self, visible):
+        if visible == self.visible:
+            return
+        self.visible = visible
+        if visible:
+            self.PaintFrame()
+            self.UpdateScrollbar()
+        else:
+            # Free the row bitmaps; the next paint redraws the screen.
+            self.ClearRowCache()
         return
     def ZoomIn(self):
         self.font_zoom += self.font_step
@@ -321,32 +632,82 @@ class glsTerminalPanel(wx.Window):
             resize = False
         self.char_w = w
         self.char_h = h
+        self.BuildRenderCache()
         return resize
+    def BuildRenderCache(self):
+        # Fonts for each bold / underline combination, the palettes and the
+        # pens and brushes of the palette; render states are added on use.
+        self.fonts = {}
+        for bold in (False, True):
+            for underline in (False, True):
+                fontinfo = wx.FontInfo(self.font_size).FaceName(self.font_name)
+                if underline:
+                    fontinfo = fontinfo.Underlined()
+                if bold:
+                    fontinfo = fontinfo.Bold()
+                self.fonts[(bold, underline)] = wx.Font(fontinfo)
+        if self.color_en:
+            self.palette_fg = [ self.color_fg ] + self.COLORS_256[1:]
+            self.palette_bg = [ self.color_bg ] + self.COLORS_256[1:]
+        else:
+            self.palette_fg = [ self.color_fg ] * 256
+            self.palette_bg = [ self.color_bg ] * 256
+        self.pens = {}
+        self.brushes = {}
+        for color in self.palette_bg:
+            self.GetPen(color)
+            self.GetBrush(color)
+        self.render_states = {}
+        self.render_states_max = 4096
+        self.ClearRowCache()
+        return
+    def ClearRowCache(self):
+        # Rendered rows keyed by (text, rendition), most recent last; the key
+        # of what dc_buffer holds for each screen row, and the absolute line
+        # number of its top row. Each row is a full width bitmap, so at most
+        # row_cache_screens screens of rows are kept.
+        self.row_cache = OrderedDict()
+        self.row_cache_screens = 2
+        self.row_keys = {}
+        self.paint_top = None
+        return
+    def GetPen(self, color):
+        pen = self.pens.get(color)
+        if pen is None:
+            pen = self.pens[color] = wx.Pen(color)
+        return pen
+    def GetBrush(self, color):
+        brush = self.brushes.get(color)
+        if brush is None:
+            brush = self.brushes[color] = wx.Brush(color)
+        return brush
     def OnChangeSettings(self):
         self.scroll_outp = glsSettings.Get('term_scroll_output')
         self.scroll_keyp = glsSettings.Get('term_scroll_keypress')
-        self.word_chars  = glsSettings.Get('term_wchars')
+        self.SetWordChars(glsSettings.Get('term_wchars'))
         self.color_en    = glsSettings.Get('term_color')
         self.color_fg    = glsSettings.Get('term_fgcolor')
         self.color_bg    = glsSettings.Get('term_bgcolor')
         self.font_name   = glsSettings.Get('term_font')
         self.font_base   = glsSettings.Get('term_font_size')
+        with self.term_lock:
+            self.SetReadBuffer(glsSettings.Get('term_read_max'))
+        self.backlog_max = glsSettings.Get('term_backlog_max')
+        self.scrollback.SetCapacity(glsSettings.Get('term_scrollback'))
+        self.UpdateScrollbar()
         if self.SetFont():
             self.OnSize()
         self.SetBackgroundColour(self.color_bg)
         self.Refresh()
-        wx.YieldIfNeeded()
         return
     def OnSetFocus(self, event=None):
         self.terminal.SetFocus(True)
         self.Refresh()
         self.SetCurrent()
-        wx.YieldIfNeeded()
         return
     def OnKillFocus(self, event):
         self.terminal.SetFocus(False)
         self.Refresh()
-        wx.YieldIfNeeded()
         return
     def SearchSelectionFiles(self):
         text = self.GetSelectedText()
@@ -388,6 +749,8 @@ class glsTerminalPanel(wx.Window):
             self.ZoomIn()
         elif id == glsTermPanelPopupMenu.ID_FONT_DOWN:
             self.ZoomOut()
+        elif id == glsTermPanelPopupMenu.ID_FIND:
+            self.ShowFind()
         return
     def WriteClipboard(self, text):
         if wx.TheClipboard.Open():
@@ -402,24 +765,92 @@ class glsTerminalPanel(wx.Window):
         if success:
             return text_data.GetText()
         return None
-    def GetSelectedText(self):
+    def SetWordChars(self, word_chars):
+        self.word_chars = word_chars
+        if word_chars:
+            self.word_re = re.compile('[%s]+'%(re.escape(word_chars)))
+        else:
+            self.word_re = re.compile('(?!)')
+        return
+    def GetSelection(self):
+        # Ordered (start, end) of the selection, or None.
         if (self.sel_start is None or self.sel_end is None or
             self.sel_start == self.sel_end):
             return None
-        text = ""
-        screen, rend = self.GetScrolledScreen()
-        start = self.sel_start[0]*self.cols + self.sel_start[1]
-        end   = self.sel_end[0]*self.cols + self.sel_end[1]
-        max_ndx = self.rows*self.cols - 1
-        start = min(max(start, 0), max_ndx)
-        end = min(max(end, 0), max_ndx)
-        if start > end:
-            start, end = end, start
-        for i in range(start, end):
-            row, col = divmod(i, self.cols)
-            if row < len(screen) and col < len(screen[row]):
-                text += screen[row][col]
-        return text
+        return min(self.sel_start, self.sel_end), max(self.sel_start, self.sel_end)
+    def GetLineTexts(self, first, last):
+        # Texts and wrapped flags of the absolute lines first to last, from the
+        # history and the screen. Returns the first line found, which is later
+        # than first if older lines are no longer kept.
+        total = self.scrollback.total
+        oldest = self.scrollback.GetFirst()
+        first = max(first, oldest)
+        texts = []
+        wrapped = []
+        for index in range(first - oldest, min(last + 1, total) - oldest):
+            text, wrap = self.scrollback.GetText(index)
+            texts.append(text)
+            wrapped.append(wrap)
+        if self.snapshot is not None:
+            screen = self.snapshot['screen']
+            screen_wrapped = self.snapshot['wrapped']
+        else:
+            screen = self.terminal.GetScreen()
+            screen_wrapped = self.terminal.GetLineWrapped()
+        for row in range(max(first - total, 0), min(last + 1 - total, len(screen))):
+            texts.append(screen[row].tounicode())
+            wrapped.append(screen_wrapped[row])
+        return first, texts, wrapped
+    def GetSelectedText(self):
+        # Lines end with a newline and lose their trailing blanks, unless they
+        # are soft-wrapped.
+        selection = self.GetSelection()
+        if selection is None:
+            return None
+        start, end = selection
+        first, texts, wrapped = self.GetLineTexts(start[0], end[0])
+        parts = []
+        for line, text, wrap in zip(range(first, first + len(texts)), texts, wrapped):
+            if line == end[0]:
+                parts.append(text[:end[1]] if line != start[0] else text[start[1]:end[1]])
+                break
+            if line == start[0]:
+                text = text[start[1]:]
+            if wrap:
+                parts.append(text)
+            else:
+                parts.append(text.rstrip(u' '))
+                parts.append(u'\n')
+        return ''.join(parts)
+    def GetWordAt(self, line, col):
+        # (start, end) of the word of word_chars at a position, or None.
+        first, texts, wrapped = self.GetLineTexts(line - self.word_lines,
+                                                  line + self.word_lines)
+        index = line - first
+        if index < 0 or index >= len(texts) or col >= len(texts[index]):
+            return None
+        low = index
+        while low > 0 and wrapped[low - 1]:
+            low -= 1
+        high = index
+        while high < len(texts) - 1 and wrapped[high]:
+            high += 1
+        starts = []
+        length = 0
+        for text in texts[low:high + 1]:
+            starts.append(length)
+            length += len(text)
+        offset = starts[index - low] + col
+        for match in self.word_re.finditer(''.join(texts[low:high + 1])):
+            if match.start() > offset:
+                break
+            if match.end() > offset:
+                row = bisect_right(starts, match.start()) - 1
+                start = (first + low + row, match.start() - starts[row])
+                row = bisect_right(starts, match.end() - 1) - 1
+                end = (first + low + row, match.end() - starts[row])
+                return start, end
+        return None
     def Copy(self):
         text = self.GetSelectedText()
         if text is not None:
@@ -432,11 +863,13 @@ class glsTerminalPanel(wx.Window):
             return
         self.terminal.PasteText(text)
         self.Refresh()
-        wx.YieldIfNeeded()
         return
     def PointToCursor(self, point):
-        return ( max(min(int(point[1]/self.char_h),self.rows),0),
-                 max(min(int(point[0]/self.char_w),self.cols),0) )
+        # Absolute (line, col) under a point.
+        self.UpdateScroll()
+        row = max(min(int(point[1]/self.char_h),self.rows),0)
+        col = max(min(int(point[0]/self.char_w),self.cols),0)
+        return (self.scrollback.total - self.scroll + row, col)
     def OnMiddleDown(self, event):
         self.Paste()
         return
@@ -445,10 +878,15 @@ class glsTerminalPanel(wx.Window):
         self.SetFocus()
         self.left_down = True
         self.left_down_time = datetime.now()
-        self.sel_start = self.PointToCursor(event.GetPosition())
-        self.sel_end = self.sel_start
+        if wx.WXK_SHIFT in self.keys_down and self.sel_start is not None:
+            # Shift+click extends the selection, also into the scrollback.
+            self.sel_extend = True
+            self.sel_end = self.PointToCursor(event.GetPosition())
+        else:
+            self.sel_extend = False
+            self.sel_start = self.PointToCursor(event.GetPosition())
+            self.sel_end = self.sel_start
         self.Refresh()
-        wx.YieldIfNeeded()
         return
     def OnLeftUp(self, event):
         self.left_down = False
@@ -456,59 +894,31 @@ class glsTerminalPanel(wx.Window):
             self.dbl_click = False
             return
         self.sel_end = self.PointToCursor(event.GetPosition())
-        if (self.sel_start == self.sel_end or
-            (datetime.now()-self.left_down_time).total_seconds() < self.select_delay):
+        if (self.sel_start == self.sel_end or (not self.sel_extend and
+            (datetime.now()-self.left_down_time).total_seconds() < self.select_delay)):
             self.sel_start = None
             self.sel_end = None
         else:
             self.selected = self.Copy()
         self.Refresh()
-        wx.YieldIfNeeded()
         return
     def OnLeftDouble(self, event):
         self.SetCurrent()
-        row, col = self.PointToCursor(event.GetPosition())
-        screen, rend = self.GetScrolledScreen()
-        if row >= len(screen) or col >= len(screen[row]):
-            return
-        if screen[row][col] not in self.word_chars:
+        word = self.GetWordAt(*self.PointToCursor(event.GetPosition()))
+        if word is None:
             self.sel_start = None
             self.sel_end = None
             return
-        start = row*self.cols + col
-        sel_start = row, col
-        for i in reversed(range(0,start)):
-            r, c = divmod(i, self.cols)
-            if row < len(screen) and col < len(screen[row]):
-                if screen[r][c] not in self.word_chars:
-                    break
-                else:
-                    sel_start = r, c
-        self.sel_start = sel_start
-        sel_end = row, col+1
-        for i in range(start,self.rows*self.cols):
-            r, c = divmod(i, self.cols)
-            if row < len(screen) and col < len(screen[row]):
-                if screen[r][c] not in self.word_chars:
-                    break
-                else:
-                    sel_end = r, c+1
-        self.sel_end = sel_end
+        self.sel_start, self.sel_end = word
         self.dbl_click = True
-        if self.sel_start == self.sel_end:
-            self.sel_start = None
-            self.sel_end = None
-        else:
-            self.selected = self.Copy()
+        self.selected = self.Copy()
         self.Refresh()
-        wx.YieldIfNeeded()
         return
     def OnMove(self, event):
-        if (self.left_down and
-            (datetime.now()-self.left_down_time).total_seconds() > self.select_delay):
+        if (self.left_down and (self.sel_extend or
+            (datetime.now()-self.left_down_time).total_seconds() > self.select_delay)):
             self.sel_end = self.PointToCursor(event.GetPosition())
             self.Refresh()
-            wx.YieldIfNeeded()
         return
     def OnRightDown(self, event):
         self.SetCurrent()
@@ -520,7 +930,7 @@ class glsTerminalPanel(wx.Window):
         return
     def ScrollToEnd(self):
         self.scrollbar.SetThumbPosition(self.scrollbar.GetRange())
-        self.scrollbar.Refresh()
+        glsRepaint.Invalidate(self.scrollbar)
         self.Refresh()
         return
     def OnWheel(self, event):
@@ -540,126 +950,179 @@ class glsTerminalPanel(wx.Window):
             else:
                 for i in range(self.scroll_delta):
                     self.SendText(self.key_press.special_key_map[wx.WXK_UP], True)
-        self.scrollbar.Refresh()
+        glsRepaint.Invalidate(self.scrollbar)
         self.Refresh()
         return
     def GetColors(self, fgndx, bgndx):
-        if self.color_en:
-            if fgndx == 0:
-                fgcolor = self.color_fg
-            else:
-                fgcolor = self.COLORS_256[fgndx]
-            if bgndx == 0:
-                bgcolor = self.color_bg
-            else:
-                bgcolor = self.COLORS_256[bgndx]
+        # Indices 256 and up are truecolor palette entries.
+        if fgndx < 256:
+            fgcolor = self.palette_fg[fgndx]
+        elif self.color_en:
+            fgcolor = self.terminal.GetTrueColor(fgndx - 256)
         else:
             fgcolor = self.color_fg
+        if bgndx < 256:
+            bgcolor = self.palette_bg[bgndx]
+        elif self.color_en:
+            bgcolor = self.terminal.GetTrueColor(bgndx - 256)
+        else:
             bgcolor = self.color_bg
-        if abs(sum(np.subtract(fgcolor, bgcolor))) < 64:
-            fgcolor = tuple(np.subtract((255, 255, 255), fgcolor))
+        if abs(sum(fgcolor) - sum(bgcolor)) < 64:
+            fgcolor = (255 - fgcolor[0], 255 - fgcolor[1], 255 - fgcolor[2])
         return fgcolor, bgcolor
-    def SetTextStyle(self, dc, cur_style, style, fgcolor, bgcolor):
-        if cur_style != style:
-            self.fontinfo = wx.FontInfo(self.font_size).FaceName(self.font_name)
-            if style & self.terminal.RENDITION_STYLE_UNDERLINE:
-                self.fontinfo = self.fontinfo.Underlined()
-            if style & self.terminal.RENDITION_STYLE_BOLD:
-                self.fontinfo = self.fontinfo.Bold()
+    def GetRenderState(self, rend):
+        # (font, fgcolor, pen, brush) to draw a rendition with.
+        state = self.render_states.get(rend)
+        if state is None:
+            if len(self.render_states) >= self.render_states_max:
+                self.render_states.clear()
+            fgndx = ((rend>>16) & 255) | (rend & 0x100)
+            bgndx = ((rend>>24) & 255) | ((rend & 0x200) >> 1)
+            style = rend & 0xff
+            fgcolor, bgcolor = self.GetColors(fgndx, bgndx)
             if style & self.terminal.RENDITION_STYLE_INVERSE:
                 fgcolor, bgcolor = bgcolor, fgcolor
-            self.font = wx.Font(self.fontinfo)
-            dc.SetFont(self.font)
-            dc.SetTextForeground(fgcolor)
-            self.SetTextBGColor(dc, None, bgcolor)
-        return style
-    def SetTextFGColor(self, dc, cur_fgcolor, fgcolor):
-        if cur_fgcolor != fgcolor:
-            dc.SetTextForeground(fgcolor)
-        return fgcolor
-    def SetTextBGColor(self, dc, cur_bgcolor, bgcolor):
-        if cur_bgcolor != bgcolor:
-            self.pen = wx.Pen(bgcolor)
-            dc.SetPen(self.pen)
-            self.brush = wx.Brush(bgcolor)
-            dc.SetBrush(self.brush)
-        return bgcolor
+            font = self.fonts[(bool(style & self.terminal.RENDITION_STYLE_BOLD),
+                               bool(style & self.terminal.RENDITION_STYLE_UNDERLINE))]
+            state = (font, fgcolor, self.GetPen(bgcolor), self.GetBrush(bgcolor))
+            self.render_states[rend] = state
+        return state
+    def SetRenderState(self, dc, cur_state, state):
+        if cur_state is None or cur_state[0] is not state[0]:
+            dc.SetFont(state[0])
+        if cur_state is None or cur_state[1] != state[1]:
+            dc.SetTextForeground(state[1])
+        if cur_state is None or cur_state[2] is not state[2]:
+            dc.SetPen(state[2])
+            dc.SetBrush(state[3])
+        return state
     def DrawText(self, dc, text, row, col):
         dc.DrawRectangle(col*self.char_w, row*self.char_h,
                          len(text)*self.char_w, self.char_h)
         dc.DrawText(text, col*self.char_w, row*self.char_h)
         return
     def GetScrolledScreen(self):
-        screen = self.terminal.GetScreen()
-        rendition = self.terminal.GetRendition()
+        if self.snapshot is not None:
+            screen = self.snapshot['screen']
+            rendition = self.snapshot['rendition']
+        else:
+            screen = self.terminal.GetScreen()
+            rendition = self.terminal.GetRendition()
         scroll = self.scroll
         if scroll > 0 and scroll < self.rows:
-            screen = self.scrolled_text[-scroll:] + screen[:-scroll]
-            rendition = self.scrolled_rendition[-scroll:] + rendition[:-scroll]
+            count = len(self.scrollback)
+            texts, renditions = self.scrollback.GetLines(count - scroll, count,
+                                                         self.cols)
+            screen = texts + screen[:-scroll]
+            rendition = renditions + rendition[:-scroll]
         elif scroll >= self.rows:
-            start = len(self.scrolled_text) - scroll
-            end = start + self.rows
-            screen = self.scrolled_text[start:end]
-            rendition = self.scrolled_rendition[start:end]
+            start = len(self.scrollback) - scroll
+            screen, rendition = self.scrollback.GetLines(start, start + self.rows,
+                                                         self.cols)
         return screen, rendition
-    def DrawScreen(self, dc):
+    def DrawScreen(self, dc, rows):
+        # Rows already in dc_buffer are skipped, the others are copied from
+        # the row cache; () is the key of a blank row below the screen.
         screen, rendition = self.GetScrolledScreen()
-        cur_style = 0
-        cur_fgcolor_ndx = 0
-        cur_bgcolor_ndx = 0
-        cur_fgcolor, cur_bgcolor = self.GetColors(cur_fgcolor_ndx, cur_bgcolor_ndx)
-        self.SetTextStyle(dc, None, cur_style, cur_fgcolor, cur_bgcolor)
-        for row in range(len(screen)):
-            col_start = 0
-            text = ""
-            for col in range(min(len(screen[row]),self.cols)):
-                rend = rendition[row][col]
-                style = rend & 0x0000ffff
-                fgcolor_ndx = (rend>>16) & 255
-                bgcolor_ndx = (rend>>24) & 255
-                if (cur_style != style or
-                    cur_fgcolor_ndx != fgcolor_ndx or
-                    cur_bgcolor_ndx != bgcolor_ndx):
-                    self.DrawText(dc, text, row, col_start)
-                    col_start = col
-                    text = ""
-                    fgcolor, bgcolor = self.GetColors(fgcolor_ndx, bgcolor_ndx)
-                    cur_style   = self.SetTextStyle(dc, cur_style, style, fgcolor, bgcolor)
-                    cur_fgcolor = self.SetTextFGColor(dc, cur_fgcolor, fgcolor)
-                    cur_bgcolor = self.SetTextBGColor(dc, cur_bgcolor, bgcolor)
-                    cur_fgcolor_ndx = fgcolor_ndx
-                    cur_bgcolor_ndx = bgcolor_ndx
-                text += screen[row][col]
-            self.DrawText(dc, text, row, col_start)
-        return
-    def DrawCursor(self, dc):
+        for row in rows:
+            if row >= len(screen) or row >= self.rows:
+                if self.row_keys.get(row) != ():
+                    dc.SetPen(self.GetPen(self.color_bg))
+                    dc.SetBrush(self.GetBrush(self.color_bg))
+                    dc.DrawRectangle(0, row*self.char_h, self.Size[0], self.char_h)
+                    self.row_keys[row] = ()
+                continue
+            text = screen[row]
+            if not isinstance(text, str):
+                text = text.tounicode()
+            rends = rendition[row]
+            key = (text, rends.tobytes() if isinstance(rends, array) else bytes(array('L', rends)))
+            if self.row_keys.get(row) == key:
+                continue
+            dc.DrawBitmap(self.GetRowBitmap(key, text, rends), 0, row*self.char_h)
+            self.row_keys[row] = key
+        return
+    def GetRowBitmap(self, key, text, rends):
+        bitmap = self.row_cache.get(key)
+        if bitmap is not None:
+            self.row_cache.move_to_end(key)
+            return bitmap
+        bitmap = wx.Bitmap(self.Size[0], self.char_h)
+        dc = wx.MemoryDC(bitmap)
+        dc.SetPen(self.GetPen(self.color_bg))
+        dc.SetBrush(self.GetBrush(self.color_bg))
+        dc.DrawRectangle(0, 0, self.Size[0], self.char_h)
+        cur_state = None
+        cols = min(len(text), self.cols)
+        col_start = 0
+        cur_rend = None
+        for col in range(cols):
+            rend = rends[col]
+            if rend != cur_rend:
+                if col > col_start:
+                    self.DrawText(dc, text[col_start:col], 0, col_start)
+                col_start = col
+                cur_rend = rend
+                cur_state = self.SetRenderState(dc, cur_state, self.GetRenderState(rend))
+        if cols > col_start:
+            self.DrawText(dc, text[col_start:cols], 0, col_start)
+        del dc
+        self.row_cache[key] = bitmap
+        while len(self.row_cache) > self.row_cache_screens*max(self.rows, 1):
+            self.row_cache.popitem(last=False)
+        return bitmap
+    def ShiftBuffer(self):
+        # When the view moved by less than a screen since the last paint, the
+        # rows still visible are moved in dc_buffer with one blit; all rows are
+        # then damaged, but only the new ones differ from row_keys.
+        top = self.scrollback.total - self.scroll
+        shift = top - self.paint_top if self.paint_top is not None else 0
+        self.paint_top = top
+        if shift == 0:
+            return False
+        if abs(shift) < self.rows and self.rows*self.char_h <= self.dc_buffer.GetHeight():
+            height = (self.rows - abs(shift))*self.char_h
+            bitmap = self.dc_buffer.GetSubBitmap(wx.Rect(0, max(shift, 0)*self.char_h,
+                                                         self.Size[0], height))
+            dc = wx.MemoryDC(self.dc_buffer)
+            dc.DrawBitmap(bitmap, 0, max(-shift, 0)*self.char_h)
+            del dc
+            self.row_keys = { row - shift: key for row, key in self.row_keys.items()
+                              if 0 <= row - shift < self.rows }
+        else:
+            self.row_keys = {}
+        return True
+    def GetCursorCell(self):
+        # Screen (row, col) of the visible cursor, or None.
         if (not self.modes[self.terminal.MODE_DECTCEM] or
             self.cursor_style == self.terminal.CURSOR_STYLE_INVISIBLE):
-            return
+            return None
         if self.scroll >= self.rows:
-            return
+            return None
         new_cr = min(max(self.cursor_pos[0], 0), self.rows-1)
         new_cc = min(max(self.cursor_pos[1], 0), self.cols-1)
         self.cursor_pos = (new_cr, new_cc)
-        cursor_pos = [new_cr + self.scroll, new_cc]
-        if cursor_pos[0] >= self.rows:
+        if new_cr + self.scroll >= self.rows:
+            return None
+        return (new_cr + self.scroll, new_cc)
+    def DrawCursor(self, dc):
+        cursor_pos = self.GetCursorCell()
+        if cursor_pos is None:
             return
+        # Rows under the cursor and selection are no longer clean in dc_buffer.
+        self.row_keys.pop(cursor_pos[0], None)
         if self.HasFocus():
-            self.pen = wx.Pen((0,255,0,175))
-            self.brush = wx.Brush((0,255,0))
+            dc.SetPen(self.GetPen((0,255,0,175)))
+            dc.SetBrush(self.GetBrush((0,255,0)))
         else:
-            self.pen = wx.Pen((255,128,0,128))
-            self.brush = wx.Brush((255,128,0))
-        dc.SetBrush(self.brush)
-        dc.SetPen(self.pen)
+            dc.SetPen(self.GetPen((255,128,0,128)))
+            dc.SetBrush(self.GetBrush((255,128,0)))
         if (self.cursor_style == self.terminal.CURSOR_STYLE_DEFAULT or
             self.cursor_style == self.terminal.CURSOR_STYLE_BLOCK):
             dc.DrawRectangle(cursor_pos[1]*self.char_w, cursor_pos[0]*self.char_h,
                              self.char_w, self.char_h)
             screen, rend = self.GetScrolledScreen()
-            self.fontinfo = wx.FontInfo(self.font_size).FaceName(self.font_name).Bold()
-            self.font = wx.Font(self.fontinfo)
-            dc.SetFont(self.font)
+            dc.SetFont(self.fonts[(True, False)])
             dc.SetTextForeground((0,0,0))
             dc.DrawText(screen[cursor_pos[0]][cursor_pos[1]],
                         cursor_pos[1]*self.char_w, cursor_pos[0]*self.char_h)
@@ -670,42 +1133,95 @@ class glsTerminalPanel(wx.Window):
             dc.DrawRectangle(cursor_pos[1]*self.char_w, (cursor_pos[0]+1)*self.char_h-2,
                              self.char_w, 2)
         return
+    def GetSelectionRects(self):
+        # Selected cells as (col, row, count) spans of the visible rows.
+        selection = self.GetSelection()
+        if selection is None:
+            return []
+        start, end = selection
+        top = self.scrollback.total - self.scroll
+        rects = []
+        for row in range(max(start[0] - top, 0), min(end[0] - top, self.rows - 1) + 1):
+            line = top + row
+            col_start = start[1] if line == start[0] else 0
+            col_end = end[1] if line == end[0] else self.cols
+            rects.append( (col_start, row, col_end - col_start) )
+        return rects
     def DrawSelection(self, dc):
-        if self.sel_start is not None and self.sel_end is not None:
-            self.pen = wx.Pen((0,0,0), style=wx.TRANSPARENT)
-            dc.SetPen(self.pen)
-            self.brush = wx.Brush((255,255,0,64))
-            dc.SetBrush(self.brush)
-            start = self.sel_start
-            end   = self.sel_end
-            if start[0]*self.cols+start[1] > end[0]*self.cols+end[1]:
-                start, end = end, start
-            cend = end[1] if start[0] == end[0] else self.cols
-            dc.DrawRectangle(start[1]*self.char_w, start[0]*self.char_h,
-                             (cend-start[1])*self.char_w, self.char_h)
-            for rmid in range(1,max(end[0]-start[0],0)):
-                dc.DrawRectangle(0, (start[0]+rmid)*self.char_h,
-                                 self.cols*self.char_w, self.char_h)
-            if end[0]-start[0] > 0:
-                dc.DrawRectangle(0, (end[0])*self.char_h,
-                                 end[1]*self.char_w, self.char_h)
+        dc.SetPen(wx.TRANSPARENT_PEN)
+        dc.SetBrush(self.GetBrush((255,255,0,64)))
+        for col, row, count in self.GetSelectionRects():
+            self.row_keys.pop(row, None)
+            dc.DrawRectangle(col*self.char_w, row*self.char_h,
+                             count*self.char_w, self.char_h)
+        return
+    def GetDamagedRows(self):
+        # Rows intersecting the update region of the current paint event.
+        rows = set()
+        region = wx.RegionIterator(self.GetUpdateRegion())
+        while region.HaveRects():
+            rect = region.GetRect()
+            first = max(rect.y // self.char_h, 0)
+            last = (rect.y + rect.height - 1) // self.char_h
+            rows.update(range(first, last + 1))
+            region.Next()
+        return sorted(rows)
+    def RefreshRows(self, rows):
+        # Invalidate terminal screen rows, merging adjacent rows into one rectangle.
+        spans = []
+        for row in rows:
+            row += self.scroll
+            if row < 0 or row >= self.rows:
+                continue
+            if spans and spans[-1][1] == row - 1:
+                spans[-1][1] = row
+            else:
+                spans.append([row, row])
+        width = self.Size[0] - self.scrollbar_w
+        for first, last in spans:
+            self.RefreshRect(wx.Rect(0, first*self.char_h, width,
+                                     (last - first + 1)*self.char_h), False)
         return
     def OnPaint(self, event):
-        # Draw with double buffering.
+        # Draw with double buffering; only damaged rows are redrawn, the rest
+        # of the buffer is kept from previous paints.
+        if self.gl_canvas is not None:
+            dc = wx.PaintDC(self)
+            return
+        self.UpdateScroll()
+        if self.ShiftBuffer():
+            rows = list(range((self.Size[1] + self.char_h - 1) // self.char_h))
+        else:
+            rows = self.GetDamagedRows()
         dc = wx.MemoryDC()
         dc.SelectObject(self.dc_buffer)
-        dc.Clear()
-        dc.SetPen(wx.Pen(self.color_bg))
-        dc.SetBrush(wx.Brush(self.color_bg))
-        dc.DrawRectangle(0, 0, self.Size[0], self.Size[1])
-        scroll = self.scrollbar.GetRange() - self.rows - self.scrollbar.GetThumbPosition()
-        self.scroll = scroll
-        self.DrawScreen(dc)
+        clip = wx.Region()
+        for row in rows:
+            clip.Union(0, row*self.char_h, self.Size[0], self.char_h)
+        dc.SetDeviceClippingRegion(clip)
+        self.DrawScreen(dc, rows)
         self.DrawCursor(dc)
         self.DrawSelection(dc)
+        dc.DestroyClippingRegion()
         del dc
         dc = wx.BufferedPaintDC(self, self.dc_buffer)
         return
+    def UpdateScroll(self):
+        self.scroll = self.scrollbar.GetRange() - self.rows - self.scrollbar.GetThumbPosition()
+        return
+    def Refresh(self, eraseBackground=True, rect=None):
+        # Repaints are coalesced by glsRepaint; the GL renderer always redraws
+        # the whole screen. SetVisible() repaints everything when shown.
+        if not self.visible:
+            return
+        if self.gl_canvas is not None:
+            glsRepaint.Invalidate(self.gl_canvas)
+        else:
+            glsRepaint.Invalidate(self, rect)
+        return
+    def RefreshRect(self, rect, eraseBackground=True):
+        self.Refresh(eraseBackground, rect)
+        return
     def UpdateScrollbar(self, new_lines=0):
         self.scrollbar.SetSize(self.Size[0]-self.scrollbar_w, 0, self.scrollbar_w,
                                self.Size[1])
@@ -713,46 +1229,205 @@ class glsTerminalPanel(wx.Window):
         if scroll and not self.scroll_outp:
             new_lines = 0
         self.scrollbar.SetScrollbar(self.scrollbar.GetThumbPosition() + new_lines,
-                                    self.rows, self.rows + len(self.scrolled_text),
+                                    self.rows, self.rows + len(self.scrollback),
                                     self.scrollbar_w, refresh=True)
-        self.scrollbar.Refresh()
+        glsRepaint.Invalidate(self.scrollbar)
         self.Refresh()
         return
     def OnScroll(self, event):
         self.SetCurrent()
-        self.scrollbar.Refresh()
+        glsRepaint.Invalidate(self.scrollbar)
         self.Refresh()
-        wx.YieldIfNeeded()
         return
     def OnSize(self, event=None):
-        self.rows = int((self.Size[1]) / self.char_h)
-        self.cols = int((self.Size[0]-self.scrollbar_w) / self.char_w)
+        # Resize buffer for painting.
+        self.dc_buffer = wx.Bitmap(*self.Size)
+        self.ClearRowCache()
+        if self.gl_canvas is not None:
+            self.gl_canvas.SetSize(0, 0, self.Size[0]-self.scrollbar_w, self.Size[1])
         self.UpdateScrollbar()
-        # Update terminal size.
-        rows, cols = self.terminal.GetSize()
-        if rows != self.rows or cols != self.cols:
-            self.terminal.Resize(self.rows, self.cols)
+        self.PlaceFindBar()
+        # Defer the terminal resize until the size settles.
+        if self.resize_timer is None:
+            self.resize_timer = wx.CallLater(self.resize_delay, self.ApplySize)
+        else:
+            self.resize_timer.Start(self.resize_delay)
+        return
+    def ApplySize(self):
+        if not self:
+            return
+        rows = int((self.Size[1]) / self.char_h)
+        cols = int((self.Size[0]-self.scrollbar_w) / self.char_w)
+        if (rows, cols) == self.terminal.GetSize():
+            return
+        at_end = self.scroll == 0
+        with self.term_lock:
+            self.rows = rows
+            self.cols = cols
+            # Reflow the terminal together with the scroll history.
+            if self.threaded:
+                self.TakeSnapshots()
+            # Only lines that can move between history and screen are taken.
+            history = self.scrollback.GetHistory(max(rows, self.terminal.GetSize()[0]))
+            count = len(history[0])
+            self.terminal.Resize(self.rows, self.cols, history)
+            self.scrollback.SetHistory(*history, count)
+            if self.threaded:
+                self.snapshot = self.BuildSnapshot()
         fcntl.ioctl(self.io, termios.TIOCSWINSZ,
                     struct.pack("hhhh", self.rows, self.cols, 0, 0))
         # Deselect.
         self.sel_start = None
         self.sel_end = None
-        # Resize buffer for painting.
-        self.dc_buffer = wx.Bitmap(*self.Size)
-        self.scrollbar.Refresh()
+        self.UpdateScrollbar()
+        if at_end:
+            self.ScrollToEnd()
+        # Reflow renumbers the lines, so find again.
+        if self.find_bar is not None and self.find_bar.IsShown():
+            self.find_bar.OnFind(None)
+        glsRepaint.Invalidate(self.scrollbar)
         self.Refresh()
         return
+    def ScheduleIndex(self):
+        if self.index_timer is None and self.scrollback.IndexPending():
+            self.index_timer = wx.CallLater(self.index_gap, self.IndexScrollback)
+        return
+    def IndexScrollback(self):
+        self.index_timer = None
+        if not self:
+            return
+        if self.scrollback.UpdateIndex(monotonic() + self.frame_budget):
+            self.index_timer = wx.CallLater(self.index_gap, self.IndexScrollback)
+        return
+    def ShowFind(self):
+        if self.find_bar is None:
+            self.find_bar = glsTermFindBar(self, self.FindStart, self.FindNext, self.HideFind)
+        self.find_bar.Show()
+        self.find_bar.Raise()
+        self.PlaceFindBar()
+        text = self.GetSelectedText()
+        if text is not None and "\n" not in text:
+            self.find_bar.SetText(text)
+        self.find_bar.Focus()
+        return
+    def HideFind(self):
+        self.FindStop()
+        self.find_bar.Hide()
+        self.SetFocus()
+        return
+    def PlaceFindBar(self):
+        if self.find_bar is None or not self.find_bar.IsShown():
+            return
+        width, height = self.find_bar.GetBestSize()
+        self.find_bar.SetSize(max(self.Size[0] - self.scrollbar_w - width, 0), 0,
+                              width, height)
+        return
+    def FindStop(self):
+        self.find_serial += 1
+        self.find_search = None
+        self.find_results = []
+        self.find_current = -1
+        return
+    def FindStart(self, text, case, regx):
+        self.FindStop()
+        if text == "":
+            self.find_bar.SetCount("")
+            return
+        flags = re.MULTILINE if case else re.MULTILINE | re.IGNORECASE
+        try:
+            pattern = re.compile(text if regx else re.escape(text), flags)
+        except re.error:
+            self.find_bar.SetCount("Bad Pattern")
+            return
+        # The screen is searched at once; its rows get the line numbers they
+        # will have once scrolled off.
+        if self.snapshot is not None:
+            screen = self.snapshot['screen']
+        else:
+            screen = self.terminal.GetScreen()
+        line = self.scrollback.total
+        for row in reversed(range(len(screen))):
+            matches = [ (line + row, match.start(), match.end() - match.start())
+                        for match in pattern.finditer(screen[row].tounicode())
+                        if match.end() > match.start() ]
+            self.find_results.extend(reversed(matches))
+        bits = () if regx else self.scrollback.FindGrams(text, case)
+        self.find_search = self.scrollback.Find(pattern, bits)
+        self.FindStep(self.find_serial)
+        return
+    def FindStep(self, serial):
+        if not self or serial != self.find_serial:
+            return
+        deadline = monotonic() + self.frame_budget
+        for result in self.find_search:
+            if result is not None:
+                self.find_results.append(result)
+            elif monotonic() > deadline:
+                break
+        else:
+            self.find_search = None
+        if self.find_current < 0 and self.find_results:
+            self.FindShow(0)
+        else:
+            self.FindCount()
+        if self.find_search is not None:
+            wx.CallLater(self.frame_gap, self.FindStep, serial)
+        return
+    def FindNext(self, older=True):
+        if not self.find_results:
+            return
+        current = self.find_current + (1 if older else -1)
+        self.FindShow(min(max(current, 0), len(self.find_results) - 1))
+        return
+    def FindShow(self, current):
+        # Scrolls a match into view and selects it.
+        self.find_current = current
+        self.FindCount()
+        line, col, length = self.find_results[current]
+        count = len(self.scrollback)
+        index = line - self.scrollback.GetFirst()
+        if index < 0:
+            return
+        row = index - count + self.scroll
+        if row < 0 or row >= self.rows:
+            self.scroll = min(max(count - index + self.rows//2, 0), count)
+            self.scrollbar.SetThumbPosition(self.scrollbar.GetRange() - self.rows - self.scroll)
+        self.sel_start = (line, col)
+        self.sel_end = (line, col + length)
+        self.selected = self.GetSelectedText()
+        glsRepaint.Invalidate(self.scrollbar)
+        self.Refresh()
+        return
+    def FindCount(self):
+        if self.find_results:
+            text = "%d of %d"%(self.find_current + 1, len(self.find_results))
+        elif self.find_search is None:
+            text = "No Matches"
+        else:
+            text = ""
+        if self.find_search is not None:
+            text += "..."
+        self.find_bar.SetCount(text)
+        return
     def SendText(self, text, user=True):
         if user and self.scroll_keyp:
             self.ScrollToEnd()
         if text is None or text == "":
             return
-        os.write(self.io, bytes(text,'utf-8'))
+        data = memoryview(bytes(text,'utf-8'))
+        while data:
+            try:
+                data = data[os.write(self.io, data):]
+            except BlockingIOError:
+                select.select([], [ self.io ], [])
         return
     def OnChar(self, event):
         return
     def OnKeyDown(self, event):
         key = event.GetKeyCode()
+        if key == ord('F') and event.ControlDown() and event.ShiftDown():
+            self.ShowFind()
+            return
         self.keys_down[key] = True
         seq = self.key_press.KeyCodeToSequence(key)
         self.SendText(seq, True)
@@ -764,38 +1439,31 @@ class glsTerminalPanel(wx.Window):
             del self.keys_down[event.GetKeyCode()]
         event.Skip()
         return
-    def OnTermScrollUpScreen(self):
-        if not self:
-            return
-        text = "".join(self.terminal.GetScreen()[0])
-        rendition = self.terminal.GetRendition()[0]
-        rend = array('L')
-        for c in range(self.cols):
-            rend.append(rendition[c])
-        if len(self.scrolled_text) >= self.max_scroll_history:
-            self.scrolled_text.pop(0)
-            self.scrolled_rendition.pop(0)
-        self.scrolled_text.append(text)
-        self.scrolled_rendition.append(rend)
-        self.UpdateScrollbar(new_lines=1)
-        return
-    def OnTermUpdateLines(self):
-        if not self:
-            return
-        self.Refresh()
-        text = self.GetSelectedText()
-        if text != self.selected and self.left_down == False:
-            self.sel_start = None
-            self.sel_end = None
-            self.selected = None
-        wx.YieldIfNeeded()
+    def AddScrolledLines(self, lines):
+        # Lines scrolled off the screen during one ProcessInput(), oldest first.
+        for text, rendition, wrapped in lines:
+            self.scrollback.Append(text, rendition, wrapped)
+        self.scrolled_new += len(lines)
+        return
+    def OnWorkerScrollUpLines(self, lines):
+        # The lines are added to the history with the next snapshot.
+        self.worker_scrolled.extend(lines)
+        return
+    def OnTermUpdateLines(self, rows):
+        # Collected until the end of the frame.
+        self.damaged_rows.update(rows)
+        return
+    def OnWorkerUpdateLines(self, rows):
+        self.worker_damaged.update(rows)
         return
     def OnTermUpdateCursorPos(self):
-        if not self:
-            return
-        self.cursor_pos = self.terminal.GetCursorPos()
-        self.Refresh()
-        wx.YieldIfNeeded()
+        self.UpdateCursorPos(self.terminal.GetCursorPos())
+        return
+    def UpdateCursorPos(self, cursor_pos):
+        if cursor_pos != self.cursor_pos:
+            self.damaged_rows.add(self.cursor_pos[0])
+            self.damaged_rows.add(cursor_pos[0])
+            self.cursor_pos = cursor_pos
         return
     def OnTermUpdateWindowTitle(self, title):
         if not self:
@@ -830,24 +1498,28 @@ class glsTerminalPanel(wx.Window):
         evt = glsEvents.TabTitle(id=wx.ID_ANY, title=title, terminal=self)
         wx.PostEvent(self.Parent, evt)
         return
-    def OnChildOutputThreadExit(self, event):
-        if self.child_output_notifier_thread is not None:
-            self.child_output_notifier_thread.join()
-            self.child_output_notifier_thread = None
+    def OnChildExit(self, event):
         if not self.notified_parent_closed:
             evt = glsEvents.TabClose(wx.ID_ANY, terminal=self)
             wx.PostEvent(self.Parent, evt)
             self.notified_parent_closed = True
         return
+    def StopWorker(self):
+        if self.threaded:
+            self.worker_stop = True
+            self.worker_wake.set()
+        return
     def OnClose(self, event=None):
-        self.stop_output_notifier = True
+        glsReactor.Unregister(self.io)
+        self.StopWorker()
+        self.scrollback.Close()
         glsSettings.RemoveWatcher(self.OnChangeSettings)
         return
     def OnDestroy(self, event):
-        self.stop_output_notifier = True
+        glsReactor.Unregister(self.io)
+        self.StopWorker()
+        self.scrollback.Close()
         glsSettings.RemoveWatcher(self.OnChangeSettings)
-        if self.child_output_notifier_thread is not None:
-            self.child_output_notifier_thread.join()
         return
 
 ################################################################
@@ -870,6 +1542,7 @@ class glsTermNotebook(wx.Window):
         self.image_list.Add(glsIcons.Get('error'))
         self.notebook = wx.Notebook(self)
         self.notebook.SetImageList(self.image_list)
+        self.notebook.Bind(wx.EVT_NOTEBOOK_PAGE_CHANGED, self.OnChangeTab)
         self.tabs = []
         self.OnNewTerm()
         box_main.Add(self.notebook, 1, wx.EXPAND)
@@ -883,6 +1556,7 @@ class glsTermNotebook(wx.Window):
         self.notebook.AddPage(terminal, " Terminal " + str(len(self.tabs)))
         self.notebook.ChangeSelection(len(self.tabs)-1)
         self.notebook.SetPageImage(len(self.tabs)-1, self.ICON_TERM)
+        self.UpdateVisible()
         return terminal
     def CloseTerminal(self, terminal):
         if terminal is None:
@@ -893,6 +1567,7 @@ class glsTermNotebook(wx.Window):
                 self.notebook.SendSizeEvent()
                 self.tabs.remove(self.tabs[i])
         self.AddPlaceHolder()
+        self.UpdateVisible()
         return
     def OnTermClose(self, event):
         self.CloseTerminal(event.terminal)
@@ -911,6 +1586,17 @@ class glsTermNotebook(wx.Window):
     def OnTermCurrent(self, event):
         self.SetCurrent(True)
         return
+    def OnChangeTab(self, event):
+        self.UpdateVisible()
+        event.Skip()
+        return
+    def UpdateVisible(self):
+        # Only the terminal of the selected tab paints.
+        current = self.notebook.GetSelection()
+        for i,t in enumerate(self.tabs):
+            if isinstance(t, glsTerminalPanel):
+                t.SetVisible(i == current)
+        return
     def RemovePlaceHolder(self):
         if len(self.tabs) != 1 or not isinstance(self.tabs[0], glsPlaceHolder):
             return
@@ -965,6 +1651,7 @@ class glsTermsPanel(wx.Window):
     ID_ZOOM_IN     = 1009
     ID_ZOOM_OUT    = 1010
     ID_EXIT        = 1011
+    ID_FIND        = 1012
     def __init__(self, parent, min_term_size, callback_layout):
         style = wx.SIMPLE_BORDER | wx.WANTS_CHARS
         super(glsTermsPanel, self).__init__(parent,style=style)
@@ -984,6 +1671,7 @@ class glsTermsPanel(wx.Window):
                   (self.ID_SEARCH_FILE, "Search Files", 'magnifier', self.OnToolSearchFiles),
                   (self.ID_SEARCH_CNTS, "Search Contents", 'magnifier_zoom_in',
                    self.OnToolSearchContents),
+                  (self.ID_FIND, "Find in Terminal", 'zoom_in', self.OnToolFind),
                   (self.ID_COPY, "Copy", 'page_copy', self.OnToolCopy),
                   (self.ID_PASTE, "Paste", 'page_paste', self.OnToolPaste),
                   (self.ID_ZOOM_OUT, "Zoom Out", 'font_delete', self.OnToolZoomOut),
@@ -1031,6 +1719,11 @@ class glsTermsPanel(wx.Window):
         if term is not None:
             term.SearchSelectionContents()
         return
+    def OnToolFind(self, event):
+        term = self.GetCurrentTerm()
+        if term is not None:
+            term.ShowFind()
+        return
     def OnToolPaste(self, event):
         term = self.GetCurrentTerm()
         if term is not None: